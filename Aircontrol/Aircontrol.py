@@ -1,17 +1,46 @@
 from MyMQTT import MyMQTT
+from dispatcher import room_key
 import json
+import senml
 import time
 import requests
+from urllib.parse import urlencode
+
+# Retained device documents published by the catalog on every change
+CATALOG_DEVICES_TOPIC = "catalog/devices/+"
+# Actuator resource -> key of its state in a room, and the messages when it changed or not
+ACTUATOR_STATES = {
+    "windows": (
+        "window_status",
+        "Window {action} for room {room_id}",
+        "Windows state unchanged: the windows are already in state {action} or the room is closed"
+    ),
+    "ventilation": (
+        "ventilation_status",
+        "Ventilation {action} for room {room_id}",
+        "Ventilation state unchanged: the ventilation is already in state {action}"
+    )
+}
 
 class AirControlManager:
-    def __init__(self, clientID, catalog_ip, catalog_port, weatherAdaptor_url):
+    def __init__(self, clientID, catalog_ip, catalog_port, weatherAdaptor_url, mqtt_settings=None, client=None):
         self.clientID = clientID
         self.catalog_ip = catalog_ip
         self.catalog_port = catalog_port
         self.weatherAdaptor_url = weatherAdaptor_url
-        self._get_broker()
         self.rooms = {}
-        self.client = MyMQTT(clientID, self.broker, self.port, self)
+        # catalog roomID -> "building/floor/number" key of self.rooms
+        self.room_keys = {}
+        # deviceID -> (room key, restIP) of the actuators in use
+        self.actuators = {}
+        # url -> (etag, data) of the last catalog responses
+        self.catalog_cache = {}
+        # client: an MQTT client already set up, e.g. the AsyncMQTT of Aircontrol_async.py
+        if client is None:
+            self._get_broker()
+            # Every subscription has its route, no notifier
+            client = MyMQTT(clientID, self.broker, self.port, None, mqtt_settings)
+        self.client = client
 
         self.eaqi_thresholds = {
             "PM2.5": [10, 20, 25, 50],
@@ -34,29 +63,61 @@ class AirControlManager:
             self.broker = "localhost"
             self.port = 1883
 
-    def notify(self, topic, msg):
+    def _get_catalog_json(self, path, params=None):
+        """GET a catalog resource, reusing the cached body when the catalog answers 304 Not Modified."""
+        url, headers = self.catalog_request(path, params)
+        response = requests.get(url, headers=headers)
+        if response.status_code == 304 and url in self.catalog_cache:
+            return self.catalog_cache[url][1]
+        response.raise_for_status()
+        return self.catalog_cached(url, response.headers, response.json())
+
+    def catalog_request(self, path, params=None):
+        """URL of a catalog resource, and the headers to revalidate its cached body."""
+        url = f"http://{self.catalog_ip}:{self.catalog_port}/{path}"
+        if params:
+            url += "?" + urlencode(params)
+        cached = self.catalog_cache.get(url)
+        return url, {"If-None-Match": cached[0]} if cached else {}
+
+    def catalog_cached(self, url, headers, data):
+        if "ETag" in headers:
+            self.catalog_cache[url] = (headers["ETag"], data)
+        return data
+
+    def on_pollutants(self, topic, msg):
         try:
-            data = json.loads(json.loads(msg))
-            print(f"Message received on topic {topic}: {data}", flush=True)
-            parts = topic.split("/")
-
-            if "pollutants" in topic:
-                room_id = "/".join(parts[1:4]) if len(parts) >= 5 else None
-                if room_id:
-                    if room_id not in self.rooms:
-                        self.add_room(room_id)
-                    room = self.rooms[room_id]
-
-                    for entry in data['e']:
-                        pollutant = entry['n']
-                        if pollutant in room["latest_values"]:
-                            room["latest_values"][pollutant] = entry['v']
-
-                    self.make_decision(room_id)
+            print(f"Message received on topic {topic}: {msg}", flush=True)
+            room_id = self.room_of(topic)
+            if room_id:
+                if room_id not in self.rooms:
+                    self.add_room(room_id)
+                self.update_values(room_id, msg)
+                self.make_decision(room_id)
         except Exception as e:
             print(f"Error processing message: {e}")
 
+    def room_of(self, topic):
+        """"building/floor/number" key of the room of a pollutants topic, None for the other topics."""
+        parts = topic.split("/")
+        if "pollutants" not in topic or len(parts) < 5:
+            return None
+        return "/".join(parts[1:4])
+
+    def update_values(self, room_id, msg):
+        room = self.rooms[room_id]
+        for record in senml.records(msg):
+            if record.name in room["latest_values"]:
+                room["latest_values"][record.name] = record.value
+
     def add_room(self, room_id):
+        self.init_room(room_id)
+        for room in self._get_catalog_json("rooms", self.rooms_query(room_id)):
+            for device in self._get_catalog_json("devices", self.devices_query(room_id, room["roomID"])):
+                self.set_actuators(room_id, device)
+        print(f"Added room {room_id} : {self.rooms[room_id]}", flush=True)
+
+    def init_room(self, room_id):
         self.rooms[room_id] = {
             "latest_values": {pollutant: 0 for pollutant in self.eaqi_thresholds.keys()},
             "window_status": "Closed",
@@ -64,27 +125,60 @@ class AirControlManager:
             "windows_actuator_ip": None,
             "ventilation_actuator_ip": None
         }
-      
-        response = requests.get(f"http://{self.catalog_ip}:{self.catalog_port}/rooms")
-        rooms = response.json()
+
+    def rooms_query(self, room_id):
+        """Parameters of GET /rooms for the catalog ID of a room."""
         building, floor, room_number = room_id.split("/")
-        for room in rooms:
-            if room["buildingName"] == building and str(room["floor"]) == floor and str(room["number"]) == room_number:
-                # iterate through the endpoints of the room to find the actuators ips
-                for deviceId in room["devices"]:
-                    response = requests.get(f"http://{self.catalog_ip}:{self.catalog_port}/devices/{deviceId}")
-                    device = response.json()
-                    # check if the device has the available resources and set the actuators ips
-                    if "windows" in device["availableResources"]:
-                        self.rooms[room_id]["windows_actuator_ip"] = device["endpoints"]["rest"]["restIP"]
-                    if "ventilation" in device["availableResources"]:
-                        self.rooms[room_id]["ventilation_actuator_ip"] = device["endpoints"]["rest"]["restIP"]
+        return {"building": building, "floor": floor, "number": room_number, "fields": "roomID"}
 
-        print(f"Added room {room_id} : {self.rooms[room_id]}", flush=True)
+    def devices_query(self, room_id, catalog_room_id):
+        """
+        Remember the catalog ID of a room, to follow the changes of its devices, and return the
+        parameters of GET /devices with only the fields needed to find the actuators ips.
+        """
+        self.room_keys[catalog_room_id] = room_id
+        return {"roomID": catalog_room_id, "fields": "deviceID,availableResources,endpoints"}
+
+    def set_actuators(self, room_id, device):
+        # check if the device has the available resources and set the actuators ips
+        if "rest" not in device["endpoints"]:
+            return
+        rest_ip = device["endpoints"]["rest"]["restIP"]
+        for resource in ("windows", "ventilation"):
+            if resource in device["availableResources"]:
+                self.rooms[room_id][f"{resource}_actuator_ip"] = rest_ip
+                self.actuators[device["deviceID"]] = (room_id, rest_ip)
+
+    def clear_actuators(self, device_id):
+        room_id, rest_ip = self.actuators.pop(device_id, (None, None))
+        if room_id is None:
+            return
+        for resource in ("windows", "ventilation"):
+            if self.rooms[room_id][f"{resource}_actuator_ip"] == rest_ip:
+                self.rooms[room_id][f"{resource}_actuator_ip"] = None
+
+    def on_device_change(self, topic, msg):
+        """Keep the actuators ips of the known rooms in sync with the catalog change feed."""
+        if not msg:
+            # Retained message cleared after a deletion
+            return
+        try:
+            device = msg["item"]
+            self.clear_actuators(device["deviceID"])
+            room_id = self.room_keys.get(device["roomID"])
+            if msg["event"] in ("create", "update") and room_id in self.rooms:
+                self.set_actuators(room_id, device)
+            print(f"Device {device['deviceID']} {msg['event']}, room {room_id}", flush=True)
+        except Exception as e:
+            print(f"Error processing catalog change: {e}")
 
     def startSim(self):
         self.client.start()
-        self.client.mySubscribe("/+/+/+/pollutants")
+        # make_decision calls the weather adaptor and the actuators: the rooms are handled in
+        # parallel by the workers of the dispatcher, in order within a room
+        self.client.route("/+/+/+/pollutants", self.on_pollutants, key=room_key)
+        # One worker for the device changes, to apply them in order
+        self.client.route(CATALOG_DEVICES_TOPIC, self.on_device_change, key=lambda topic: "", workers=1)
         print("Subscribed to pollutant topics")
 
     def stopSim(self):
@@ -103,9 +197,13 @@ class AirControlManager:
             return {}
 
     def make_decision(self, room_id):
-        room = self.rooms[room_id]
         weather_data = self.get_weather_data()
+        window_action, ventilation_action = self.decide(self.rooms[room_id], weather_data)
+        self.control(room_id, "windows", window_action)
+        self.control(room_id, "ventilation", ventilation_action)
 
+    def decide(self, room, weather_data):
+        """Window and ventilation states of a room for its latest values and the current weather."""
         overall_index = max([
             self.determine_eaqi_level(pollutant, value)
             for pollutant, value in room["latest_values"].items()
@@ -117,27 +215,22 @@ class AirControlManager:
 
         # Decision Logic
         if overall_index > 3:
-            self.control_window(room_id, "Closed")
-            self.control_ventilation(room_id, "On")
+            return "Closed", "On"
         elif precipitation > 0 or temperature > 30:
-            self.control_window(room_id, "Closed")
             if wind_speed > 15:
-                self.control_ventilation(room_id, "Boost") 
+                return "Closed", "Boost"
             else:
-                self.control_ventilation(room_id, "On")
+                return "Closed", "On"
         elif wind_speed > 10 and overall_index <= 3:
             if 90 <= wind_direction <= 270:  
-                self.control_window(room_id, "Open")
-                self.control_ventilation(room_id, "Off")
+                return "Open", "Off"
             else:
-                self.control_window(room_id, "Closed")
-                self.control_ventilation(room_id, "On")
+                return "Closed", "On"
         else:
             if overall_index <= 2:
-                self.control_window(room_id, "Slightly_Open") 
+                return "Slightly_Open", "On"
             else:
-                self.control_window(room_id, "Closed")
-            self.control_ventilation(room_id, "On")
+                return "Closed", "On"
 
     def determine_eaqi_level(self, pollutant, value):
         thresholds = self.eaqi_thresholds.get(pollutant, [])
@@ -146,21 +239,21 @@ class AirControlManager:
                 return index + 1
         return 5 
 
-    def control_window(self, room_id, action):
-        response = requests.put(f"{self.rooms[room_id]['windows_actuator_ip']}/windows", params={"state": action})
-        if response.status_code == 200:
-            print(f"Window {action} for room {room_id}", flush=True)
-            self.rooms[room_id]["window_status"] = action
-        else:
-            print(f"Windows state unchanged: the windows are already in state {action} or the room is closed", flush=True)
+    def control(self, room_id, resource, action):
+        response = requests.put(self.actuator_url(room_id, resource), params={"state": action})
+        self.actuated(room_id, resource, action, response.status_code)
+
+    def actuator_url(self, room_id, resource):
+        return f"{self.rooms[room_id][f'{resource}_actuator_ip']}/{resource}"
 
-    def control_ventilation(self, room_id, action):
-        response = requests.put(f"{self.rooms[room_id]['ventilation_actuator_ip']}/ventilation", params={"state": action})
-        if response.status_code == 200:
-            print(f"Ventilation {action} for room {room_id}", flush=True)
-            self.rooms[room_id]["ventilation_status"] = action
+    def actuated(self, room_id, resource, action, status):
+        """Update the state of an actuator of a room after its PUT answered status."""
+        state_key, changed, unchanged = ACTUATOR_STATES[resource]
+        if status == 200:
+            print(changed.format(action=action, room_id=room_id), flush=True)
+            self.rooms[room_id][state_key] = action
         else:
-            print(f"Ventilation state unchanged: the ventilation is already in state {action}", flush=True)
+            print(unchanged.format(action=action), flush=True)
 
 if __name__ == "__main__":
     with open("config-aircontrol.json", "r") as file:
@@ -171,7 +264,7 @@ if __name__ == "__main__":
     weatherAdaptor_url = config["weatherAdaptor"]["url"]
     clientId = config["mqttInfos"]["clientId"]
 
-    air_control_manager = AirControlManager(clientId, catalog_ip, catalog_port, weatherAdaptor_url)
+    air_control_manager = AirControlManager(clientId, catalog_ip, catalog_port, weatherAdaptor_url, config["mqttInfos"])
     air_control_manager.startSim()
 
     try:
@@ -0,0 +1,95 @@
+import json
+
+import aio
+from aio import AsyncMQTT, HttpClient
+from Aircontrol import AirControlManager, CATALOG_DEVICES_TOPIC
+from dispatcher import room_key
+
+# AirControlManager on the asyncio runtime of common/aio.py: the catalog, the weather adaptor and
+# the actuators are called with one pooled HTTP client, so the rooms waiting for them do not hold
+# a thread each. Usage: python3 Aircontrol_async.py, in place of Aircontrol.py
+
+
+class AsyncAirControlManager(AirControlManager):
+    """The decisions of AirControlManager, with coroutines for the HTTP calls."""
+
+    def __init__(self, clientID, catalog_ip, catalog_port, weatherAdaptor_url, client, http):
+        super().__init__(clientID, catalog_ip, catalog_port, weatherAdaptor_url, client=client)
+        self.http = http
+
+    async def _get_catalog_json(self, path, params=None):
+        """GET a catalog resource, reusing the cached body when the catalog answers 304 Not Modified."""
+        url, headers = self.catalog_request(path, params)
+        status, response_headers, body = await self.http.request("GET", url, headers=headers)
+        if status == 304 and url in self.catalog_cache:
+            return self.catalog_cache[url][1]
+        if status != 200:
+            raise RuntimeError(f"GET {path} answered {status}")
+        return self.catalog_cached(url, response_headers, json.loads(body))
+
+    async def on_pollutants(self, topic, msg):
+        try:
+            print(f"Message received on topic {topic}: {msg}", flush=True)
+            room_id = self.room_of(topic)
+            if room_id:
+                if room_id not in self.rooms:
+                    await self.add_room(room_id)
+                self.update_values(room_id, msg)
+                await self.make_decision(room_id)
+        except Exception as e:
+            print(f"Error processing message: {e}", flush=True)
+
+    async def add_room(self, room_id):
+        self.init_room(room_id)
+        for room in await self._get_catalog_json("rooms", self.rooms_query(room_id)):
+            for device in await self._get_catalog_json("devices", self.devices_query(room_id, room["roomID"])):
+                self.set_actuators(room_id, device)
+        print(f"Added room {room_id} : {self.rooms[room_id]}", flush=True)
+
+    def startSim(self):
+        self.client.start()
+        # One task per room, the rooms waiting for the HTTP calls concurrently
+        self.client.route("/+/+/+/pollutants", self.on_pollutants, key=room_key)
+        # One task for the device changes, to apply them in order
+        self.client.route(CATALOG_DEVICES_TOPIC, self.on_device_change, key=lambda topic: "")
+        print("Subscribed to pollutant topics", flush=True)
+
+    async def get_weather_data(self):
+        try:
+            return await self.http.get_json(self.weatherAdaptor_url)
+        except Exception as e:
+            print(f"Error fetching weather data: {e}", flush=True)
+            return {}
+
+    async def make_decision(self, room_id):
+        weather_data = await self.get_weather_data()
+        window_action, ventilation_action = self.decide(self.rooms[room_id], weather_data)
+        await self.control(room_id, "windows", window_action)
+        await self.control(room_id, "ventilation", ventilation_action)
+
+    async def control(self, room_id, resource, action):
+        status, _, _ = await self.http.request("PUT", self.actuator_url(room_id, resource), params={"state": action})
+        self.actuated(room_id, resource, action, status)
+
+
+async def main(stopped):
+    with open("config-aircontrol.json", "r") as file:
+        config = json.load(file)
+
+    catalog_ip = config["catalog"]["ip"]
+    catalog_port = config["catalog"]["port"]
+    weatherAdaptor_url = config["weatherAdaptor"]["url"]
+    clientId = config["mqttInfos"]["clientId"]
+
+    async with HttpClient(config.get("http")) as http:
+        broker, port = await aio.get_broker(http, catalog_ip, catalog_port, ("localhost", 1883))
+        client = AsyncMQTT(clientId, broker, port, None, config["mqttInfos"])
+        air_control_manager = AsyncAirControlManager(clientId, catalog_ip, catalog_port, weatherAdaptor_url, client, http)
+        air_control_manager.startSim()
+        await stopped.wait()
+        await client.stop()
+        print("Stopping", flush=True)
+
+
+if __name__ == "__main__":
+    aio.run(main)
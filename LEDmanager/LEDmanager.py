@@ -1,15 +1,21 @@
 import json
 import requests
 import time
+import senml
 from MyMQTT import MyMQTT
+from dispatcher import room_key
 
 class LightManager:
-    def __init__(self, clientID, catalog_ip, catalog_port):
+    def __init__(self, clientID, catalog_ip, catalog_port, mqtt_settings=None, client=None):
         self.clientID = clientID
         self.catalog_ip = catalog_ip
         self.catalog_port = catalog_port
-        self._get_broker()
-        self.client = MyMQTT(clientID, self.broker, self.port, self)
+        # client: an MQTT client already set up, e.g. the AsyncMQTT of LEDmanager_async.py
+        if client is None:
+            self._get_broker()
+            # Every subscription has its route, no notifier
+            client = MyMQTT(clientID, self.broker, self.port, None, mqtt_settings)
+        self.client = client
         self.rooms = {} 
         # Define color mappings (in RGB format)
         # EAQI 1: green, 2: yellow, 3: orange, 4: red, 5: dark purple
@@ -44,10 +50,9 @@ class LightManager:
             self.broker = "localhost"
             self.port = 1883 
 
-    def notify(self, topic, msg):
+    def on_pollutants(self, topic, msg):
         try:
-            data = json.loads(json.loads(msg))
-            print(f"Message received on topic {topic}: {data}", flush=True)
+            print(f"Message received on topic {topic}: {msg}", flush=True)
             parts = topic.split("/")
             room_id = "/".join(parts[:4]) if len(parts) >= 4 else None 
 
@@ -55,10 +60,9 @@ class LightManager:
                 if room_id not in self.rooms:
                     self.add_room(room_id) 
                 room = self.rooms[room_id]
-                for entry in data['e']:
-                    pollutant = entry['n']
-                    if pollutant in room["latest_values"]:
-                        room["latest_values"][pollutant] = entry['v']
+                for record in senml.records(msg):
+                    if record.name in room["latest_values"]:
+                        room["latest_values"][record.name] = record.value
                 color, eaqi_value = self.determine_led_color_and_eaqi(room["latest_values"])
                 room["current_color"] = color
                 self.publish_led(room_id, color)
@@ -75,7 +79,7 @@ class LightManager:
 
     def startSim(self):
         self.client.start()
-        self.client.mySubscribe("/+/+/+/pollutants") 
+        self.client.route("/+/+/+/pollutants", self.on_pollutants, key=room_key)
         print("Subscribed to all pollutant topics", flush=True)
 
     def stopSim(self):
@@ -118,7 +122,7 @@ class LightManager:
             'bt': time.time(),
             'e': [{'n': 'status', 'u': 'rgb', 'v': color}]
         }
-        self.client.myPublish(topic_publish, json.dumps(message))
+        self.client.myPublish(topic_publish, message)
         print(f"LED color {color} published for room {room_id} at {topic_publish}", flush=True)
 
     def publish_eaqi(self, room_id, eaqi_value):
@@ -128,7 +132,7 @@ class LightManager:
             'bt': time.time(),
             'e': [{'n': 'aqi', 'u': 'score', 'v': eaqi_value}]
         }
-        self.client.myPublish(topic_publish, json.dumps(message))
+        self.client.myPublish(topic_publish, message)
         print(f"EAQI value {eaqi_value} published for room {room_id} at {topic_publish}", flush=True)
 
 if __name__ == "__main__":
@@ -137,7 +141,7 @@ if __name__ == "__main__":
     catalog_ip = config["catalog"]["ip"]
     catalog_port = config["catalog"]["port"]
     clientId = config["mqttInfos"]["clientId"]
-    light_manager = LightManager(clientId, catalog_ip, catalog_port)
+    light_manager = LightManager(clientId, catalog_ip, catalog_port, config["mqttInfos"])
     
     light_manager.startSim()
     try:
@@ -0,0 +1,31 @@
+import json
+
+import aio
+from aio import AsyncMQTT, HttpClient
+from LEDmanager import LightManager
+
+# LightManager on the asyncio runtime of common/aio.py: the rooms are handled in one task each on
+# the event loop, which also reads and writes the MQTT socket.
+# Usage: python3 LEDmanager_async.py, in place of LEDmanager.py
+
+
+async def main(stopped):
+    with open("config-ledmanager.json", "r") as file:
+        config = json.load(file)
+    catalog_ip = config["catalog"]["ip"]
+    catalog_port = config["catalog"]["port"]
+    clientId = config["mqttInfos"]["clientId"]
+
+    async with HttpClient(config.get("http")) as http:
+        broker, port = await aio.get_broker(http, catalog_ip, catalog_port, ("localhost", 1883))
+    client = AsyncMQTT(clientId, broker, port, None, config["mqttInfos"])
+    light_manager = LightManager(clientId, catalog_ip, catalog_port, client=client)
+
+    light_manager.startSim()
+    await stopped.wait()
+    await client.stop()
+    print("Stopping", flush=True)
+
+
+if __name__ == "__main__":
+    aio.run(main)
@@ -18,13 +18,14 @@ class ActuatorsConnector:
         
         self._get_broker()
         self._get_opening_hours()
-        self.mqtt_client = MyMQTT(self.config['mqttInfos']['clientId'], self.brokerIp, self.brokerPort, self)
+        self.mqtt_client = MyMQTT(
+            self.config['mqttInfos']['clientId'], self.brokerIp, self.brokerPort, self, self.config['mqttInfos']
+        )
         self.mqtt_client.start()
         self.mqtt_client.mySubscribe(self.config['mqttInfos']['basename']+"/LED")
         self._post_device()
 
-    def notify(self, topic, payload):
-        msg = json.loads(json.loads(payload))
+    def notify(self, topic, msg):
         print(f"Received message on topic {topic}")
         if(topic == self.config['mqttInfos']['basename']+"/LED"):
             self.led_rgb = msg['e'][0]['v']
@@ -62,20 +63,16 @@ class ActuatorsConnector:
         response = requests.post(f"http://{self.catalog_ip}:{self.catalog_port}/devices", json=body)
         self.device_id = response.json()["deviceID"]   
 
-    def _put_device(self):
-        # Update device at the catalog
-        body = {
-            "ip": self.config["ip"],
-            "port": self.config["port"],
-            "endpoints": self.config["endpoints"],
-            "availableResources": self.config["availableResources"],
-            "roomID": self.config["roomID"],
-        }
-        response = requests.put(f"http://{self.catalog_ip}:{self.catalog_port}/devices/{self.device_id}", json=body)
+    def _heartbeat(self):
+        # Refresh the device liveness at the catalog, registering it again if it expired
+        response = requests.post(f"http://{self.catalog_ip}:{self.catalog_port}/devices/{self.device_id}/heartbeat")
+        if response.status_code == 404:
+            print("Device expired at the catalog, registering it again", flush=True)
+            self._post_device()
 
     def periodically_register_device_and_close_windows(self):
         while not self.thread_stop.is_set():
-            self._put_device()
+            self._heartbeat()
             # Close the windows if the room is closed
             if(self.isRoomClosed() and self.windows_state != "Closed"):
                 self.windows_state = "Closed"
@@ -100,7 +97,7 @@ class ActuatorsConnector:
         if(actuator == "ventilation"):
             msg['e'][0]['n'] = "ventilation"
             msg['e'][0]['v'] = self.ventilation_state
-        self.mqtt_client.myPublish(self.config['mqttInfos']['basename']+"/"+actuator, json.dumps(msg))
+        self.mqtt_client.myPublish(self.config['mqttInfos']['basename']+"/"+actuator, msg)
 
     def setActuator(self, actuator, state):
         if(actuator == "windows"):
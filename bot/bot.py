@@ -23,6 +23,27 @@ ACTUATORS_URL = config.get("ACTUATORS_URL")
 ################################################################################
 # Helpers 
 
+# url -> (etag, data) of the last Catalog responses
+ETAG_CACHE = {}
+
+def get_json_cached(url, timeout=5):
+    """
+    GET a JSON resource with a conditional request (If-None-Match).
+    Returns (response, data): when the server answers 304 the cached data is reused,
+    data is None if the request failed.
+    """
+    cached = ETAG_CACHE.get(url)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    resp = requests.get(url, headers=headers, timeout=timeout)
+    if resp.status_code == 304 and cached:
+        return resp, cached[1]
+    if resp.status_code != 200:
+        return resp, None
+    data = resp.json()
+    if "ETag" in resp.headers:
+        ETAG_CACHE[url] = (resp.headers["ETag"], data)
+    return resp, data
+
 def compose_room_label(building, floor, number):
     """ 'A', 1, 1 => 'A101' """
     floor_str = str(floor)
@@ -108,9 +129,8 @@ class AirQualityBot:
         self.room_map.clear()
         self.inverse_room_map.clear()
         try:
-            resp = requests.get(f"{CATALOG_URL}/rooms", timeout=5)
-            if resp.status_code == 200:
-                rooms_list = resp.json()
+            resp, rooms_list = get_json_cached(f"{CATALOG_URL}/rooms")
+            if rooms_list is not None:
                 for r in rooms_list:
                     building = r["buildingName"]
                     floor = r["floor"]
@@ -282,34 +302,31 @@ class AirQualityBot:
 
         # 1) Attempt direct device data from Catalog (optional)
         try:
-            r = requests.get(f"{CATALOG_URL}/rooms/{room_id}", timeout=5)
+            # The room comes with its device documents in a single request
+            r = requests.get(f"{CATALOG_URL}/rooms/{room_id}", params={"expand": "devices"}, timeout=5)
             if r.status_code != 200:
                 self.bot.sendMessage(chat_id, f"❌ Error retrieving room data: {r.text}")
             else:
                 room_data = r.json()
-                device_ids = room_data.get("devices", [])
-                if device_ids:
+                devices = room_data.get("devices", [])
+                if devices:
                     sensor_reports = []
-                    for d_id in device_ids:
-                        dresp = requests.get(f"{CATALOG_URL}/devices/{d_id}", timeout=5)
-                        if dresp.status_code == 200:
-                            dev_info = dresp.json()
-                            resources = dev_info.get("availableResources", [])
-                            # Skip actuators
-                            if any(res.lower() in ["window", "ventilation"] for res in resources):
-                                continue
-                            rest_ip = dev_info["endpoints"]["rest"]["restIP"]
-                            try:
-                                aqi_resp = requests.get(f"{rest_ip}/aqi", timeout=5)
-                                if aqi_resp.status_code == 200:
-                                    data = aqi_resp.json()
-                                    sensor_reports.append(f"Device {d_id} => {json.dumps(data)}")
-                                else:
-                                    sensor_reports.append(f"Device {d_id} => /aqi error {aqi_resp.status_code}")
-                            except Exception as se:
-                                sensor_reports.append(f"Device {d_id} => REST error: {se}")
-                        else:
-                            sensor_reports.append(f"Device {d_id} not found in the Catalog")
+                    for dev_info in devices:
+                        d_id = dev_info["deviceID"]
+                        resources = dev_info.get("availableResources", [])
+                        # Skip actuators
+                        if any(res.lower() in ["window", "ventilation"] for res in resources):
+                            continue
+                        rest_ip = dev_info["endpoints"]["rest"]["restIP"]
+                        try:
+                            aqi_resp = requests.get(f"{rest_ip}/aqi", timeout=5)
+                            if aqi_resp.status_code == 200:
+                                data = aqi_resp.json()
+                                sensor_reports.append(f"Device {d_id} => {json.dumps(data)}")
+                            else:
+                                sensor_reports.append(f"Device {d_id} => /aqi error {aqi_resp.status_code}")
+                        except Exception as se:
+                            sensor_reports.append(f"Device {d_id} => REST error: {se}")
                     direct_data = "\n".join(sensor_reports) if sensor_reports else "No direct sensor data found."
                 else:
                     direct_data = "No devices found in room."
@@ -324,7 +341,8 @@ class AirQualityBot:
         latest_aqi = self._fetch_latest_from_tsdb("aqi", building, floor, number)
         latest_windows = self._fetch_latest_from_tsdb("windows", building, floor, number)
         latest_ventilation = self._fetch_latest_from_tsdb("ventilation", building, floor, number)
-        aqi_24h = self._fetch_range_from_tsdb("aqi", building, floor, number, "1d")
+        # 5 minute averages are enough for the plot, at most 288 points
+        aqi_24h = self._fetch_range_from_tsdb("aqi", building, floor, number, "1d", bucket="5m", agg="avg")
 
         # Build the textual report
         concentration_info = f"Current AQI: {latest_aqi}" if latest_aqi is not None else "No recent AQI data"
@@ -332,7 +350,7 @@ class AirQualityBot:
         ventilation_info = f"Ventilation state: {latest_ventilation}" if latest_ventilation is not None else "No recent ventilation data"
 
         if aqi_24h:
-            range_info = f"24h data: {len(aqi_24h)} records"
+            range_info = f"24h data: {len(aqi_24h)} points (5 min averages)"
         else:
             range_info = "No 24h AQI data"
 
@@ -356,13 +374,14 @@ class AirQualityBot:
     def _fetch_latest_from_tsdb(self, measure_type, building, floor, number):
 
         try:
-            url = f"{TIME_SERIES_DB_URL}/{measure_type}?building={building}&floor={floor}&room={number}"
-            resp = requests.get(url, timeout=5)
+            # Only the last row is sent back
+            url = f"{TIME_SERIES_DB_URL}/{measure_type}"
+            params = {"building": building, "floor": floor, "room": number, "latest": "true"}
+            resp = requests.get(url, params=params, timeout=5)
             if resp.status_code == 200:
                 data = resp.json()
                 if data:
-                    last_row = data[-1]
-                    return last_row.get("value")
+                    return data[0].get("value")
                 else:
                     return None
             else:
@@ -372,14 +391,15 @@ class AirQualityBot:
             print(f"[ERROR] _fetch_latest_from_tsdb({measure_type}, {building},{floor},{number}) => {e}")
             return None
 
-    def _fetch_range_from_tsdb(self, measure_type, building, floor, number, range_str):
+    def _fetch_range_from_tsdb(self, measure_type, building, floor, number, range_str, bucket=None, agg=None):
     
         try:
-            url = (
-                f"{TIME_SERIES_DB_URL}/{measure_type}"
-                f"?building={building}&floor={floor}&room={number}&range={range_str}"
-            )
-            resp = requests.get(url, timeout=5)
+            url = f"{TIME_SERIES_DB_URL}/{measure_type}"
+            params = {"building": building, "floor": floor, "room": number, "range": range_str}
+            if bucket:
+                # Aggregated by the adaptor: one row per bucket
+                params.update(bucket=bucket, agg=agg or "avg")
+            resp = requests.get(url, params=params, timeout=5)
             if resp.status_code == 200:
                 return resp.json()
             else:
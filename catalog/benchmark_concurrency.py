@@ -0,0 +1,184 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import cherrypy
+import requests
+
+# Stress test of the catalog: many clients register devices concurrently and then keep
+# heartbeating and updating them. At the end every registration and update must be found
+# both in memory and in the persisted state. A last check compacts the log in the middle of
+# a registration, which must be found after a restart.
+
+CLIENTS = 50
+DEVICES_PER_CLIENT = 20
+DURATION = 10
+PORT = 18080
+URL = f"http://127.0.0.1:{PORT}"
+
+
+def client(index, room_id, results):
+    try:
+        run_client(index, room_id, results)
+    except requests.RequestException as e:
+        print(f"Client {index} failed: {e}", flush=True)
+
+
+def run_client(index, room_id, results):
+    session = requests.Session()
+    device_ids = []
+    ops = 0
+    errors = 0
+    body = {
+        "ip": f"client-{index}",
+        "port": 8080,
+        "endpoints": {"rest": {"restIP": f"http://client-{index}:8080"}},
+        "availableResources": ["aqi"],
+        "roomID": room_id
+    }
+    for _ in range(DEVICES_PER_CLIENT):
+        response = session.post(f"{URL}/devices", json=body)
+        ops += 1
+        if response.status_code == 200:
+            device_ids.append(response.json()["deviceID"])
+        else:
+            errors += 1
+
+    # Heartbeat all devices and bump the port of one of them on each round
+    updates = {}
+    deadline = time.time() + DURATION
+    round_number = 0
+    while time.time() < deadline:
+        round_number += 1
+        for device_id in device_ids:
+            response = session.post(f"{URL}/devices/{device_id}/heartbeat")
+            ops += 1
+            errors += response.status_code != 200
+        device_id = device_ids[round_number % len(device_ids)]
+        response = session.put(f"{URL}/devices/{device_id}", json=dict(body, port=round_number))
+        ops += 1
+        if response.status_code == 200:
+            updates[device_id] = round_number
+        else:
+            errors += 1
+    results[index] = (device_ids, updates, ops, errors)
+
+
+def check(devices, rooms, room_id, results):
+    """Return the lost registrations and updates."""
+    devices = {device["deviceID"]: device for device in devices}
+    room_devices = set(next(room for room in rooms if room["roomID"] == room_id)["devices"])
+    lost = []
+    for device_ids, updates, _, _ in results.values():
+        for device_id in device_ids:
+            if device_id not in devices or device_id not in room_devices:
+                lost.append(("registration", device_id))
+        for device_id, port in updates.items():
+            if devices.get(device_id, {}).get("port") != port:
+                lost.append(("update", device_id))
+    return lost
+
+
+def check_compaction_during_write():
+    """
+    Register a device while the log is compacted between its append and the release of the
+    write locks, then reload the storage. Returns True if the device was lost on disk.
+    """
+    from registry import CatalogRegistry
+    from storage import JsonJournalStorage
+
+    # In its own directory, the snapshot files have fixed names
+    os.chdir(tempfile.mkdtemp(dir=os.getcwd()))
+    room = {"roomID": "room-1", "number": 1, "floor": 1, "buildingName": "A", "devices": []}
+    with open("rooms.json", "w") as file:
+        json.dump([room], file)
+    settings = {"logFile": "compaction.log", "compactEvery": 2}
+    storage = JsonJournalStorage(settings)
+    state = storage.load()
+    registry = CatalogRegistry(state["devices"], state["rooms"], state["users"])
+    storage.snapshot_provider = lambda: {
+        "devices": registry.list_devices_last_seen(),
+        "rooms": registry.list_rooms(),
+        "users": registry.list_users()
+    }
+    # Cache the views of before the write
+    registry.list_rooms()
+    registry.list_devices()
+
+    device = {"deviceID": "device-1", "ip": "x", "port": 8080, "endpoints": {},
+              "availableResources": ["aqi"], "roomID": "room-1"}
+    with registry.write("rooms", "devices"):
+        registry.add_device(device)
+        # Two records reach compactEvery: the compaction starts while the locks are held
+        storage.append([("put", "devices", "device-1", device), ("put", "rooms", "room-1", registry.get_room("room-1"))])
+        time.sleep(0.5)
+    while storage.compacting:
+        time.sleep(0.05)
+    storage.close()
+
+    persisted = JsonJournalStorage(settings).load()
+    os.chdir("..")
+    rooms = {room["roomID"]: room for room in persisted["rooms"]}
+    return (
+        not any(device["deviceID"] == "device-1" for device in persisted["devices"])
+        or "device-1" not in rooms["room-1"]["devices"]
+    )
+
+
+if __name__ == '__main__':
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, source_dir)
+    from catalog import CatalogService
+    from storage import create_storage
+
+    # Run the catalog in a scratch directory holding a copy of the seed files
+    work_dir = tempfile.mkdtemp()
+    for file_name in ["broker.json", "rooms.json", "users.json", "config-catalog.json"]:
+        shutil.copy(os.path.join(source_dir, file_name), work_dir)
+    os.chdir(work_dir)
+
+    service = CatalogService()
+    room_id = service.registry.list_rooms()[0]["roomID"]
+    cherrypy.tree.mount(service, '/', {'/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}})
+    cherrypy.config.update({
+        'server.socket_port': PORT,
+        'server.socket_host': '127.0.0.1',
+        'server.thread_pool': service.settings.get("threadPool", 10),
+        'server.socket_queue_size': CLIENTS,
+        'log.screen': False
+    })
+    cherrypy.engine.start()
+
+    results = {}
+    threads = [threading.Thread(target=client, args=(i, room_id, results)) for i in range(CLIENTS)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    in_memory = check(requests.get(f"{URL}/devices").json(), requests.get(f"{URL}/rooms").json(), room_id, results)
+
+    cherrypy.engine.exit()
+    service.thread_stop.set()
+    service.storage.close()
+
+    # Replay what was persisted on disk
+    persisted = create_storage(service.settings.get("storage")).load()
+    on_disk = check(persisted["devices"], persisted["rooms"], room_id, results)
+
+    lost_in_compaction = check_compaction_during_write()
+
+    ops = sum(r[2] for r in results.values())
+    errors = sum(r[3] for r in results.values()) + CLIENTS - len(results)
+    print(f"{CLIENTS} clients, {CLIENTS * DEVICES_PER_CLIENT} devices, {elapsed:.1f}s")
+    print(f"throughput: {ops / elapsed:.0f} requests/s, errors: {errors}")
+    print(f"lost in memory: {len(in_memory)}, lost on disk: {len(on_disk)}")
+    print(f"registration lost by a concurrent compaction: {lost_in_compaction}")
+    shutil.rmtree(work_dir)
+    os._exit(0 if not in_memory and not on_disk and not errors and not lost_in_compaction else 1)
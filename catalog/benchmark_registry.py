@@ -0,0 +1,70 @@
+import random
+import time
+import uuid
+
+from registry import CatalogRegistry
+
+# Number of lookups timed for every fleet size
+LOOKUPS = 20000
+DEVICES_PER_ROOM = 10
+
+
+def build_fleet(n_devices):
+    """Generate n_devices spread over rooms of DEVICES_PER_ROOM devices each."""
+    rooms = []
+    devices = []
+    n_rooms = max(1, n_devices // DEVICES_PER_ROOM)
+    for i in range(n_rooms):
+        rooms.append({
+            "roomID": str(uuid.uuid4()),
+            "number": i % 100,
+            "floor": (i // 100) % 10,
+            "buildingName": f"B{i // 1000}",
+            "openingHours": {"start": 8, "end": 18},
+            "coordinates": {"lat": 45.07, "lon": 7.67},
+            "devices": []
+        })
+    for i in range(n_devices):
+        room = rooms[i % n_rooms]
+        device = {
+            "deviceID": str(uuid.uuid4()),
+            "ip": "sensors",
+            "port": 8080,
+            "endpoints": {"rest": {"restIP": "http://sensors:8080"}},
+            "availableResources": ["aqi", "pollutants"],
+            "roomID": room["roomID"],
+            "insert-timestamp": "2025-01-01T12:00:00+00:00"
+        }
+        room["devices"].append(device["deviceID"])
+        devices.append(device)
+    return devices, rooms
+
+
+def time_per_call(func, keys):
+    start = time.perf_counter()
+    for key in keys:
+        func(key)
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def linear_get(devices):
+    # The lookup used by the catalog before the registry
+    return lambda device_id: next((d for d in devices if d["deviceID"] == device_id), None)
+
+
+if __name__ == '__main__':
+    print(f"{'devices':>8} {'get_device':>12} {'find_room':>12} {'devices_in_room':>16} {'linear scan':>12}  (us/op)")
+    for n_devices in [10, 100, 1000, 10000, 100000]:
+        devices, rooms = build_fleet(n_devices)
+        registry = CatalogRegistry(devices, rooms, [])
+
+        device_keys = [random.choice(devices)["deviceID"] for _ in range(LOOKUPS)]
+        room_keys = [random.choice(rooms) for _ in range(LOOKUPS)]
+
+        get_us = time_per_call(registry.get_device, device_keys)
+        find_us = time_per_call(lambda r: registry.find_room(r["buildingName"], r["floor"], r["number"]), room_keys)
+        in_room_us = time_per_call(lambda r: registry.devices_in_room(r["roomID"]), room_keys)
+        # The linear scan is only timed on a few lookups, it gets too slow at scale
+        linear_us = time_per_call(linear_get(devices), device_keys[:100])
+
+        print(f"{n_devices:>8} {get_us:>12.3f} {find_us:>12.3f} {in_room_us:>16.3f} {linear_us:>12.3f}")
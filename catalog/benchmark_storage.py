@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import time
+
+from benchmark_registry import build_fleet
+from storage import CatalogStorage, JsonJournalStorage, create_storage
+
+# Compares the storage backends of the catalog: startup load, single-item writes (one
+# request each), the room cascade delete and the size on disk. The full rewrite of a JSON
+# file on every write, used by the catalog before the log, is timed as a reference.
+
+UPDATES = 2000
+CASCADES = 100
+REWRITES = 10
+
+BACKENDS = {
+    "json": {"backend": "json", "logFile": "catalog.log", "fsyncInterval": 1, "compactEvery": 10 ** 9},
+    "sqlite": {"backend": "sqlite", "dbFile": "catalog.db"}
+}
+
+
+def write_seed(devices, rooms):
+    for name, items in (("devices", devices), ("rooms", rooms), ("users", [])):
+        JsonJournalStorage.write_json_atomic(CatalogStorage.COLLECTIONS[name][0], items)
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def disk_size():
+    return sum(os.path.getsize(name) for name in os.listdir(".")) / 1e6
+
+
+def run_backend(settings, devices, rooms):
+    storage = create_storage(settings)
+    first_load = timed(storage.load)
+    storage.close()
+    if settings["backend"] == "sqlite":
+        # The seed files were imported, only the database counts on disk
+        for name in ("devices.json", "rooms.json", "users.json"):
+            os.remove(name)
+
+    storage = create_storage(settings)
+    load = timed(storage.load)
+
+    def updates():
+        for i in range(UPDATES):
+            device = dict(devices[i % len(devices)], port=i)
+            storage.append([("put", "devices", device["deviceID"], device)])
+        storage.flush()
+
+    def cascades():
+        for room in rooms[:CASCADES]:
+            records = [("delete", "devices", device_id, None) for device_id in room["devices"]]
+            storage.append(records + [("delete", "rooms", room["roomID"], None)])
+        storage.flush()
+
+    update_us = timed(updates) / UPDATES * 1e6
+    cascade_us = timed(cascades) / CASCADES * 1e6
+    storage.close()
+    return first_load, load, update_us, cascade_us, disk_size()
+
+
+def run_rewrite(devices):
+    def rewrites():
+        for i in range(REWRITES):
+            devices[i % len(devices)] = dict(devices[i % len(devices)], port=i)
+            JsonJournalStorage.write_json_atomic("devices.json", devices)
+    return timed(rewrites) / REWRITES * 1e6
+
+
+if __name__ == '__main__':
+    print(f"{'devices':>8} {'backend':>8} {'first load':>11} {'load':>8} {'update':>10} {'cascade':>10} {'disk':>8}")
+    print(f"{'':>8} {'':>8} {'(s)':>11} {'(s)':>8} {'(us/op)':>10} {'(us/op)':>10} {'(MB)':>8}")
+    for n_devices in [1000, 10000, 100000]:
+        devices, rooms = build_fleet(n_devices)
+        for name, settings in BACKENDS.items():
+            work_dir = tempfile.mkdtemp()
+            os.chdir(work_dir)
+            write_seed(devices, rooms)
+            first_load, load, update_us, cascade_us, size = run_backend(settings, devices, rooms)
+            print(f"{n_devices:>8} {name:>8} {first_load:>11.3f} {load:>8.3f} {update_us:>10.1f} {cascade_us:>10.1f} {size:>8.2f}")
+            os.chdir("/")
+            shutil.rmtree(work_dir)
+
+        work_dir = tempfile.mkdtemp()
+        os.chdir(work_dir)
+        print(f"{n_devices:>8} {'rewrite':>8} {'':>11} {'':>8} {run_rewrite(list(devices)):>10.1f}")
+        os.chdir("/")
+        shutil.rmtree(work_dir)
@@ -5,14 +5,39 @@ import json
 import uuid
 import threading
 
+from registry import CatalogRegistry
+from storage import create_storage
+from response_cache import ResponseCache
+from query import param_list, parse_limit, paginate, project
+from changefeed import ChangeFeed, MQTTChangePublisher
+
 class CatalogService:
     exposed = True
 
     def __init__(self):
         self.broker = self.load_json("broker.json")
-        self.devices = self.load_json("devices.json")
-        self.users = self.load_json("users.json")
-        self.rooms = self.load_json("rooms.json")
+        self.settings = self.load_json("config-catalog.json") or {}
+
+        # Replay the persisted snapshot and mutation log into the registry
+        self.storage = create_storage(self.settings.get("storage"))
+        state = self.storage.load()
+        self.device_ttl = self.settings.get("deviceTTL", 120)
+        self.registry = CatalogRegistry(state["devices"], state["rooms"], state["users"], self.device_ttl)
+        self.storage.snapshot_provider = self.snapshot
+        self.response_cache = ResponseCache()
+
+        # Every change is recorded in the feed (GET /changes) and published to the broker
+        feed_settings = self.settings.get("changeFeed", {})
+        self.feed = ChangeFeed(feed_settings.get("retention", 10000))
+        self.publisher = MQTTChangePublisher(
+            feed_settings.get("clientId", "catalog"),
+            self.broker["ip"],
+            self.broker["port"],
+            feed_settings.get("topicPrefix", "catalog"),
+            feed_settings.get("mqtt")
+        )
+        self.feed.listeners.append(self.publisher.publish)
+        self.publisher.connect()
 
         # Flag to stop the cleaning thread
         self.thread_stop = threading.Event()
@@ -37,162 +62,334 @@ class CatalogService:
         except FileNotFoundError:
             return []
 
-    @staticmethod
-    def save_json(file_name, data):
-        """Save JSON data to a file."""
-        with open(file_name, "w") as file:
-            json.dump(data, file, indent=4)
+    def snapshot(self):
+        """Current state of the collections, used by the storage backend to compact or refresh its data."""
+        return {
+            "devices": self.registry.list_devices_last_seen(),
+            "rooms": self.registry.list_rooms(),
+            "users": self.registry.list_users()
+        }
+
+    def commit(self, changes):
+        """
+        Persist changes in the storage backend and record them in the change feed.
+        Changes are (event, collection, item_id, item) with event one of create, update, delete
+        or expire. Called while holding the write locks, so the feed follows the log order.
+        """
+        records = []
+        for event, collection, item_id, item in changes:
+            if event in ("delete", "expire"):
+                records.append(("delete", collection, item_id, None))
+            else:
+                records.append(("put", collection, item_id, item))
+        self.storage.append(records)
+        for change in changes:
+            self.feed.record(*change)
+
+    def room_change(self, room_id):
+        """Update of a room whose device list changed, or nothing if the room is gone."""
+        room = self.registry.get_room(room_id)
+        return [("update", "rooms", room_id, room)] if room is not None else []
 
     def periodic_cleanup(self):
-        """Periodic cleanup thread to remove old devices every 2 minutes."""
+        """Cleanup thread removing the devices without a heartbeat for deviceTTL seconds."""
         while not self.thread_stop.is_set():
-            print("Running periodic cleanup...", flush=True)
-            devices = CatalogService.load_json("devices.json")
-            current_time = datetime.datetime.now(datetime.timezone.utc)
-            updated_devices = [
-                device for device in devices
-                if datetime.datetime.fromisoformat(device["insert-timestamp"]) > current_time - datetime.timedelta(minutes=2)
-            ]
-            rooms = CatalogService.load_json("rooms.json")
-            for room in rooms:
-                room["devices"] = [device for device in room["devices"] if device in [d["deviceID"] for d in updated_devices]]
-            CatalogService.save_json("devices.json", updated_devices)
-            CatalogService.save_json("rooms.json", rooms)
-            time.sleep(60)
-
-    def get_item(self, collection, item_id, item_name):
-        """Get an item from a collection by ID."""
-        item = next((item for item in collection if item[item_name] == item_id), None)
+            with self.registry.write("rooms", "devices"):
+                expired = self.registry.expire_devices()
+                for device in expired:
+                    self.commit([("expire", "devices", device["deviceID"], device)] + self.room_change(device["roomID"]))
+            for device in expired:
+                print(f"Device {device['deviceID']} expired", flush=True)
+            # Sleep until the next deadline. Devices added meanwhile expire after it,
+            # so with an empty heap one TTL is the longest safe wait.
+            next_deadline = self.registry.expiry.next_deadline()
+            if next_deadline is None:
+                timeout = min(60, self.device_ttl)
+            else:
+                timeout = min(60, max(0, next_deadline - time.time()))
+            self.thread_stop.wait(timeout)
+
+    @staticmethod
+    def not_found(item_name):
+        return cherrypy.HTTPError(404, f"{item_name.capitalize()} not found")
+
+    def get_item(self, item, item_name):
+        """Serialize an item looked up in the registry."""
         if item:
             return json.dumps(item).encode('utf-8')
-        raise cherrypy.HTTPError(404, f"{item_name.capitalize()} not found")
+        raise self.not_found(item_name)
+
+    def set_feed_version(self):
+        """
+        Tell the client the change feed version its response is at least as recent as,
+        to continue with GET /changes?since=<version>. Read it before the data.
+        """
+        cherrypy.response.headers["X-Catalog-Epoch"] = self.feed.epoch
+        cherrypy.response.headers["X-Catalog-Version"] = str(self.feed.version)
+
+    def get_cached(self, name, version, serialize):
+        """Serve a cached response with its ETag, or 304 if the client already has it."""
+        etag, body = self.response_cache.get(name, version, serialize)
+        cherrypy.response.headers["ETag"] = etag
+        if self.response_cache.not_modified(cherrypy.request.headers, etag):
+            cherrypy.response.status = 304
+            return b""
+        return body
+
+    def get_collection(self, name):
+        # Read the versions before the view: the view is then at least as recent
+        self.set_feed_version()
+        version = self.registry.versions[name]
+        return self.get_cached(name, version, lambda: json.dumps(self.registry.view(name)).encode('utf-8'))
+
+    def query_collection(self, name, versions, params, select):
+        """
+        Serve a filtered, projected or paginated listing of a collection.
+        select() returns the items matching the filters, or None if there is no filter.
+        """
+        self.set_feed_version()
+        etag = self.response_cache.query_etag(name, versions, cherrypy.request.query_string)
+        cherrypy.response.headers["ETag"] = etag
+        if self.response_cache.not_modified(cherrypy.request.headers, etag):
+            cherrypy.response.status = 304
+            return b""
+
+        limit = parse_limit(params)
+        fields = param_list(params.get("fields", ""))
+        items = select()
+        if limit is None:
+            items = self.registry.view(name) if items is None else items
+            return json.dumps(project(items, fields)).encode('utf-8')
+
+        id_field = self.registry.ID_FIELDS[name]
+        if items is None:
+            ids, items = self.registry.sorted_view(name)
+        else:
+            items = sorted(items, key=lambda item: item[id_field])
+            ids = [item[id_field] for item in items]
+        page, next_cursor = paginate(ids, items, limit, params.get("cursor"))
+        return json.dumps({"items": project(page, fields), "next": next_cursor}).encode('utf-8')
+
+    @staticmethod
+    def location_filter(params):
+        return {key: params[key] for key in ("building", "floor", "number") if key in params}
+
+    def select_rooms(self, params):
+        location = self.location_filter(params)
+        return self.registry.find_rooms(**location) if location else None
+
+    def select_devices(self, params):
+        room_ids = param_list(params["roomID"]) if "roomID" in params else None
+        location = self.location_filter(params)
+        if location:
+            location_ids = [room["roomID"] for room in self.registry.find_rooms(**location)]
+            room_ids = location_ids if room_ids is None else [r for r in room_ids if r in location_ids]
+        resource = params.get("resource")
+        device_ids = param_list(params["ids"]) if "ids" in params else None
+        if room_ids is None and resource is None and device_ids is None:
+            return None
+        return self.registry.find_devices(room_ids, resource, device_ids)
+
+    def expand_room(self, room):
+        """Copy of a room with its device IDs replaced by the device documents."""
+        devices = [self.registry.get_device(device_id) for device_id in room["devices"]]
+        return dict(room, devices=[device for device in devices if device is not None])
+
+    def get_changes(self, params):
+        """Changes after the version given by ?since=, for the clients keeping a replica of the catalog."""
+        if "since" not in params:
+            return json.dumps({"epoch": self.feed.epoch, "version": self.feed.version, "changes": []}).encode('utf-8')
+        try:
+            since = int(params["since"])
+        except ValueError:
+            raise cherrypy.HTTPError(400, "Invalid request: 'since' must be an integer")
+        changes = self.feed.since(since)
+        if changes is None or params.get("epoch", self.feed.epoch) != self.feed.epoch:
+            raise cherrypy.HTTPError(410, "Changes not available anymore, reload the collections")
+        version = changes[-1]["version"] if changes else since
+        return json.dumps({"epoch": self.feed.epoch, "version": version, "changes": changes}).encode('utf-8')
 
     def GET(self, *uri, **params):
         """Handle GET requests."""
+        if uri[0] == "changes":
+            return self.get_changes(params)
         if uri[0] == "broker":
-            return json.dumps(self.broker).encode('utf-8')
+            return self.get_cached("broker", 0, lambda: json.dumps(self.broker).encode('utf-8'))
         if uri[0] == "devices":
             if len(uri) == 2:
-                return self.get_item(self.devices, uri[1], "deviceID")
-            return json.dumps(self.devices).encode('utf-8')
+                return self.get_item(self.registry.get_device(uri[1]), "deviceID")
+            if params:
+                versions = (self.registry.versions["rooms"], self.registry.versions["devices"])
+                return self.query_collection("devices", versions, params, lambda: self.select_devices(params))
+            return self.get_collection("devices")
         if uri[0] == "rooms":
             if len(uri) == 2:
-                return self.get_item(self.rooms, uri[1], "roomID")
-            return json.dumps(self.rooms).encode('utf-8')
+                room = self.registry.get_room(uri[1])
+                if room and params.get("expand") == "devices":
+                    room = self.expand_room(room)
+                return self.get_item(room, "roomID")
+            if params:
+                versions = (self.registry.versions["rooms"],)
+                return self.query_collection("rooms", versions, params, lambda: self.select_rooms(params))
+            return self.get_collection("rooms")
         if uri[0] == "users":
             if len(uri) == 2:
-                return self.get_item(self.users, uri[1], "userID")
-            return json.dumps(self.users).encode('utf-8')
+                return self.get_item(self.registry.get_user(uri[1]), "userID")
+            if params:
+                versions = (self.registry.versions["users"],)
+                return self.query_collection("users", versions, params, lambda: None)
+            return self.get_collection("users")
 
-    def add_item(self, collection, item, file_name):
-        """Add an item to a collection and save to file."""
-        collection.append(item)
-        self.save_json(file_name, collection)
-        return json.dumps(item).encode('utf-8')
+    def validate_device(self, device):
+        """Validate a device body and the room it references."""
+        self.validate_fields(["ip", "port", "endpoints", "availableResources", "roomID"], device)
+        if "mqtt" in device["endpoints"]:
+            self.validate_fields(["topics"], device["endpoints"]["mqtt"])
+        if "rest" in device["endpoints"]:
+            self.validate_fields(["restIP"], device["endpoints"]["rest"])
+        if not self.registry.has_room(device["roomID"]):
+            raise cherrypy.HTTPError(404, "Referenced room not found")
+
+    def validate_user_rooms(self, user):
+        for roomID in user["rooms"]:
+            if not self.registry.has_room(roomID):
+                raise cherrypy.HTTPError(404, "Referenced room not found")
 
     def POST(self, *uri, **params):
         """Handle POST requests."""
+        if len(uri) == 2 and uri[0] == "devices" and uri[1] == "heartbeat":
+            # Batched heartbeat: {"deviceIDs": [...]}
+            body = json.loads(cherrypy.request.body.read())
+            self.validate_fields(["deviceIDs"], body)
+            now = time.time()
+            unknown = [device_id for device_id in body["deviceIDs"] if not self.registry.touch(device_id, now)]
+            return json.dumps({"unknown": unknown}).encode('utf-8')
+
+        if len(uri) == 2 and uri[0] == "devices" and uri[1] == "batch":
+            # Batch read: {"deviceIDs": [...]}
+            body = json.loads(cherrypy.request.body.read())
+            self.validate_fields(["deviceIDs"], body)
+            devices = self.registry.find_devices(device_ids=body["deviceIDs"])
+            found = {device["deviceID"] for device in devices}
+            unknown = [device_id for device_id in body["deviceIDs"] if device_id not in found]
+            return json.dumps({"devices": devices, "unknown": unknown}).encode('utf-8')
+
+        if len(uri) == 3 and uri[0] == "devices" and uri[2] == "heartbeat":
+            if not self.registry.touch(uri[1]):
+                raise self.not_found("deviceID")
+            return json.dumps({"deviceID": uri[1]}).encode('utf-8')
+
         if uri[0] == "devices":
-            device = json.loads(cherrypy.request.body.read())
-            self.validate_fields(["ip", "port", "endpoints", "availableResources", "roomID"], device)
-            if "mqtt" in device["endpoints"]:
-                self.validate_fields(["topics"], device["endpoints"]["mqtt"])
-            if "rest" in device["endpoints"]:
-                self.validate_fields(["restIP"], device["endpoints"]["rest"])
-            if not any(room["roomID"] == device["roomID"] for room in self.rooms):
-                raise cherrypy.HTTPError(404, "Referenced room not found")
-            device["deviceID"] = str(uuid.uuid4())
-            device["insert-timestamp"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
-            for room in self.rooms:
-                if room["roomID"] == device["roomID"]:
-                    room["devices"].append(device["deviceID"])
-                    break
-            self.save_json("rooms.json", self.rooms)
-            return self.add_item(self.devices, device, "devices.json")
+            # A list registers many devices with one write to the storage, all or none of them
+            body = json.loads(cherrypy.request.body.read())
+            devices = body if isinstance(body, list) else [body]
+            timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            for device in devices:
+                device["deviceID"] = str(uuid.uuid4())
+                device["insert-timestamp"] = timestamp
+            with self.registry.write("rooms", "devices"):
+                for device in devices:
+                    self.validate_device(device)
+                changes = []
+                for device in devices:
+                    self.registry.add_device(device)
+                    changes.append(("create", "devices", device["deviceID"], device))
+                for room_id in dict.fromkeys(device["roomID"] for device in devices):
+                    changes += self.room_change(room_id)
+                self.commit(changes)
+            return json.dumps(body).encode('utf-8')
 
         if uri[0] == "rooms":
-            room = json.loads(cherrypy.request.body.read())
-            self.validate_fields(["number", "floor", "buildingName", "openingHours", "coordinates"], room)
-            room["roomID"] = str(uuid.uuid4())
-            room["devices"] = []
-            return self.add_item(self.rooms, room, "rooms.json")
+            # A list creates many rooms at once, like the devices
+            body = json.loads(cherrypy.request.body.read())
+            rooms = body if isinstance(body, list) else [body]
+            for room in rooms:
+                self.validate_fields(["number", "floor", "buildingName", "openingHours", "coordinates"], room)
+                room["roomID"] = str(uuid.uuid4())
+                room["devices"] = []
+            with self.registry.write("rooms"):
+                for room in rooms:
+                    self.registry.add_room(room)
+                self.commit([("create", "rooms", room["roomID"], room) for room in rooms])
+            return json.dumps(body).encode('utf-8')
 
         if uri[0] == "users":
             user = json.loads(cherrypy.request.body.read())
             self.validate_fields(["username", "telegramChatID", "rooms"], user)
-            for roomID in user["rooms"]:
-                if not any(room["roomID"] == roomID for room in self.rooms):
-                    raise cherrypy.HTTPError(404, "Referenced room not found")
             user["userID"] = str(uuid.uuid4())
-            return self.add_item(self.users, user, "users.json")
-
-    def update_item(self, collection, item, item_id, item_name, file_name):
-        """Update an item in a collection and save to file."""
-        for i, existing_item in enumerate(collection):
-            if existing_item[item_name] == item_id:
-                collection[i] = item
-                self.save_json(file_name, collection)
-                return json.dumps(item).encode('utf-8')
-        raise cherrypy.HTTPError(404, f"{item_name.capitalize()} not found")
+            # The rooms lock keeps the referenced rooms from being deleted meanwhile
+            with self.registry.write("rooms", "users"):
+                self.validate_user_rooms(user)
+                self.registry.add_user(user)
+                self.commit([("create", "users", user["userID"], user)])
+            return json.dumps(user).encode('utf-8')
 
     def PUT(self, *uri, **params):
         """Handle PUT requests."""
         if len(uri) == 2 and uri[0] == "devices":
             device = json.loads(cherrypy.request.body.read())
-            self.validate_fields(["ip", "port", "endpoints", "availableResources", "roomID"], device)
-            if "mqtt" in device["endpoints"]:
-                self.validate_fields(["topics"], device["endpoints"]["mqtt"])
-            if "rest" in device["endpoints"]:
-                self.validate_fields(["restIP"], device["endpoints"]["rest"])
-            if not any(room["roomID"] == device["roomID"] for room in self.rooms):
-                raise cherrypy.HTTPError(404, "Referenced room not found")
             device["deviceID"] = uri[1]
             device["insert-timestamp"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
-            return self.update_item(self.devices, device, uri[1], "deviceID", "devices.json")
+            with self.registry.write("rooms", "devices"):
+                self.validate_device(device)
+                old = self.registry.update_device(device)
+                if old is None:
+                    raise self.not_found("deviceID")
+                changes = [("update", "devices", device["deviceID"], device)]
+                if old["roomID"] != device["roomID"]:
+                    changes += self.room_change(old["roomID"]) + self.room_change(device["roomID"])
+                self.commit(changes)
+            return json.dumps(device).encode('utf-8')
 
         if len(uri) == 2 and uri[0] == "rooms":
             room = json.loads(cherrypy.request.body.read())
             self.validate_fields(["number", "floor", "buildingName", "openingHours", "coordinates", "devices"], room)
             room["roomID"] = uri[1]
-            return self.update_item(self.rooms, room, uri[1], "roomID", "rooms.json")
+            with self.registry.write("rooms"):
+                if self.registry.update_room(room) is None:
+                    raise self.not_found("roomID")
+                self.commit([("update", "rooms", room["roomID"], room)])
+            return json.dumps(room).encode('utf-8')
 
         if len(uri) == 2 and uri[0] == "users":
             user = json.loads(cherrypy.request.body.read())
             self.validate_fields(["username", "telegramChatID", "rooms"], user)
             user["userID"] = uri[1]
-            for roomID in user["rooms"]:
-                if not any(room["roomID"] == roomID for room in self.rooms):
-                    raise cherrypy.HTTPError(404, "Referenced room not found")
-            return self.update_item(self.users, user, uri[1], "userID", "users.json")
+            with self.registry.write("rooms", "users"):
+                self.validate_user_rooms(user)
+                if self.registry.update_user(user) is None:
+                    raise self.not_found("userID")
+                self.commit([("update", "users", user["userID"], user)])
+            return json.dumps(user).encode('utf-8')
 
         raise cherrypy.HTTPError(400, "Invalid request")
 
-    def delete_item(self, collection, item_id, item_name, file_name):
-        """Delete an item from a collection and save to file."""
-        for i, item in enumerate(collection):
-            if item[item_name] == item_id:
-                del collection[i]
-                self.save_json(file_name, collection)
-                return
-        raise cherrypy.HTTPError(404, f"{item_name.capitalize()} not found")
-
     def DELETE(self, *uri, **params):
         """Handle DELETE requests."""
         if len(uri) == 2 and uri[0] == "devices":
-            return self.delete_item(self.devices, uri[1], "deviceID", "devices.json")
+            with self.registry.write("rooms", "devices"):
+                device = self.registry.delete_device(uri[1])
+                if device is None:
+                    raise self.not_found("deviceID")
+                self.commit([("delete", "devices", uri[1], device)] + self.room_change(device["roomID"]))
+            return
 
         if len(uri) == 2 and uri[0] == "rooms":
-            for i, room in enumerate(self.rooms):
-                if room["roomID"] == uri[1]:
-                    del self.rooms[i]
-                    self.devices = [d for d in self.devices if d["roomID"] != uri[1]]
-                    self.save_json("rooms.json", self.rooms)
-                    self.save_json("devices.json", self.devices)
-                    return
-            raise cherrypy.HTTPError(404, "Room not found")
+            with self.registry.write("rooms", "devices"):
+                room, removed = self.registry.delete_room(uri[1])
+                if room is None:
+                    raise cherrypy.HTTPError(404, "Room not found")
+                changes = [("delete", "devices", device["deviceID"], device) for device in removed]
+                self.commit(changes + [("delete", "rooms", uri[1], room)])
+            return
 
         if len(uri) == 2 and uri[0] == "users":
-            return self.delete_item(self.users, uri[1], "userID", "users.json")
+            with self.registry.write("users"):
+                user = self.registry.delete_user(uri[1])
+                if user is None:
+                    raise self.not_found("userID")
+                self.commit([("delete", "users", uri[1], user)])
+            return
 
         raise cherrypy.HTTPError(400, "Invalid request")
 
@@ -210,6 +407,8 @@ if __name__ == '__main__':
     def shutdown():
         print("Stopping cleaning thread...")
         service.thread_stop.set()
+        service.publisher.stop()
+        service.storage.close()
 
     cherrypy.engine.subscribe('stop', shutdown)
 
@@ -217,6 +416,7 @@ if __name__ == '__main__':
     cherrypy.config.update({
         'server.socket_port': 8080,
         'server.socket_host': '0.0.0.0',
+        'server.thread_pool': service.settings.get("threadPool", 10),
         "tools.response_headers.on": True,
         "tools.response_headers.headers": [("Content-Type", "application/json")]
     })
@@ -0,0 +1,88 @@
+import collections
+import itertools
+import threading
+import uuid
+
+from MyMQTT import MyMQTT
+
+
+class ChangeFeed:
+    """
+    Versioned log of the catalog changes.
+    Every change gets the next version number. The last `retention` changes are kept in memory
+    so that clients can catch up with GET /changes?since=N, and every change is passed to the
+    listeners (e.g. the MQTT publisher). Versions restart with the process: the epoch tells
+    the clients that their version belongs to a previous run.
+    """
+
+    def __init__(self, retention=10000):
+        self.lock = threading.Lock()
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.changes = collections.deque(maxlen=retention)
+        self.listeners = []
+
+    def record(self, event, collection, item_id, item):
+        with self.lock:
+            self.version += 1
+            change = {
+                "version": self.version,
+                "event": event,
+                "collection": collection,
+                "id": item_id,
+                "item": item
+            }
+            self.changes.append(change)
+        for listener in self.listeners:
+            try:
+                listener(change)
+            except Exception as e:
+                print(f"Error publishing change {change['version']}: {e}", flush=True)
+        return change
+
+    def since(self, version):
+        """
+        Changes after a version, oldest first.
+        Returns None if some of them are not retained anymore: the client must reload the collections.
+        """
+        with self.lock:
+            if version > self.version:
+                return None
+            if version == self.version:
+                return []
+            if not self.changes or version < self.changes[0]["version"] - 1:
+                return None
+            start = version - self.changes[0]["version"] + 1
+            return list(itertools.islice(self.changes, start, None))
+
+
+class MQTTChangePublisher:
+    """
+    Publishes the catalog changes to the broker. {prefix}/{collection}/{id} holds the current
+    document of each item as a retained message. A deletion is sent as a message without
+    retain, then the retained message is cleared with an empty payload.
+    """
+
+    def __init__(self, client_id, broker, port, prefix="catalog", mqtt_settings=None):
+        self.prefix = prefix
+        self.client = MyMQTT(client_id, broker, port, self, mqtt_settings)
+
+    def notify(self, topic, payload):
+        # The catalog does not subscribe to anything
+        pass
+
+    def connect(self):
+        """Connect in the background, the changes are queued while the broker is not reachable."""
+        self.client.start()
+
+    def publish(self, change):
+        topic = f"{self.prefix}/{change['collection']}/{change['id']}"
+        message = {"version": change["version"], "event": change["event"], "item": change["item"]}
+        if change["event"] in ("delete", "expire"):
+            self.client.myPublish(topic, message)
+            self.client.myPublish(topic, None, retain=True)
+        else:
+            self.client.myPublish(topic, message, retain=True)
+
+    def stop(self):
+        self.client.stop()
@@ -0,0 +1,47 @@
+import heapq
+
+
+class ExpiryHeap:
+    """
+    Min-heap of device expiry deadlines.
+    Heartbeats do not touch the heap: when an entry comes due, the device is expired only
+    if it was not seen since, otherwise it is pushed back with its new deadline.
+    Every operation is O(log n) and each device is checked about once per TTL.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.heap = []          # (deadline, deviceID)
+        self.scheduled = {}     # deviceID -> deadline of its entry in the heap
+
+    def __len__(self):
+        return len(self.scheduled)
+
+    def schedule(self, device_id, last_seen):
+        """Add an entry for a device unless it already has one."""
+        if device_id in self.scheduled:
+            return
+        deadline = last_seen + self.ttl
+        self.scheduled[device_id] = deadline
+        heapq.heappush(self.heap, (deadline, device_id))
+
+    def next_deadline(self):
+        return self.heap[0][0] if self.heap else None
+
+    def pop_expired(self, now, last_seen):
+        """Return the IDs of the devices whose last heartbeat is older than the TTL."""
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, device_id = heapq.heappop(self.heap)
+            if self.scheduled.get(device_id) != deadline:
+                continue
+            del self.scheduled[device_id]
+            seen = last_seen.get(device_id)
+            if seen is None:
+                # The device was deleted meanwhile
+                continue
+            if seen + self.ttl <= now:
+                expired.append(device_id)
+            else:
+                self.schedule(device_id, seen)
+        return expired
@@ -0,0 +1,40 @@
+import bisect
+
+import cherrypy
+
+def param_list(value):
+    """Comma separated (or repeated) query parameter as a list."""
+    if isinstance(value, list):
+        return [v for item in value for v in param_list(item)]
+    return [v for v in value.split(",") if v]
+
+
+def project(items, fields):
+    """Keep only the requested top-level fields of each item."""
+    if not fields:
+        return items
+    return [{field: item[field] for field in fields if field in item} for item in items]
+
+
+def paginate(ids, items, limit, cursor=None):
+    """
+    Cursor pagination over items sorted by ID.
+    The cursor is the last ID of the previous page, so pages stay consistent when items
+    are added or removed in between. Returns (page, next cursor or None).
+    """
+    start = bisect.bisect_right(ids, cursor) if cursor else 0
+    page = items[start:start + limit]
+    has_more = start + limit < len(items)
+    return page, ids[start + limit - 1] if has_more else None
+
+
+def parse_limit(params):
+    if "limit" not in params:
+        return None
+    try:
+        limit = int(params["limit"])
+    except ValueError:
+        raise cherrypy.HTTPError(400, "Invalid request: 'limit' must be an integer")
+    if limit <= 0:
+        raise cherrypy.HTTPError(400, "Invalid request: 'limit' must be positive")
+    return limit
@@ -0,0 +1,358 @@
+import contextlib
+import datetime
+import threading
+import time
+
+from expiry import ExpiryHeap
+
+
+class CatalogRegistry:
+    """
+    In-memory indexed registry of the catalog devices, rooms and users.
+
+    Concurrency model:
+    - Writers hold the lock of every collection they change (see write()), so writes are
+      serialized per collection. Locks are always taken in LOCK_ORDER.
+    - Published documents are never modified in place: writers store new copies, so readers
+      can use the dicts without locking and always see a whole document.
+    - Secondary index entries can be large and are changed in place: readers copy an entry
+      with a single tuple() call before walking it.
+    - Full listings are immutable views rebuilt at most once per version of the collection.
+    """
+
+    LOCK_ORDER = ("rooms", "devices", "users")
+    ID_FIELDS = {"rooms": "roomID", "devices": "deviceID", "users": "userID"}
+
+    def __init__(self, devices, rooms, users, device_ttl=120):
+        # Primary indexes: ID -> document
+        self.devices = {}
+        self.rooms = {}
+        self.users = {}
+
+        # Secondary indexes
+        self.devices_by_room = {}      # roomID -> {deviceID: None} (ordered set)
+        self.devices_by_resource = {}  # resource -> {deviceID: None}
+        self.room_by_location = {}     # (building, floor, number) -> roomID
+        self.rooms_by_building = {}    # building -> {roomID: None}
+
+        # Liveness: deviceID -> epoch of the last registration or heartbeat.
+        # It is kept in memory only, loaded devices get a full TTL to send their next heartbeat.
+        self.last_seen = {}
+        self.expiry = ExpiryHeap(device_ttl)
+
+        self.locks = {name: threading.RLock() for name in self.LOCK_ORDER}
+        self.versions = {name: 0 for name in self.LOCK_ORDER}
+        self.views = {name: None for name in self.LOCK_ORDER}
+        self.sorted_views = {name: None for name in self.LOCK_ORDER}
+        # Set by the writers holding the lock of a collection when they change it
+        self.changed = {name: False for name in self.LOCK_ORDER}
+
+        now = time.time()
+        for room in rooms:
+            self._index_room(room)
+        for device in devices:
+            self._index_device(device)
+            self.last_seen[device["deviceID"]] = now
+            self.expiry.schedule(device["deviceID"], now)
+        for user in users:
+            self.users[user["userID"]] = user
+        self.changed = {name: False for name in self.LOCK_ORDER}
+
+    @staticmethod
+    def location_key(building, floor, number):
+        """Normalize a building/floor/number triple (ints and strings are mixed in the files)."""
+        return (str(building), str(floor), str(number))
+
+    @contextlib.contextmanager
+    def write(self, *collections):
+        """Hold the write locks of the given collections, bumping the version of the changed ones on exit."""
+        locks = [self.locks[name] for name in self.LOCK_ORDER if name in collections]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            # Drop the view before bumping the version: a reader that sees the new
+            # version must not be able to pick up the old view
+            for name in collections:
+                if self.changed[name]:
+                    self.changed[name] = False
+                    self.views[name] = None
+                    self.sorted_views[name] = None
+                    self.versions[name] += 1
+            for lock in reversed(locks):
+                lock.release()
+
+    def view(self, name):
+        """Immutable listing of a collection, shared by all readers until the next write."""
+        view = self.views[name]
+        if view is None:
+            with self.locks[name]:
+                view = self.views[name]
+                if view is None:
+                    view = self.views[name] = tuple(getattr(self, name).values())
+        return view
+
+    def sorted_view(self, name):
+        """(sorted IDs, items in the same order) of a collection, used for cursor pagination."""
+        view = self.sorted_views[name]
+        if view is None:
+            with self.locks[name]:
+                view = self.sorted_views[name]
+                if view is None:
+                    id_field = self.ID_FIELDS[name]
+                    items = sorted(self.view(name), key=lambda item: item[id_field])
+                    view = self.sorted_views[name] = ([item[id_field] for item in items], items)
+        return view
+
+    # ------------------------------------------------------------------
+    # Index maintenance (callers hold the write locks)
+
+    def _mark_changed(self, name):
+        # Drop the views as soon as the collection changes, before the change is persisted:
+        # a snapshot taken meanwhile (e.g. by the log compaction) then rebuilds them, which
+        # waits for the write lock, instead of saving the state from before the change
+        self.changed[name] = True
+        self.views[name] = None
+        self.sorted_views[name] = None
+
+    @staticmethod
+    def _index_add(index, key, item_id):
+        index.setdefault(key, {})[item_id] = None
+
+    @staticmethod
+    def _index_remove(index, key, item_id):
+        entry = index.get(key)
+        if entry is not None:
+            entry.pop(item_id, None)
+
+    def _index_room(self, room):
+        old = self.rooms.get(room["roomID"])
+        self.rooms[room["roomID"]] = room
+        self._mark_changed("rooms")
+        self.devices_by_room.setdefault(room["roomID"], {})
+        if old is not None:
+            self._unindex_room_location(old)
+        key = self.location_key(room["buildingName"], room["floor"], room["number"])
+        self.room_by_location[key] = room["roomID"]
+        self._index_add(self.rooms_by_building, str(room["buildingName"]), room["roomID"])
+
+    def _unindex_room_location(self, room):
+        key = self.location_key(room["buildingName"], room["floor"], room["number"])
+        if self.room_by_location.get(key) == room["roomID"]:
+            del self.room_by_location[key]
+        self._index_remove(self.rooms_by_building, str(room["buildingName"]), room["roomID"])
+
+    def _unindex_room(self, room):
+        del self.rooms[room["roomID"]]
+        self._mark_changed("rooms")
+        self.devices_by_room.pop(room["roomID"], None)
+        self._unindex_room_location(room)
+
+    def _index_device(self, device):
+        self.devices[device["deviceID"]] = device
+        self._mark_changed("devices")
+        self._index_add(self.devices_by_room, device["roomID"], device["deviceID"])
+        for resource in device["availableResources"]:
+            self._index_add(self.devices_by_resource, resource, device["deviceID"])
+
+    def _unindex_device_secondary(self, device):
+        """Remove a device from the secondary indexes (the primary dict is left untouched)."""
+        self._index_remove(self.devices_by_room, device["roomID"], device["deviceID"])
+        for resource in device["availableResources"]:
+            self._index_remove(self.devices_by_resource, resource, device["deviceID"])
+
+    def _set_room_devices(self, room_id, change):
+        """Replace a room document with a copy whose device list went through change()."""
+        room = self.rooms.get(room_id)
+        if room is not None:
+            self.rooms[room_id] = dict(room, devices=change(list(room["devices"])))
+            self._mark_changed("rooms")
+
+    @staticmethod
+    def _appended(device_id):
+        return lambda devices: devices + [device_id]
+
+    @staticmethod
+    def _removed(device_id):
+        return lambda devices: [d for d in devices if d != device_id]
+
+    # ------------------------------------------------------------------
+    # Lookups (lock-free)
+
+    def get_device(self, device_id):
+        return self.devices.get(device_id)
+
+    def get_room(self, room_id):
+        return self.rooms.get(room_id)
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def has_room(self, room_id):
+        return room_id in self.rooms
+
+    def find_room(self, building, floor, number):
+        """Return the room at the given location, or None."""
+        room_id = self.room_by_location.get(self.location_key(building, floor, number))
+        return self.rooms.get(room_id) if room_id else None
+
+    def devices_in_room(self, room_id):
+        """Return the devices registered in a room."""
+        devices = (self.devices.get(device_id) for device_id in tuple(self.devices_by_room.get(room_id, ())))
+        return [device for device in devices if device is not None]
+
+    def find_rooms(self, building=None, floor=None, number=None):
+        """Rooms matching a location, any of the fields can be omitted."""
+        if building is not None and floor is not None and number is not None:
+            room = self.find_room(building, floor, number)
+            return [room] if room else []
+        if building is not None:
+            rooms = (self.rooms.get(room_id) for room_id in tuple(self.rooms_by_building.get(str(building), ())))
+        else:
+            rooms = self.view("rooms")
+        return [
+            room for room in rooms
+            if room is not None
+            and (floor is None or str(room["floor"]) == str(floor))
+            and (number is None or str(room["number"]) == str(number))
+        ]
+
+    def find_devices(self, room_ids=None, resource=None, device_ids=None):
+        """Devices among device_ids, in any of the given rooms, providing a resource. Any filter can be omitted."""
+        candidates = []
+        if device_ids is not None:
+            candidates.append(device_ids)
+        if room_ids is not None:
+            candidates.append([device_id for room_id in room_ids for device_id in tuple(self.devices_by_room.get(room_id, ()))])
+        if resource is not None:
+            candidates.append(tuple(self.devices_by_resource.get(resource, ())))
+        if not candidates:
+            return list(self.view("devices"))
+        # Walk the smallest index entry and check the other filters on each device
+        candidates.sort(key=len)
+        room_ids = set(room_ids) if room_ids is not None else None
+        devices = (self.devices.get(device_id) for device_id in candidates[0])
+        return [
+            device for device in devices
+            if device is not None
+            and (room_ids is None or device["roomID"] in room_ids)
+            and (resource is None or resource in device["availableResources"])
+        ]
+
+    def list_devices(self):
+        return self.view("devices")
+
+    def list_devices_last_seen(self):
+        """Devices with their insert-timestamp refreshed from the last heartbeat, used when persisting."""
+        devices = []
+        for device in self.view("devices"):
+            last_seen = self.last_seen.get(device["deviceID"])
+            if last_seen is not None:
+                timestamp = datetime.datetime.fromtimestamp(last_seen, datetime.timezone.utc).isoformat()
+                device = dict(device, **{"insert-timestamp": timestamp})
+            devices.append(device)
+        return devices
+
+    def list_rooms(self):
+        return self.view("rooms")
+
+    def list_users(self):
+        return self.view("users")
+
+    # ------------------------------------------------------------------
+    # Devices
+
+    def touch(self, device_id, timestamp=None):
+        """Record a heartbeat of a device. Returns False if the device is unknown. Lock-free."""
+        if device_id not in self.devices:
+            return False
+        self.last_seen[device_id] = timestamp or time.time()
+        if device_id not in self.devices:
+            # Deleted concurrently, do not leave a stale entry behind
+            self.last_seen.pop(device_id, None)
+            return False
+        return True
+
+    def add_device(self, device):
+        self._index_device(device)
+        self.touch(device["deviceID"])
+        self.expiry.schedule(device["deviceID"], self.last_seen[device["deviceID"]])
+        self._set_room_devices(device["roomID"], self._appended(device["deviceID"]))
+        return device
+
+    def update_device(self, device):
+        """Replace a device, moving it to another room if its roomID changed. Returns the previous version."""
+        old = self.devices.get(device["deviceID"])
+        if old is None:
+            return None
+        self._unindex_device_secondary(old)
+        self._index_device(device)
+        self.touch(device["deviceID"])
+        if old["roomID"] != device["roomID"]:
+            self._set_room_devices(old["roomID"], self._removed(device["deviceID"]))
+            self._set_room_devices(device["roomID"], self._appended(device["deviceID"]))
+        return old
+
+    def delete_device(self, device_id):
+        device = self.devices.pop(device_id, None)
+        if device is None:
+            return None
+        self._mark_changed("devices")
+        self.last_seen.pop(device_id, None)
+        self._unindex_device_secondary(device)
+        self._set_room_devices(device["roomID"], self._removed(device_id))
+        return device
+
+    def expire_devices(self, now=None):
+        """Delete the devices without a heartbeat for longer than the TTL and return them."""
+        expired_ids = self.expiry.pop_expired(now or time.time(), self.last_seen)
+        return [device for device in map(self.delete_device, expired_ids) if device is not None]
+
+    # ------------------------------------------------------------------
+    # Rooms
+
+    def add_room(self, room):
+        self._index_room(room)
+        return room
+
+    def update_room(self, room):
+        if room["roomID"] not in self.rooms:
+            return None
+        self._index_room(room)
+        return room
+
+    def delete_room(self, room_id):
+        """Delete a room and its devices, returning (room, removed devices)."""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None, []
+        removed = self.devices_in_room(room_id)
+        for device in removed:
+            del self.devices[device["deviceID"]]
+            self.last_seen.pop(device["deviceID"], None)
+            self._unindex_device_secondary(device)
+            self._mark_changed("devices")
+        self._unindex_room(room)
+        return room, removed
+
+    # ------------------------------------------------------------------
+    # Users
+
+    def add_user(self, user):
+        self.users[user["userID"]] = user
+        self._mark_changed("users")
+        return user
+
+    def update_user(self, user):
+        if user["userID"] not in self.users:
+            return None
+        self.users[user["userID"]] = user
+        self._mark_changed("users")
+        return user
+
+    def delete_user(self, user_id):
+        user = self.users.pop(user_id, None)
+        if user is not None:
+            self._mark_changed("users")
+        return user
@@ -0,0 +1,39 @@
+import hashlib
+import uuid
+
+
+class ResponseCache:
+    """
+    Serialized responses of the catalog collections, keyed by collection version.
+    A collection is serialized again only after it changed. The ETag contains an ID of the
+    running process so that tags from before a restart never match.
+    """
+
+    def __init__(self):
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.entries = {}   # name -> (version, etag, body)
+
+    def get(self, name, version, serialize):
+        """Return (etag, body) of a collection at a version, calling serialize() on a miss."""
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != version:
+            # Serialized outside of any lock: concurrent misses only do the work twice
+            entry = (version, f'"{name}-{self.boot_id}-{version}"', serialize())
+            current = self.entries.get(name)
+            if current is None or current[0] < version:
+                self.entries[name] = entry
+        return entry[1], entry[2]
+
+    def query_etag(self, name, versions, query_string):
+        """ETag of a filtered query: it changes with the versions of the collections it reads."""
+        digest = hashlib.sha1(query_string.encode('utf-8')).hexdigest()[:12]
+        return f'"{name}-{self.boot_id}-{"-".join(map(str, versions))}-{digest}"'
+
+    @staticmethod
+    def not_modified(request_headers, etag):
+        """Check the If-None-Match header of a request against an ETag."""
+        header = request_headers.get("If-None-Match")
+        if not header:
+            return False
+        tags = [tag.strip() for tag in header.split(",")]
+        return "*" in tags or etag in tags
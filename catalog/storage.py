@@ -0,0 +1,201 @@
+import abc
+import json
+import os
+import threading
+
+
+class CatalogStorage(abc.ABC):
+    """
+    Interface of the catalog storage backends.
+    The registry keeps the whole catalog in memory: a backend only has to load it at startup
+    and persist the mutations, in the order they are applied.
+    """
+
+    COLLECTIONS = {
+        "devices": ("devices.json", "deviceID"),
+        "rooms": ("rooms.json", "roomID"),
+        "users": ("users.json", "userID")
+    }
+
+    def __init__(self):
+        # Called to get the current state of the collections, e.g. when compacting
+        self.snapshot_provider = None
+
+    @staticmethod
+    def read_json(file_name):
+        try:
+            with open(file_name, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return []
+
+    @abc.abstractmethod
+    def load(self):
+        """Return the persisted collections as {name: [items]}."""
+
+    @abc.abstractmethod
+    def append(self, records):
+        """
+        Persist the mutations of one request, all or nothing. Each record is a tuple
+        (op, collection, item_id, item) with op "put" or "delete".
+        """
+
+    def flush(self):
+        """Make the appended mutations durable."""
+
+    def close(self):
+        self.flush()
+
+
+class JsonJournalStorage(CatalogStorage):
+    """
+    Append-only persistence for the catalog.
+    Every mutation is appended as one JSON line to a log file. The log is fsynced in
+    batches by a background thread and compacted into the JSON snapshot files
+    (devices.json, rooms.json, users.json) once it holds enough records.
+    Startup replays the snapshot files and then the log.
+    """
+
+    def __init__(self, settings=None):
+        super().__init__()
+        settings = settings or {}
+        self.log_file = settings.get("logFile", "catalog.log")
+        self.fsync_interval = settings.get("fsyncInterval", 1)
+        self.compact_every = settings.get("compactEvery", 10000)
+
+        self.lock = threading.Lock()
+        self.log = None
+        self.dirty = False
+        self.records_since_compaction = 0
+        self.compacting = False
+
+        self.thread_stop = threading.Event()
+        self.flush_thread = threading.Thread(target=self.periodic_fsync, daemon=True)
+
+    @property
+    def rotated_log_file(self):
+        return self.log_file + ".1"
+
+    @staticmethod
+    def write_json_atomic(file_name, data):
+        """Write a JSON file through a temporary file so a crash never leaves it truncated."""
+        tmp_name = file_name + ".tmp"
+        with open(tmp_name, "w") as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_name, file_name)
+
+    def replay(self, file_name, state):
+        """Apply the records of a log file to the state, ignoring a torn last line."""
+        try:
+            with open(file_name, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        print(f"Ignoring corrupted record in {file_name}", flush=True)
+                        continue
+                    collection = state[record["c"]]
+                    if record["op"] == "put":
+                        collection[record["id"]] = record["item"]
+                    elif record["op"] == "delete":
+                        collection.pop(record["id"], None)
+        except FileNotFoundError:
+            pass
+
+    def load(self):
+        """Return the persisted collections as {name: [items]} and open the log for appending."""
+        state = {}
+        for name, (file_name, id_field) in self.COLLECTIONS.items():
+            state[name] = {item[id_field]: item for item in self.read_json(file_name)}
+        # A rotated log only survives if a compaction did not finish
+        self.replay(self.rotated_log_file, state)
+        self.replay(self.log_file, state)
+
+        self.log = open(self.log_file, "a")
+        self.flush_thread.start()
+        return {name: list(items.values()) for name, items in state.items()}
+
+    def append(self, records):
+        """
+        Append mutations to the log. Each record is a tuple (op, collection, item_id, item)
+        with op "put" or "delete". The write is buffered, fsync is done by periodic_fsync.
+        """
+        lines = "".join(
+            json.dumps({"op": op, "c": collection, "id": item_id, "item": item}) + "\n"
+            for op, collection, item_id, item in records
+        )
+        with self.lock:
+            self.log.write(lines)
+            self.dirty = True
+            self.records_since_compaction += len(records)
+            compact = self.records_since_compaction >= self.compact_every and not self.compacting
+            if compact:
+                self.compacting = True
+        if compact:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def flush(self):
+        """Flush the log buffer and fsync it if anything was written."""
+        with self.lock:
+            if not self.dirty or self.log is None:
+                return
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.dirty = False
+
+    def periodic_fsync(self):
+        """Group commit: one fsync per interval for all the records written in between."""
+        while not self.thread_stop.wait(self.fsync_interval):
+            self.flush()
+
+    def compact(self):
+        """Rewrite the snapshot files from the current state and drop the log."""
+        try:
+            # Rotate the log first: every record of the rotated log is already in the state
+            # taken below, and records appended meanwhile go to the new log
+            with self.lock:
+                self.log.flush()
+                os.fsync(self.log.fileno())
+                self.log.close()
+                if os.path.exists(self.rotated_log_file):
+                    # A previous compaction failed: keep its records in front of the new ones
+                    with open(self.rotated_log_file, "a") as rotated, open(self.log_file, "r") as log:
+                        rotated.write(log.read())
+                    os.remove(self.log_file)
+                else:
+                    os.replace(self.log_file, self.rotated_log_file)
+                self.log = open(self.log_file, "a")
+                self.dirty = False
+                self.records_since_compaction = 0
+
+            state = self.snapshot_provider()
+            for name, (file_name, _) in self.COLLECTIONS.items():
+                self.write_json_atomic(file_name, state[name])
+            os.remove(self.rotated_log_file)
+            print("Catalog log compacted", flush=True)
+        except Exception as e:
+            print(f"Error compacting the catalog log: {e}", flush=True)
+        finally:
+            self.compacting = False
+
+    def close(self):
+        self.thread_stop.set()
+        self.flush()
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+
+def create_storage(settings=None):
+    """Storage backend selected by the "backend" setting: "json" (default) or "sqlite"."""
+    settings = settings or {}
+    backend = settings.get("backend", "json")
+    if backend == "json":
+        return JsonJournalStorage(settings)
+    if backend == "sqlite":
+        from storage_sqlite import SqliteStorage
+        return SqliteStorage(settings)
+    raise ValueError(f"Unknown storage backend: {backend}")
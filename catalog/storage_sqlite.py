@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import threading
+
+from storage import CatalogStorage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (
+    roomID TEXT PRIMARY KEY,
+    buildingName TEXT NOT NULL,
+    floor TEXT NOT NULL,
+    number TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rooms_location ON rooms (buildingName, floor, number);
+
+CREATE TABLE IF NOT EXISTS devices (
+    deviceID TEXT PRIMARY KEY,
+    roomID TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devices_room ON devices (roomID);
+
+CREATE TABLE IF NOT EXISTS users (
+    userID TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+"""
+
+# Statements are constant strings so that sqlite3 prepares each of them once and reuses it
+PUT_SQL = {
+    "rooms": "INSERT OR REPLACE INTO rooms (roomID, buildingName, floor, number, doc) VALUES (?, ?, ?, ?, ?)",
+    "devices": "INSERT OR REPLACE INTO devices (deviceID, roomID, doc) VALUES (?, ?, ?)",
+    "users": "INSERT OR REPLACE INTO users (userID, doc) VALUES (?, ?)"
+}
+DELETE_SQL = {
+    "rooms": "DELETE FROM rooms WHERE roomID = ?",
+    "devices": "DELETE FROM devices WHERE deviceID = ?",
+    "users": "DELETE FROM users WHERE userID = ?"
+}
+
+
+def row(collection, item):
+    """Parameters of PUT_SQL for an item: the indexed columns and the whole document."""
+    doc = json.dumps(item)
+    if collection == "rooms":
+        return (item["roomID"], str(item["buildingName"]), str(item["floor"]), str(item["number"]), doc)
+    if collection == "devices":
+        return (item["deviceID"], item["roomID"], doc)
+    return (item["userID"], doc)
+
+
+class SqliteStorage(CatalogStorage):
+    """
+    SQLite persistence for the catalog, one table per collection.
+    The database runs in WAL mode: readers never block the writer and each request is
+    committed as one transaction (e.g. a room deleted with all its devices). With the
+    default synchronous=NORMAL a commit is not fsynced, the WAL is at checkpoints, which
+    batches the fsyncs like the fsyncInterval of the JSON backend.
+    An empty database is first filled from the JSON snapshot files.
+    """
+
+    def __init__(self, settings=None):
+        super().__init__()
+        settings = settings or {}
+        self.db_file = settings.get("dbFile", "catalog.db")
+        self.synchronous = settings.get("synchronous", "NORMAL")
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def load(self):
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        self.conn.executescript(SCHEMA)
+
+        if not any(self.conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone() for name in self.COLLECTIONS):
+            self.import_json()
+
+        return {
+            name: [json.loads(doc) for (doc,) in self.conn.execute(f"SELECT doc FROM {name}")]
+            for name in self.COLLECTIONS
+        }
+
+    def import_json(self):
+        """Copy the JSON snapshot files into the database, used on the first start."""
+        with self.conn:
+            for name, (file_name, _) in self.COLLECTIONS.items():
+                items = self.read_json(file_name)
+                self.conn.executemany(PUT_SQL[name], (row(name, item) for item in items))
+                if items:
+                    print(f"Imported {len(items)} {name} from {file_name}", flush=True)
+
+    def append(self, records):
+        with self.lock, self.conn:
+            for op, collection, item_id, item in records:
+                if op == "put":
+                    self.conn.execute(PUT_SQL[collection], row(collection, item))
+                else:
+                    self.conn.execute(DELETE_SQL[collection], (item_id,))
+
+    def close(self):
+        with self.lock:
+            if self.conn is None:
+                return
+            if self.snapshot_provider is not None:
+                # Store the insert-timestamp refreshed from the heartbeats
+                with self.conn:
+                    devices = self.snapshot_provider()["devices"]
+                    self.conn.executemany(PUT_SQL["devices"], (row("devices", device) for device in devices))
+            self.conn.close()
+            self.conn = None
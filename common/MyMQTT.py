@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+
+import senml
+from dispatcher import Dispatcher
+from mqtt_base import MQTTClientBase
+
+
+class MyMQTT(MQTTClientBase):
+    """
+    MQTT client of the services: messages are published with the SenML codec and the received
+    ones are passed decoded to notifier.notify(topic, message). The notifier may be None when
+    every subscription is made with route().
+
+    Settings, the mqttInfos of the services configuration (all optional):
+    - payloadFormat: format of the published payloads, see senml.FORMATS
+    - qos: {"default": 1, "topics": {filter: qos}}, QoS of the publications and subscriptions,
+      the first filter matching a topic wins
+    - maxInflight: QoS 1/2 messages sent and not acknowledged yet before paho queues them
+    - maxQueued: messages waiting in the publish queue, the next ones are dropped
+    - publishBatch: messages handed to paho each time the publisher thread wakes up
+    - reconnectDelay: [min, max] seconds between the connection attempts
+    - dispatcher: {"workers": 1, "queueSize": 1000}, defaults of the routes
+
+    The messages of the filters registered with route() are handled in worker threads (see
+    dispatcher.py), the other ones by notifier.notify() on the network thread of paho, which
+    must then return quickly.
+
+    myPublish() only queues the message, a publisher thread sends it. The connection is made in
+    the background and retried while the broker is not reachable, and the subscriptions are
+    restored on every (re)connection. paho keeps the unacknowledged QoS 1/2 messages and sends
+    them again after a reconnection, QoS 0 messages published while disconnected are dropped.
+    """
+
+    def __init__(self, clientID, broker, port, notifier, settings=None):
+        super().__init__(clientID, broker, port, notifier, settings, Dispatcher())
+        settings = settings or {}
+        self.publish_batch = settings.get("publishBatch", 100)
+        # (topic, payload, qos, retain, time queued), None to stop the publisher thread
+        self.publish_queue = queue.Queue(maxsize=settings.get("maxQueued", 10000))
+        self.publisher_thread = threading.Thread(target=self._publish_loop, daemon=True)
+        # message id -> time acknowledged of the messages acknowledged before _send() stored their id
+        self.early_acks = {}
+
+    def myOnDisconnect(self, paho_mqtt, userdata, rc):
+        if rc != 0:
+            print("Disconnected from %s (%d), reconnecting" % (self.broker, rc), flush=True)
+        self.connected = False
+
+    def myOnPublish(self, paho_mqtt, userdata, mid):
+        # Called once a QoS 0 message is written or a QoS 1/2 message is acknowledged
+        now = time.time()
+        with self.stats_lock:
+            queued = self.unacknowledged.pop(mid, None)
+            if queued is None:
+                # Acknowledged before _send() stored its id
+                self.early_acks[mid] = now
+                return
+            self.acknowledged(now - queued)
+
+    def myPublish(self, topic, msg, retain=False, qos=None):
+        """Queue a message, an empty payload if msg is None. Returns False if the queue is full."""
+        payload = senml.encode(msg, self.payload_format) if msg is not None else None
+        qos = self.qos(topic) if qos is None else qos
+        try:
+            self.publish_queue.put_nowait((topic, payload, qos, retain, time.time()))
+        except queue.Full:
+            self.count(dropped=1)
+            return False
+        return True
+
+    def _send(self, topic, payload, qos, retain, queued):
+        info = self._paho_mqtt.publish(topic, payload, qos, retain)
+        if self.rejected(info, qos):
+            return
+        with self.stats_lock:
+            self.stats["published"] += 1
+            acked = self.early_acks.pop(info.mid, None)
+            if acked is None:
+                self.unacknowledged[info.mid] = queued
+            else:
+                self.acknowledged(acked - queued)
+
+    def _publish_loop(self):
+        while True:
+            batch = [self.publish_queue.get()]
+            while len(batch) < self.publish_batch:
+                try:
+                    batch.append(self.publish_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    return
+                self._send(*item)
+
+    def start(self):
+        # manage connection to broker, in the background
+        self.dispatcher.start()
+        self._paho_mqtt.reconnect_delay_set(*self.reconnect_delay)
+        self._paho_mqtt.connect_async(self.broker, self.port)
+        self._paho_mqtt.loop_start()
+        self.publisher_thread.start()
+
+    def metrics(self):
+        metrics = super().metrics()
+        metrics["queueDepth"] = self.publish_queue.qsize()
+        return metrics
+
+    def stop(self, timeout=5):
+        # Send what is still queued, up to timeout seconds
+        if self.publisher_thread.is_alive():
+            try:
+                self.publish_queue.put(None, timeout=timeout)
+                self.publisher_thread.join(timeout)
+            except queue.Full:
+                pass
+        self.unsubscribe()
+
+        self._paho_mqtt.disconnect()
+        self._paho_mqtt.loop_stop()
+        self.dispatcher.stop(timeout)
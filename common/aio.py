@@ -0,0 +1,327 @@
+import asyncio
+import collections
+import signal
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+import senml
+from dispatcher import TopicTrie
+from mqtt_base import MQTTClientBase
+
+# asyncio runtime of the services: the MQTT client, an HTTP client with pooled connections and
+# the REST server share one event loop, so that a process handles thousands of rooms with
+# coroutines instead of a thread per blocking call. Everything here runs on the thread of the loop.
+
+
+class KeyedTasks:
+    """
+    Runs handler(topic, message), a function or a coroutine function, in one task per key (e.g.
+    a room) with a queue of queueSize messages: the messages of a key are handled in order while
+    the other keys run concurrently. The task of a key ends once its queue is empty, so idle
+    rooms cost nothing. A message whose queue is full is dropped.
+    """
+
+    def __init__(self, name, handler, key=None, queue_size=1000):
+        self.name = name
+        self.handler = handler
+        self.is_coroutine = asyncio.iscoroutinefunction(handler)
+        self.key = key
+        self.queue_size = queue_size
+        # key -> messages waiting, while its task runs
+        self.queues = {}
+        self.tasks = set()
+        self.stats = {
+            "handled": 0,
+            "dropped": 0,
+            "errors": 0,
+            "totalLatencySeconds": 0.0,
+            "maxLatencySeconds": 0.0,
+            "maxWaitSeconds": 0.0
+        }
+
+    def submit(self, topic, message):
+        key = self.key(topic) if self.key is not None else topic
+        q = self.queues.get(key)
+        if q is None:
+            q = self.queues[key] = collections.deque()
+            task = asyncio.ensure_future(self.run(key, q))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        if len(q) >= self.queue_size:
+            self.stats["dropped"] += 1
+            print(f"Queue of {self.name} full, message of {topic} dropped", flush=True)
+            return
+        q.append((time.time(), topic, message))
+
+    async def run(self, key, q):
+        try:
+            while q:
+                received, topic, message = q.popleft()
+                start = time.time()
+                try:
+                    if self.is_coroutine:
+                        await self.handler(topic, message)
+                    else:
+                        self.handler(topic, message)
+                    error = 0
+                except Exception as e:
+                    print(f"Error handling a message of {topic}: {e}", flush=True)
+                    error = 1
+                end = time.time()
+                self.stats["handled"] += 1
+                self.stats["errors"] += error
+                self.stats["totalLatencySeconds"] += end - start
+                self.stats["maxLatencySeconds"] = max(self.stats["maxLatencySeconds"], end - start)
+                self.stats["maxWaitSeconds"] = max(self.stats["maxWaitSeconds"], start - received)
+                # Let the other keys run between two messages of a synchronous handler
+                await asyncio.sleep(0)
+        finally:
+            del self.queues[key]
+
+    async def stop(self, timeout=5):
+        """Wait for the messages already queued to be handled, up to timeout seconds."""
+        if self.tasks:
+            _, pending = await asyncio.wait(list(self.tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    def metrics(self):
+        metrics = dict(self.stats)
+        depths = [len(q) for q in list(self.queues.values())]
+        metrics["activeKeys"] = len(depths)
+        metrics["queueDepth"] = sum(depths)
+        metrics["maxQueueDepth"] = max(depths, default=0)
+        metrics["avgLatencySeconds"] = metrics["totalLatencySeconds"] / metrics["handled"] if metrics["handled"] else 0.0
+        return metrics
+
+
+class AsyncDispatcher:
+    """Routes the received messages to the KeyedTasks of the topic filters they match."""
+
+    def __init__(self):
+        self.trie = TopicTrie()
+        self.executors = {}
+
+    def add(self, topic_filter, handler, key=None, workers=1, queue_size=1000):
+        # workers is unused: the keys run concurrently in tasks of their own
+        executor = KeyedTasks(topic_filter, handler, key, queue_size)
+        self.executors[topic_filter] = executor
+        self.trie.add(topic_filter, executor)
+
+    def dispatch(self, topic, message):
+        """Queue a message in the executors of the matching filters, returns False if there is none."""
+        executors = self.trie.match(topic)
+        for executor in executors:
+            executor.submit(topic, message)
+        return bool(executors)
+
+    async def stop(self, timeout=5):
+        for executor in self.executors.values():
+            await executor.stop(timeout)
+
+    def metrics(self):
+        return {topic_filter: executor.metrics() for topic_filter, executor in list(self.executors.items())}
+
+
+class AsyncMQTT(MQTTClientBase):
+    """
+    MQTT client of the services on the asyncio event loop, with the interface and settings of
+    MyMQTT: paho reads and writes its socket when the loop reports it ready, instead of in its
+    own thread. myPublish() hands the message to paho at once (paho queues up to maxQueued
+    messages beyond the maxInflight ones), publishBatch is unused.
+
+    The handlers of route() may be coroutine functions. The messages of a key are handled in
+    order by one task, the keys run concurrently (see KeyedTasks), so workers is unused.
+    start(), and every other method, must be called from a coroutine running on the loop.
+    """
+
+    def __init__(self, clientID, broker, port, notifier, settings=None):
+        super().__init__(clientID, broker, port, notifier, settings, AsyncDispatcher())
+        settings = settings or {}
+        self.stopping = False
+        self.loop = None
+        self.loop_thread = None
+        self.connect_task = None
+        self.misc_task = None
+
+        self._paho_mqtt.max_queued_messages_set(settings.get("maxQueued", 10000))
+        # The event loop watches the socket of paho
+        self._paho_mqtt.on_socket_open = lambda client, userdata, sock: self._call(
+            self.loop.add_reader, sock.fileno(), self._read)
+        self._paho_mqtt.on_socket_close = lambda client, userdata, sock: self._call(
+            self.loop.remove_reader, sock.fileno())
+        self._paho_mqtt.on_socket_register_write = lambda client, userdata, sock: self._call(
+            self.loop.add_writer, sock.fileno(), self._write)
+        self._paho_mqtt.on_socket_unregister_write = lambda client, userdata, sock: self._call(
+            self.loop.remove_writer, sock.fileno())
+
+    def _call(self, function, *args):
+        # paho opens the socket in reconnect(), which runs in a thread of the executor
+        if threading.get_ident() == self.loop_thread:
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def _read(self):
+        self._paho_mqtt.loop_read()
+
+    def _write(self):
+        self._paho_mqtt.loop_write()
+
+    async def _misc_loop(self):
+        # Keepalive pings and retries of the unacknowledged messages
+        while True:
+            await asyncio.sleep(1)
+            self._paho_mqtt.loop_misc()
+
+    async def _connect(self, delay):
+        """Connect, retrying with an exponential backoff while the broker is not reachable."""
+        while not self.stopping:
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                # Resolving the name and connecting block, out of the loop
+                await self.loop.run_in_executor(None, self._paho_mqtt.reconnect)
+                return
+            except (OSError, ValueError) as e:
+                print(f"Cannot connect to {self.broker}:{self.port}: {e}", flush=True)
+            delay = min(max(delay * 2, self.reconnect_delay[0]), self.reconnect_delay[1])
+
+    def _start_connecting(self, delay):
+        if self.connect_task is None or self.connect_task.done():
+            self.connect_task = self.loop.create_task(self._connect(delay))
+
+    def myOnDisconnect(self, paho_mqtt, userdata, rc):
+        self.connected = False
+        if self.stopping:
+            return
+        print("Disconnected from %s (%d), reconnecting" % (self.broker, rc), flush=True)
+        self._start_connecting(self.reconnect_delay[0])
+
+    def myOnPublish(self, paho_mqtt, userdata, mid):
+        # Called once a QoS 0 message is written or a QoS 1/2 message is acknowledged, on the
+        # loop after myPublish() stored its id
+        published = self.unacknowledged.pop(mid, None)
+        if published is None:
+            return
+        with self.stats_lock:
+            self.acknowledged(time.time() - published)
+
+    def myPublish(self, topic, msg, retain=False, qos=None):
+        """Publish a message, an empty payload if msg is None. Returns False if it was dropped."""
+        payload = senml.encode(msg, self.payload_format) if msg is not None else None
+        qos = self.qos(topic) if qos is None else qos
+        info = self._paho_mqtt.publish(topic, payload, qos, retain)
+        if self.rejected(info, qos):
+            return False
+        self.count(published=1)
+        self.unacknowledged[info.mid] = time.time()
+        return True
+
+    def start(self):
+        # manage connection to broker, in the background
+        self.loop = asyncio.get_event_loop()
+        self.loop_thread = threading.get_ident()
+        self._paho_mqtt.connect_async(self.broker, self.port)
+        self.misc_task = self.loop.create_task(self._misc_loop())
+        self._start_connecting(0)
+
+    async def stop(self, timeout=5):
+        """Handle the messages received and wait for the acknowledgements, up to timeout seconds."""
+        deadline = time.time() + timeout
+        await self.dispatcher.stop(timeout)
+        while self.unacknowledged and self.connected and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        self.stopping = True
+        if self.connected:
+            self.unsubscribe()
+            self._paho_mqtt.disconnect()
+            # paho closes the socket once the DISCONNECT packet is written
+            while self.connected and time.time() < deadline:
+                await asyncio.sleep(0.05)
+        for task in (self.connect_task, self.misc_task):
+            if task is not None:
+                task.cancel()
+
+
+class HttpClient:
+    """
+    HTTP client keeping its connections alive, to call the catalog, the adaptors and the
+    actuators of every room with a few sockets. Use it with async with, or start() and close().
+
+    Settings (all optional): {"connections": 100, "connectionsPerHost": 20, "keepAlive": 30, "timeout": 10}
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings or {}
+        self.session = None
+
+    async def start(self):
+        # The session must be created on the loop
+        connector = aiohttp.TCPConnector(
+            limit=self.settings.get("connections", 100),
+            limit_per_host=self.settings.get("connectionsPerHost", 20),
+            keepalive_timeout=self.settings.get("keepAlive", 30)
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.settings.get("timeout", 10))
+        )
+        return self
+
+    async def close(self):
+        await self.session.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self, method, url, params=None, headers=None):
+        """Status, headers and body of a response."""
+        async with self.session.request(method, url, params=params, headers=headers) as response:
+            return response.status, response.headers, await response.read()
+
+    async def get_json(self, url, params=None, headers=None):
+        """Decoded JSON body of a GET. Raises aiohttp.ClientError, also for the error statuses."""
+        async with self.session.get(url, params=params, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+
+async def get_broker(http, catalog_ip, catalog_port, default=None):
+    """(ip, port) of the broker from the catalog, default if it is given and the catalog cannot answer."""
+    try:
+        broker_info = await http.get_json(f"http://{catalog_ip}:{catalog_port}/broker")
+        print(f"Broker retrieved: {broker_info['ip']}:{broker_info['port']}", flush=True)
+        return broker_info["ip"], broker_info["port"]
+    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+        if default is None:
+            raise
+        print(f"Error retrieving broker information: {e}", flush=True)
+        return default
+
+
+async def serve(routes, host="0.0.0.0", port=8080):
+    """Serve the routes (aiohttp.web route definitions), returns the runner to cleanup() on shutdown."""
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def run(main):
+    """Run the coroutine main(stopped) of a service, the event stopped is set on SIGINT or SIGTERM."""
+    async def run_main():
+        stopped = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+        await main(stopped)
+
+    asyncio.run(run_main())
@@ -0,0 +1,82 @@
+import statistics
+import sys
+import threading
+import time
+
+from MyMQTT import MyMQTT
+
+# Publish throughput and end-to-end latency of MyMQTT for each QoS, against a local broker
+# (docker compose up broker, the mosquitto of broker/).
+# Usage: python3 benchmark_mqtt.py [messages] [host] [port]
+
+TOPIC = "/bench/1/1/pollutants"
+
+
+class Receiver:
+    def __init__(self, expected):
+        self.expected = expected
+        self.latencies = []
+        self.done = threading.Event()
+
+    def notify(self, topic, message):
+        self.latencies.append(time.time() - message["bt"])
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+
+class Sender:
+    def notify(self, topic, message):
+        pass
+
+
+def wait_connected(client, timeout=10):
+    deadline = time.time() + timeout
+    while not client.connected:
+        if time.time() > deadline:
+            raise SystemExit(f"Broker not reachable at {client.broker}:{client.port}")
+        time.sleep(0.05)
+
+
+def run(n_messages, qos, host, port):
+    receiver = Receiver(n_messages)
+    subscriber = MyMQTT(f"bench-sub-{qos}", host, port, receiver, {"qos": {"default": qos}})
+    publisher = MyMQTT(f"bench-pub-{qos}", host, port, Sender(), {"qos": {"default": qos}, "maxQueued": n_messages})
+    subscriber.start()
+    publisher.start()
+    wait_connected(subscriber)
+    wait_connected(publisher)
+    subscriber.mySubscribe(TOPIC)
+    time.sleep(0.5)
+
+    start = time.time()
+    for i in range(n_messages):
+        publisher.myPublish(TOPIC, {"bn": TOPIC, "bt": time.time(), "e": [{"n": "PM2.5", "u": "ug/m3", "v": i}]})
+    queued = time.time() - start
+    received = receiver.done.wait(60)
+    elapsed = time.time() - start
+    metrics = publisher.metrics()
+    publisher.stop()
+    subscriber.stop()
+
+    latencies = sorted(receiver.latencies)
+    return {
+        "received": len(latencies) if received else f"{len(latencies)} (timeout)",
+        "publishCallUs": queued / n_messages * 1e6,
+        "messagesPerSecond": len(latencies) / elapsed,
+        "medianLatencyMs": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99LatencyMs": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0,
+        "ackLatencyMs": metrics["avgLatencySeconds"] * 1000
+    }
+
+
+if __name__ == '__main__':
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    host = sys.argv[2] if len(sys.argv) > 2 else "localhost"
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 1883
+    print(f"{'qos':<4} {'received':>9} {'publish (us)':>13} {'msg/s':>8} {'median (ms)':>12} {'p99 (ms)':>9} {'ack (ms)':>9}")
+    for qos in (0, 1, 2):
+        result = run(n_messages, qos, host, port)
+        print(
+            f"{qos:<4} {result['received']:>9} {result['publishCallUs']:>13.1f} {result['messagesPerSecond']:>8.0f}"
+            f" {result['medianLatencyMs']:>12.1f} {result['p99LatencyMs']:>9.1f} {result['ackLatencyMs']:>9.1f}"
+        )
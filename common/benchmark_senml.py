@@ -0,0 +1,47 @@
+import random
+import time
+import timeit
+
+import senml
+
+# CPU time per message to publish (encode) and receive (decode) a pollutants message of the
+# sensors, with the legacy double JSON encoding and with the formats of the shared codec.
+# Usage: python3 benchmark_senml.py
+
+NUMBER = 20000
+REPEAT = 5
+
+
+def pollutants_message():
+    return {
+        'bn': "/A/1/1/pollutants",
+        'bt': time.time(),
+        'e': [
+            {'n': 'PM2.5', 'u': 'ug/m3', 'v': random.uniform(12.1, 35.4)},
+            {'n': 'O3', 'u': 'ug/m3', 'v': random.uniform(55, 124)},
+            {'n': 'NO2', 'u': 'ug/m3', 'v': random.uniform(54, 100)},
+            {'n': 'SO2', 'u': 'ug/m3', 'v': random.uniform(36, 185)},
+            {'n': 'PM10', 'u': 'ug/m3', 'v': random.uniform(25.1, 50.4)}
+        ]
+    }
+
+
+def best_us(statement):
+    return min(timeit.repeat(statement, number=NUMBER, repeat=REPEAT)) / NUMBER * 1e6
+
+
+if __name__ == '__main__':
+    message = pollutants_message()
+    legacy_us = None
+    print(f"{'format':<8} {'bytes':>6} {'encode (us)':>12} {'decode (us)':>12} {'total (us)':>11} {'saved':>7}")
+    for payload_format in ("legacy", "json", "cbor"):
+        payload = senml.encode(message, payload_format)
+        assert senml.decode(payload) == message
+        encode_us = best_us(lambda: senml.encode(message, payload_format))
+        decode_us = best_us(lambda: senml.decode(payload))
+        total_us = encode_us + decode_us
+        legacy_us = legacy_us or total_us
+        print(
+            f"{payload_format:<8} {len(payload):>6} {encode_us:>12.2f} {decode_us:>12.2f} {total_us:>11.2f}"
+            f" {1 - total_us / legacy_us:>7.0%}"
+        )
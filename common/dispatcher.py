@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+import zlib
+
+
+def room_key(topic):
+    """Key of the messages of a room: /<building>/<floor>/<room>/<measure> without the measure."""
+    return topic.rsplit("/", 1)[0]
+
+
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class TopicTrie:
+    """Topic filters (with + and # wildcards) split by level, matched in one walk of the topic levels."""
+
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, topic_filter, value):
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.values.append(value)
+
+    def match(self, topic):
+        """Values of the filters matching a topic."""
+        levels = topic.split("/")
+        matches = []
+        nodes = [self.root]
+        for i, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                # A # matches the rest of the topic, but not the topics starting with $ (e.g. $SYS)
+                rest = node.children.get("#")
+                if rest is not None and not (i == 0 and level.startswith("$")):
+                    matches.extend(rest.values)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                child = node.children.get("+")
+                if child is not None and not (i == 0 and level.startswith("$")):
+                    next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                return matches
+        for node in nodes:
+            matches.extend(node.values)
+            # "a/#" also matches "a"
+            rest = node.children.get("#")
+            if rest is not None:
+                matches.extend(rest.values)
+        return matches
+
+
+class KeyedExecutor:
+    """
+    Runs handler(topic, message) in `workers` threads, each with a queue of queueSize messages.
+    The messages of a key (e.g. a room) always go to the same worker, so they are handled in
+    order while the other keys run in parallel. A message whose queue is full is dropped.
+    """
+
+    def __init__(self, name, handler, key=None, workers=1, queue_size=1000):
+        self.name = name
+        self.handler = handler
+        self.key = key
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self.run, args=(q,), name=f"{name}-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "handled": 0,
+            "dropped": 0,
+            "errors": 0,
+            "totalLatencySeconds": 0.0,
+            "maxLatencySeconds": 0.0,
+            "maxWaitSeconds": 0.0
+        }
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, topic, message):
+        key = self.key(topic) if self.key is not None else topic
+        # crc32 is stable, unlike hash() of strings, so a key keeps its worker across restarts
+        q = self.queues[zlib.crc32(key.encode("utf-8")) % len(self.queues)]
+        try:
+            q.put_nowait((time.time(), topic, message))
+        except queue.Full:
+            with self.stats_lock:
+                self.stats["dropped"] += 1
+            print(f"Queue of {self.name} full, message of {topic} dropped", flush=True)
+
+    def run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            received, topic, message = item
+            start = time.time()
+            try:
+                self.handler(topic, message)
+                error = 0
+            except Exception as e:
+                print(f"Error handling a message of {topic}: {e}", flush=True)
+                error = 1
+            end = time.time()
+            with self.stats_lock:
+                self.stats["handled"] += 1
+                self.stats["errors"] += error
+                self.stats["totalLatencySeconds"] += end - start
+                self.stats["maxLatencySeconds"] = max(self.stats["maxLatencySeconds"], end - start)
+                self.stats["maxWaitSeconds"] = max(self.stats["maxWaitSeconds"], start - received)
+
+    def stop(self, timeout=5):
+        """Stop the workers once they handled the messages already queued, up to timeout seconds."""
+        deadline = time.time() + timeout
+        for q in self.queues:
+            try:
+                q.put(None, timeout=max(deadline - time.time(), 0))
+            except queue.Full:
+                pass
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join(max(deadline - time.time(), 0))
+
+    def metrics(self):
+        with self.stats_lock:
+            metrics = dict(self.stats)
+        metrics["queueDepth"] = sum(q.qsize() for q in self.queues)
+        metrics["maxQueueDepth"] = max(q.qsize() for q in self.queues)
+        metrics["avgLatencySeconds"] = metrics["totalLatencySeconds"] / metrics["handled"] if metrics["handled"] else 0.0
+        return metrics
+
+
+class Dispatcher:
+    """Routes the received messages to the executors of the topic filters they match."""
+
+    def __init__(self):
+        self.trie = TopicTrie()
+        self.executors = {}
+        self.started = False
+
+    def add(self, topic_filter, handler, key=None, workers=1, queue_size=1000):
+        executor = KeyedExecutor(topic_filter, handler, key, workers, queue_size)
+        self.executors[topic_filter] = executor
+        self.trie.add(topic_filter, executor)
+        if self.started:
+            executor.start()
+
+    def start(self):
+        self.started = True
+        for executor in self.executors.values():
+            executor.start()
+
+    def dispatch(self, topic, message):
+        """Queue a message in the executors of the matching filters, returns False if there is none."""
+        executors = self.trie.match(topic)
+        for executor in executors:
+            executor.submit(topic, message)
+        return bool(executors)
+
+    def stop(self, timeout=5):
+        for executor in self.executors.values():
+            executor.stop(timeout)
+
+    def metrics(self):
+        return {topic_filter: executor.metrics() for topic_filter, executor in self.executors.items()}
@@ -0,0 +1,144 @@
+import threading
+
+import paho.mqtt.client as PahoMQTT
+
+import senml
+
+
+class MQTTClientBase:
+    """
+    What MyMQTT and aio.AsyncMQTT share: the settings (see MyMQTT), the QoS of the topics, the
+    statistics of the publications, the subscriptions restored on every (re)connection and the
+    routes of the received messages. The subclasses run the network loop of paho, in its
+    thread or on the event loop, and pass the dispatcher running the routes (a
+    dispatcher.Dispatcher or an aio.AsyncDispatcher).
+    """
+
+    def __init__(self, clientID, broker, port, notifier, settings, dispatcher):
+        settings = settings or {}
+        self.broker = broker
+        self.port = port
+        self.notifier = notifier
+        self.clientID = clientID
+        self.payload_format = settings.get("payloadFormat", "json")
+        qos = settings.get("qos", {})
+        self.default_qos = qos.get("default", 1)
+        self.qos_filters = list(qos.get("topics", {}).items())
+        self.qos_cache = {}
+        self.reconnect_delay = settings.get("reconnectDelay", [1, 60])
+        self.route_settings = settings.get("dispatcher", {})
+        self.dispatcher = dispatcher
+
+        # topic filter -> QoS of the subscriptions to restore on reconnection
+        self._topics = {}
+        self.connected = False
+        self.was_connected = False
+
+        # message id -> time queued of the messages sent and not acknowledged yet
+        self.stats_lock = threading.Lock()
+        self.unacknowledged = {}
+        self.stats = {
+            "published": 0,
+            "acknowledged": 0,
+            "dropped": 0,
+            "reconnections": 0,
+            "totalLatencySeconds": 0.0,
+            "maxLatencySeconds": 0.0
+        }
+
+        # create an instance of paho.mqtt.client
+        self._paho_mqtt = PahoMQTT.Client(clientID, True)
+        self._paho_mqtt.max_inflight_messages_set(settings.get("maxInflight", 20))
+        # register the callback
+        self._paho_mqtt.on_connect = self.myOnConnect
+        self._paho_mqtt.on_disconnect = self.myOnDisconnect
+        self._paho_mqtt.on_message = self.myOnMessageReceived
+        self._paho_mqtt.on_publish = self.myOnPublish
+
+    def qos(self, topic):
+        """QoS of a topic (or topic filter) from the qos settings."""
+        qos = self.qos_cache.get(topic)
+        if qos is None:
+            qos = self.default_qos
+            for topic_filter, filter_qos in self.qos_filters:
+                if topic_filter == topic or PahoMQTT.topic_matches_sub(topic_filter, topic):
+                    qos = filter_qos
+                    break
+            self.qos_cache[topic] = qos
+        return qos
+
+    def myOnConnect(self, paho_mqtt, userdata, flags, rc):
+        print("Connected to %s with result code: %d" % (self.broker, rc), flush=True)
+        if rc != 0:
+            return
+        if self.was_connected:
+            self.count(reconnections=1)
+        self.connected = self.was_connected = True
+        # A clean session starts without subscriptions
+        topics = list(self._topics.items())
+        if topics:
+            self._paho_mqtt.subscribe(topics)
+
+    def myOnMessageReceived(self, paho_mqtt, userdata, msg):
+        # A new message is received, passed decoded to its route or to the notifier
+        try:
+            message = senml.decode(msg.payload)
+        except ValueError as e:
+            print(f"Invalid payload on {msg.topic}: {e}", flush=True)
+            return
+        if not self.dispatcher.dispatch(msg.topic, message) and self.notifier is not None:
+            self.notifier.notify(msg.topic, message)
+
+    def rejected(self, info, qos):
+        """Whether paho refused a message: QoS 0 ones are dropped while disconnected, QoS 1/2 ones kept for the reconnection."""
+        rejected = info.rc not in (PahoMQTT.MQTT_ERR_SUCCESS, PahoMQTT.MQTT_ERR_NO_CONN) or (
+            info.rc == PahoMQTT.MQTT_ERR_NO_CONN and qos == 0)
+        if rejected:
+            self.count(dropped=1)
+        return rejected
+
+    def acknowledged(self, latency):
+        self.stats["acknowledged"] += 1
+        self.stats["totalLatencySeconds"] += latency
+        self.stats["maxLatencySeconds"] = max(self.stats["maxLatencySeconds"], latency)
+
+    def count(self, **increments):
+        with self.stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def route(self, topic_filter, handler, key=None, workers=None, queue_size=None):
+        """
+        Subscribe to a topic filter and run handler(topic, message) for its messages in the
+        dispatcher. The messages with the same key(topic) (the topic by default, e.g.
+        dispatcher.room_key for the rooms) are handled in order.
+        """
+        self.dispatcher.add(
+            topic_filter, handler, key,
+            workers or self.route_settings.get("workers", 1),
+            queue_size or self.route_settings.get("queueSize", 1000)
+        )
+        self.mySubscribe(topic_filter)
+
+    def mySubscribe(self, topic, qos=None):
+        qos = self.qos(topic) if qos is None else qos
+        self._topics[topic] = qos
+        # Otherwise the subscription is made once connected
+        if self.connected:
+            self._paho_mqtt.subscribe(topic, qos)
+        print("subscribed to %s" % (topic), flush=True)
+
+    def unsubscribe(self):
+        for topic in self._topics:
+            self._paho_mqtt.unsubscribe(topic)
+        self._topics = {}
+
+    def metrics(self):
+        with self.stats_lock:
+            metrics = dict(self.stats)
+            metrics["inflight"] = len(self.unacknowledged)
+        metrics["avgLatencySeconds"] = (
+            metrics["totalLatencySeconds"] / metrics["acknowledged"] if metrics["acknowledged"] else 0.0
+        )
+        metrics["routes"] = self.dispatcher.metrics()
+        return metrics
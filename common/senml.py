@@ -0,0 +1,204 @@
+import json
+import math
+import numbers
+import struct
+
+# SenML codec of the MQTT payloads, shared by the services (copied next to MyMQTT.py in their images).
+# A message is encoded once, as compact JSON or as CBOR with the integer labels of SenML (RFC 8428).
+# Decoding detects the format, and still accepts the JSON string of a JSON document that the
+# services used to publish ("legacy" format).
+
+FORMATS = ("json", "cbor", "legacy")
+
+# Integer labels of SenML-CBOR, RFC 8428 section 6
+LABELS = {
+    "bver": -1, "bn": -2, "bt": -3, "bu": -4, "bv": -5, "bs": -6,
+    "n": 0, "u": 1, "v": 2, "vs": 3, "vb": 4, "s": 5, "t": 6, "ut": 7, "vd": 8
+}
+LABEL_NAMES = {label: name for name, label in LABELS.items()}
+
+# Created once: json.dumps() builds a new encoder on every call with non-default separators
+_JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+class Record:
+    """A resolved SenML entry: its time is absolute (base time + time) and value is v, vs or vb."""
+    __slots__ = ("name", "unit", "value", "time")
+
+    def __init__(self, name, unit, value, time):
+        self.name = name
+        self.unit = unit
+        self.value = value
+        self.time = time
+
+    def is_numeric(self):
+        return isinstance(self.value, numbers.Real) and not isinstance(self.value, bool)
+
+    def __repr__(self):
+        return f"Record({self.name!r}, {self.unit!r}, {self.value!r}, {self.time!r})"
+
+
+def records(pack):
+    """
+    Records of a SenML message: a record or a list of them, with their entries in "e" or not.
+    The base time bt and base unit bu carry over to the next records.
+    """
+    base_time = 0
+    base_unit = None
+    for record in pack if isinstance(pack, list) else [pack]:
+        base_time = record.get("bt", base_time)
+        base_unit = record.get("bu", base_unit)
+        for entry in record.get("e", [record]):
+            if "n" not in entry:
+                continue
+            value = entry.get("v", entry.get("vs", entry.get("vb")))
+            yield Record(entry["n"], entry.get("u", base_unit), value, base_time + entry.get("t", 0))
+
+
+def encode(message, payload_format="json"):
+    """Payload of a message in one of FORMATS."""
+    if payload_format == "json":
+        return _JSON_ENCODER.encode(message).encode("utf-8")
+    if payload_format == "cbor":
+        out = []
+        _cbor_encode(message, out)
+        return b"".join(out)
+    if payload_format == "legacy":
+        return json.dumps(json.dumps(message)).encode("utf-8")
+    raise ValueError(f"Unknown payload format '{payload_format}', expected one of {', '.join(FORMATS)}")
+
+
+def decode(payload):
+    """Message of a payload of any of FORMATS, None for an empty payload. Raises ValueError if it is invalid."""
+    if not payload:
+        return None
+    # Every CBOR map or array starts with a byte >= 0x80, a JSON document with an ASCII character
+    if payload[0] >= 0x80:
+        try:
+            message, end = _cbor_decode(payload, 0)
+        except (IndexError, struct.error):
+            raise ValueError("Truncated CBOR message")
+        if end != len(payload):
+            raise ValueError("Trailing bytes after the CBOR message")
+        return message
+    message = json.loads(payload)
+    if isinstance(message, str):
+        # Legacy payload: a JSON string holding the JSON message
+        try:
+            return json.loads(message)
+        except ValueError:
+            return message
+    return message
+
+
+# ----------------------------------------------------------------------
+# Minimal CBOR (RFC 8949): null, booleans, integers, floats, strings, bytes, arrays and maps.
+
+def _cbor_head(major, n):
+    if n < 24:
+        return bytes((major << 5 | n,))
+    if n < 0x100:
+        return bytes((major << 5 | 24, n))
+    if n < 0x10000:
+        return struct.pack(">BH", major << 5 | 25, n)
+    if n < 0x100000000:
+        return struct.pack(">BI", major << 5 | 26, n)
+    return struct.pack(">BQ", major << 5 | 27, n)
+
+
+def _cbor_encode(value, out):
+    if value is None:
+        out.append(b"\xf6")
+    elif value is True:
+        out.append(b"\xf5")
+    elif value is False:
+        out.append(b"\xf4")
+    elif isinstance(value, int):
+        out.append(_cbor_head(0, value) if value >= 0 else _cbor_head(1, -1 - value))
+    elif isinstance(value, float):
+        # Single precision when it is exact, e.g. most timestamps are not but rounded readings are
+        try:
+            single = struct.pack(">f", value)
+        except OverflowError:
+            single = None
+        if single is not None and (struct.unpack(">f", single)[0] == value or math.isnan(value)):
+            out.append(b"\xfa" + single)
+        else:
+            out.append(b"\xfb" + struct.pack(">d", value))
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out.append(_cbor_head(3, len(data)))
+        out.append(data)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_cbor_head(2, len(value)))
+        out.append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        out.append(_cbor_head(4, len(value)))
+        for item in value:
+            _cbor_encode(item, out)
+    elif isinstance(value, dict):
+        out.append(_cbor_head(5, len(value)))
+        for key, item in value.items():
+            _cbor_encode(LABELS.get(key, key), out)
+            _cbor_encode(item, out)
+    else:
+        raise TypeError(f"Object of type {type(value).__name__} cannot be encoded in CBOR")
+
+
+def _cbor_length(payload, info, offset):
+    """Argument of a data item head and the offset after it."""
+    if info < 24:
+        return info, offset
+    if info == 24:
+        return payload[offset], offset + 1
+    if info == 25:
+        return struct.unpack_from(">H", payload, offset)[0], offset + 2
+    if info == 26:
+        return struct.unpack_from(">I", payload, offset)[0], offset + 4
+    if info == 27:
+        return struct.unpack_from(">Q", payload, offset)[0], offset + 8
+    raise ValueError("Indefinite length CBOR items are not supported")
+
+
+def _cbor_decode(payload, offset):
+    """Data item starting at offset and the offset after it."""
+    initial = payload[offset]
+    major, info = initial >> 5, initial & 0x1f
+    offset += 1
+    if major == 7:
+        if info == 20:
+            return False, offset
+        if info == 21:
+            return True, offset
+        if info in (22, 23):
+            return None, offset
+        if info == 25:
+            return struct.unpack_from(">e", payload, offset)[0], offset + 2
+        if info == 26:
+            return struct.unpack_from(">f", payload, offset)[0], offset + 4
+        if info == 27:
+            return struct.unpack_from(">d", payload, offset)[0], offset + 8
+        raise ValueError(f"Unsupported CBOR simple value {info}")
+    n, offset = _cbor_length(payload, info, offset)
+    if major == 0:
+        return n, offset
+    if major == 1:
+        return -1 - n, offset
+    if major == 2:
+        return bytes(payload[offset:offset + n]), offset + n
+    if major == 3:
+        return bytes(payload[offset:offset + n]).decode("utf-8"), offset + n
+    if major == 4:
+        items = []
+        for _ in range(n):
+            item, offset = _cbor_decode(payload, offset)
+            items.append(item)
+        return items, offset
+    if major == 5:
+        items = {}
+        for _ in range(n):
+            key, offset = _cbor_decode(payload, offset)
+            value, offset = _cbor_decode(payload, offset)
+            items[LABEL_NAMES.get(key, key)] = value
+        return items, offset
+    raise ValueError(f"Unsupported CBOR major type {major}")
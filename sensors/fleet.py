@@ -0,0 +1,197 @@
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+from MyMQTT import MyMQTT
+from sensor import SensorSimulator, POLLUTANTS
+
+# Load generator of the end-to-end benchmarks: N virtual rooms publishing their pollutants
+# messages at a given total rate. Each round draws the readings of every room at once and
+# publishes one message per room, spread over the round to keep the rate.
+# Usage: python3 fleet.py [rooms] [messages per second, 0 for as fast as possible] [seconds, 0 until Ctrl+C]
+# The other settings are the "fleet" section of config-sensor.json.
+
+
+class SensorFleet:
+    """
+    Settings (all optional):
+    - rooms: number of virtual rooms, numbered /<building>/<floor>/<room> with roomsPerFloor per floor
+    - rate: messages per second of the whole fleet, 0 to publish as fast as MyMQTT queues them
+    - duration: seconds to run, 0 until interrupted
+    - mode: good, moderate or bad, see SensorSimulator
+    - register: create the rooms and their devices in the catalog, in bulk, and send their heartbeats
+    - registerBatch: rooms or devices per catalog request
+    - heartbeatInterval: seconds between two batched heartbeats of the devices
+    - reportInterval: seconds between two reports of the achieved rate
+    - mqtt: settings of MyMQTT overriding the mqttInfos of the sensor
+    """
+
+    def __init__(self, config, settings):
+        self.config = config
+        self.n_rooms = settings.get("rooms", 1000)
+        self.rate = settings.get("rate", 1000)
+        self.duration = settings.get("duration", 0)
+        self.building = settings.get("building", "Fleet")
+        self.rooms_per_floor = settings.get("roomsPerFloor", 100)
+        self.register = settings.get("register", False)
+        self.register_batch = settings.get("registerBatch", 1000)
+        self.heartbeat_interval = settings.get("heartbeatInterval", 60)
+        self.report_interval = settings.get("reportInterval", 10)
+        self.simulator = SensorSimulator(settings.get("mode", "moderate"), np.random.default_rng())
+
+        # (floor, number) of each room, in publishing order
+        self.locations = [(i // self.rooms_per_floor + 1, i % self.rooms_per_floor + 1) for i in range(self.n_rooms)]
+        self.topics = [f"/{self.building}/{floor}/{number}/pollutants" for floor, number in self.locations]
+        # deviceID -> index of its room
+        self.devices = {}
+        self.thread_stop = threading.Event()
+        self.deadline = None
+        self.stats = {"queued": 0, "dropped": 0, "rounds": 0}
+
+        self.catalog_url = f"http://{config['catalog']['ip']}:{config['catalog']['port']}"
+        broker_info = requests.get(f"{self.catalog_url}/broker").json()
+        mqtt_settings = dict(config["mqttInfos"], **settings.get("mqtt", {}))
+        self.mqtt_client = MyMQTT(
+            f"{config['mqttInfos']['clientId']}-fleet", broker_info["ip"], broker_info["port"], None, mqtt_settings
+        )
+
+    def _rooms_in_catalog(self):
+        """roomID of each room, creating the rooms missing in the catalog."""
+        response = requests.get(f"{self.catalog_url}/rooms", params={"building": self.building, "fields": "roomID,floor,number"})
+        response.raise_for_status()
+        existing = {(str(room["floor"]), str(room["number"])): room["roomID"] for room in response.json()}
+        missing = [i for i, (floor, number) in enumerate(self.locations) if (str(floor), str(number)) not in existing]
+        for start in range(0, len(missing), self.register_batch):
+            batch = missing[start:start + self.register_batch]
+            response = requests.post(f"{self.catalog_url}/rooms", json=[{
+                "number": self.locations[i][1],
+                "floor": self.locations[i][0],
+                "buildingName": self.building,
+                "openingHours": {"start": "00:00", "end": "23:59"},
+                "coordinates": {"lat": 45.07, "lon": 7.67}
+            } for i in batch])
+            response.raise_for_status()
+            for room in response.json():
+                existing[(str(room["floor"]), str(room["number"]))] = room["roomID"]
+        print(f"{len(missing)} rooms created in the catalog, {self.n_rooms - len(missing)} already there", flush=True)
+        return [existing[(str(floor), str(number))] for floor, number in self.locations]
+
+    def _register_devices(self, room_indexes):
+        """Register the devices of rooms in the catalog, registerBatch devices per request."""
+        for start in range(0, len(room_indexes), self.register_batch):
+            batch = room_indexes[start:start + self.register_batch]
+            response = requests.post(f"{self.catalog_url}/devices", json=[{
+                "ip": self.config["ip"],
+                "port": self.config["port"],
+                "endpoints": {"mqtt": {"topics": [self.topics[i].replace("/pollutants", "/aqi"), self.topics[i]]}},
+                "availableResources": ["aqi", "pollutants"],
+                "roomID": self.room_ids[i]
+            } for i in batch])
+            response.raise_for_status()
+            for i, device in zip(batch, response.json()):
+                self.devices[device["deviceID"]] = i
+
+    def _heartbeat(self):
+        # One request for all the devices, registering again the expired ones
+        while not self.thread_stop.wait(self.heartbeat_interval):
+            try:
+                response = requests.post(f"{self.catalog_url}/devices/heartbeat", json={"deviceIDs": list(self.devices)})
+                response.raise_for_status()
+                unknown = response.json()["unknown"]
+                if unknown:
+                    print(f"{len(unknown)} devices expired at the catalog, registering them again", flush=True)
+                    self._register_devices([self.devices.pop(device_id) for device_id in unknown])
+            except (requests.RequestException, ValueError) as e:
+                print(f"Error sending the heartbeats: {e}", flush=True)
+
+    def publish_round(self, round_start):
+        """Publish one message per room, paced to the rate from round_start."""
+        readings = self.simulator.simulate_rooms(self.n_rooms).tolist()
+        # Pace by slices of about 10 ms of messages
+        step = max(1, int(self.rate * 0.01)) if self.rate else self.n_rooms
+        for start in range(0, self.n_rooms, step):
+            if self.deadline is not None and time.time() >= self.deadline:
+                self.thread_stop.set()
+            if self.thread_stop.is_set():
+                return
+            if self.rate:
+                delay = round_start + start / self.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            timestamp = time.time()
+            for topic, values in zip(self.topics[start:start + step], readings[start:start + step]):
+                message = {
+                    'bn': topic,
+                    'bt': timestamp,
+                    'e': [{'n': name, 'u': 'ug/m3', 'v': value} for name, value in zip(POLLUTANTS, values)]
+                }
+                if self.mqtt_client.myPublish(topic, message):
+                    self.stats["queued"] += 1
+                else:
+                    self.stats["dropped"] += 1
+        self.stats["rounds"] += 1
+
+    def _report(self, start):
+        # Rates since the previous report
+        previous = (start, 0, 0, 0)
+        while not self.thread_stop.wait(self.report_interval):
+            metrics = self.mqtt_client.metrics()
+            current = (time.time(), self.stats["queued"], metrics["published"], metrics["acknowledged"])
+            interval = current[0] - previous[0]
+            print(
+                f"{current[0] - start:7.1f} s: {(current[1] - previous[1]) / interval:8.0f} msg/s queued,"
+                f" {(current[2] - previous[2]) / interval:8.0f} msg/s sent,"
+                f" {(current[3] - previous[3]) / interval:8.0f} msg/s acknowledged,"
+                f" {self.stats['dropped'] + metrics['dropped']} dropped, queue {metrics['queueDepth']}",
+                flush=True
+            )
+            previous = current
+
+    def run(self):
+        self.mqtt_client.start()
+        if self.register:
+            self.room_ids = self._rooms_in_catalog()
+            self._register_devices(list(range(self.n_rooms)))
+            print(f"{len(self.devices)} devices registered in the catalog", flush=True)
+            threading.Thread(target=self._heartbeat, daemon=True).start()
+
+        while not self.mqtt_client.connected:
+            time.sleep(0.1)
+        print(f"Publishing {self.n_rooms} rooms at {self.rate or 'max'} msg/s", flush=True)
+        start = time.time()
+        if self.duration:
+            self.deadline = start + self.duration
+        threading.Thread(target=self._report, args=(start,), daemon=True).start()
+        round_start = start
+        try:
+            while not self.thread_stop.is_set():
+                self.publish_round(round_start)
+                if self.rate:
+                    # The next round starts when this one should have ended, to keep the average rate
+                    round_start = max(round_start + self.n_rooms / self.rate, time.time() - 1)
+        except KeyboardInterrupt:
+            pass
+        self.thread_stop.set()
+        elapsed = time.time() - start
+        self.mqtt_client.stop()
+        metrics = self.mqtt_client.metrics()
+        print(
+            f"{self.stats['rounds']} rounds in {elapsed:.1f} s: {metrics['published'] / elapsed:.0f} msg/s sent"
+            f" ({self.rate or 'max'} requested), {metrics['acknowledged']} acknowledged,"
+            f" {self.stats['dropped'] + metrics['dropped']} dropped,"
+            f" {metrics['avgLatencySeconds'] * 1000:.1f} ms average acknowledgement latency",
+            flush=True
+        )
+
+
+if __name__ == '__main__':
+    config = json.load(open("config-sensor.json"))
+    settings = dict(config.get("fleet", {}))
+    for i, name in enumerate(("rooms", "rate", "duration")):
+        if len(sys.argv) > i + 1:
+            settings[name] = float(sys.argv[i + 1]) if name == "rate" else int(sys.argv[i + 1])
+    SensorFleet(config, settings).run()
@@ -7,50 +7,50 @@ import cherrypy
 from MyMQTT import *
 
 
+# Pollutants of the pollutants messages, in their order
+POLLUTANTS = ("PM2.5", "O3", "NO2", "SO2", "PM10")
+# Range (low, high) in ug/m3 of each pollutant for each mode
+RANGES = {
+    "good": ((0, 12), (0, 54), (0, 53), (0, 35), (0, 22)),
+    "moderate": ((12.1, 35.4), (55, 124), (54, 100), (36, 185), (25.1, 50.4)),
+    "bad": ((35.5, 55.4), (125, 164), (101, 360), (186, 304), (55.5, 105.4))
+}
+
 class SensorSimulator:
-    def __init__(self, mode='moderate'):
+    def __init__(self, mode='moderate', rng=None):
         self.mode = mode
         self.computed_aqi_json = None
+        # rng: a numpy.random.Generator, the global generator of numpy by default
+        self.rng = rng if rng is not None else np.random
+
+    def bounds(self):
+        """Arrays of the low and high values of POLLUTANTS for the current mode."""
+        ranges = np.array(RANGES.get(self.mode, RANGES["moderate"]))
+        return ranges[:, 0], ranges[:, 1]
+
+    def simulate(self, pollutant):
+        low, high = RANGES.get(self.mode, RANGES["moderate"])[POLLUTANTS.index(pollutant)]
+        return self.rng.uniform(low, high)
+
+    def simulate_rooms(self, n_rooms):
+        """Readings of n_rooms rooms, an (n_rooms, len(POLLUTANTS)) array drawn at once."""
+        low, high = self.bounds()
+        return self.rng.uniform(low, high, size=(n_rooms, len(POLLUTANTS)))
 
     def simulate_pm25(self):
-        if self.mode == 'good':
-            return np.random.uniform(0, 12)
-        elif self.mode == 'bad':
-            return np.random.uniform(35.5, 55.4)
-        else:
-            return np.random.uniform(12.1, 35.4)
+        return self.simulate("PM2.5")
         
     def simulate_pm10(self):
-        if self.mode == 'good':
-            return np.random.uniform(0, 22)
-        elif self.mode == 'bad':
-            return np.random.uniform(55.5, 105.4)
-        else:
-            return np.random.uniform(25.1, 50.4)
+        return self.simulate("PM10")
 
     def simulate_o3(self):
-        if self.mode == 'good':
-            return np.random.uniform(0, 54)
-        elif self.mode == 'bad':
-            return np.random.uniform(125, 164)
-        else:
-            return np.random.uniform(55, 124)
+        return self.simulate("O3")
 
     def simulate_no2(self):
-        if self.mode == 'good':
-            return np.random.uniform(0, 53)
-        elif self.mode == 'bad':
-            return np.random.uniform(101, 360)
-        else:
-            return np.random.uniform(54, 100)
+        return self.simulate("NO2")
 
     def simulate_so2(self):
-        if self.mode == 'good':
-            return np.random.uniform(0, 35)
-        elif self.mode == 'bad':
-            return np.random.uniform(186, 304)
-        else:
-            return np.random.uniform(36, 185)
+        return self.simulate("SO2")
 
 class SensorsConnector:
     def __init__(self, config):
@@ -61,14 +61,16 @@ class SensorsConnector:
         self.thread_stop = threading.Event()
         
         self._get_broker()
-        self.mqtt_client = MyMQTT(self.config['mqttInfos']['clientId'], self.brokerIp, self.brokerPort, self)
+        self.mqtt_client = MyMQTT(
+            self.config['mqttInfos']['clientId'], self.brokerIp, self.brokerPort, self, self.config['mqttInfos']
+        )
         self.mqtt_client.start()
         self.mqtt_client.mySubscribe(self.config['endpoints']['mqtt']['topics'][0])
         self._post_device()
 
     def notify(self, topic, msg):
         print(f"Received message on topic {topic}")
-        self.simulator.computed_aqi_json = json.loads(json.loads(msg))
+        self.simulator.computed_aqi_json = msg
 
 
     def _get_broker(self):
@@ -92,16 +94,12 @@ class SensorsConnector:
         self.device_id = response.json()["deviceID"]
         
 
-    def _put_device(self):
-        # Update device at the catalog
-        body = {
-            "ip": self.config["ip"],
-            "port": self.config["port"],
-            "endpoints": self.config["endpoints"],
-            "availableResources": self.config["availableResources"],
-            "roomID": self.config["roomID"],
-        }
-        response = requests.put(f"http://{self.catalog_ip}:{self.catalog_port}/devices/{self.device_id}", json=body)
+    def _heartbeat(self):
+        # Refresh the device liveness at the catalog, registering it again if it expired
+        response = requests.post(f"http://{self.catalog_ip}:{self.catalog_port}/devices/{self.device_id}/heartbeat")
+        if response.status_code == 404:
+            print("Device expired at the catalog, registering it again", flush=True)
+            self._post_device()
 
     def publish_sensor_data(self):
         while not self.thread_stop.is_set():
@@ -116,9 +114,9 @@ class SensorsConnector:
                     {'n': 'PM10', 'u': 'ug/m3', 'v': self.simulator.simulate_pm10()}
                 ]
             }
-            self.mqtt_client.myPublish(self.config['endpoints']['mqtt']['topics'][1], json.dumps(sensor_data))
+            self.mqtt_client.myPublish(self.config['endpoints']['mqtt']['topics'][1], sensor_data)
             print("Published sensor data")
-            self._put_device()
+            self._heartbeat()
             time.sleep(60)
 
 class AQIRestService:
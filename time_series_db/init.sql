@@ -2,27 +2,115 @@ DROP DATABASE IF EXISTS timeseries_db;
 CREATE DATABASE timeseries_db;
 USE timeseries_db;
 
+-- Rows are clustered by (building, floor, room, timestamp): a room over a time range is one
+-- range scan. The tables are partitioned by day, the adaptor creates the partitions of the
+-- next days ahead and drops the ones older than the retention (see partitions.py).
+-- MySQL requires the partitioning column in every unique key, hence the primary key.
+
 CREATE TABLE IF NOT EXISTS air_quality_index (
-    id INT PRIMARY KEY AUTO_INCREMENT,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    building VARCHAR(50),
-    floor INT,
-    room VARCHAR(50),
-    value FLOAT
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    value FLOAT,
+    PRIMARY KEY (building, floor, room, timestamp, id),
+    KEY idx_id (id),
+    KEY idx_timestamp (timestamp)
+)
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
 );
+
 CREATE TABLE IF NOT EXISTS windows (
-    id INT PRIMARY KEY AUTO_INCREMENT,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    building VARCHAR(50),
-    floor INT,
-    room VARCHAR(50),
-    value VARCHAR(50)
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    value VARCHAR(50),
+    PRIMARY KEY (building, floor, room, timestamp, id),
+    KEY idx_id (id),
+    KEY idx_timestamp (timestamp)
+)
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
 );
+
 CREATE TABLE IF NOT EXISTS ventilation (
-    id INT PRIMARY KEY AUTO_INCREMENT,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    building VARCHAR(50),
-    floor INT,
-    room VARCHAR(50),
-    value VARCHAR(50)
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    value VARCHAR(50),
+    PRIMARY KEY (building, floor, room, timestamp, id),
+    KEY idx_id (id),
+    KEY idx_timestamp (timestamp)
+)
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- Every numeric SenML entry of every message, one row per entry (e.g. each pollutant of the
+-- sensors), in the same layout as above with the entry name in the key.
+CREATE TABLE IF NOT EXISTS measurements (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    timestamp DATETIME(3) NOT NULL,
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    name VARCHAR(16) NOT NULL,
+    value DOUBLE NOT NULL,
+    PRIMARY KEY (building, floor, room, name, timestamp, id),
+    KEY idx_id (id),
+    KEY idx_timestamp (timestamp)
+)
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- Rollups of the measurements table at 1 minute, 1 hour and 1 day, updated by the adaptor in
+-- the same transaction as the raw rows (see rollups.py). Bucketed queries read the coarsest
+-- rollup that fits their bucket instead of the raw rows.
+CREATE TABLE IF NOT EXISTS rollup_1m (
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    measure VARCHAR(16) NOT NULL,
+    timestamp DATETIME NOT NULL,
+    samples BIGINT NOT NULL,
+    total DOUBLE NOT NULL,
+    min_value DOUBLE NOT NULL,
+    max_value DOUBLE NOT NULL,
+    PRIMARY KEY (building, floor, room, measure, timestamp),
+    KEY idx_timestamp (timestamp)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_1h (
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    measure VARCHAR(16) NOT NULL,
+    timestamp DATETIME NOT NULL,
+    samples BIGINT NOT NULL,
+    total DOUBLE NOT NULL,
+    min_value DOUBLE NOT NULL,
+    max_value DOUBLE NOT NULL,
+    PRIMARY KEY (building, floor, room, measure, timestamp),
+    KEY idx_timestamp (timestamp)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_1d (
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    measure VARCHAR(16) NOT NULL,
+    timestamp DATETIME NOT NULL,
+    samples BIGINT NOT NULL,
+    total DOUBLE NOT NULL,
+    min_value DOUBLE NOT NULL,
+    max_value DOUBLE NOT NULL,
+    PRIMARY KEY (building, floor, room, measure, timestamp),
+    KEY idx_timestamp (timestamp)
 );
\ No newline at end of file
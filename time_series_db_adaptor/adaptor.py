@@ -1,33 +1,118 @@
 import json
+import re
 import requests
-import time
-from datetime import datetime
 
 import cherrypy
 import mysql.connector
+import senml
 
 from MyMQTT import *
+from ingest import IngestPipeline, TABLES, utc_datetime
+from spool import IngestSpool
+from db_pool import ConnectionPool, PoolTimeout
+from partitions import PartitionManager
+from query import build_query, QueryError
+from export import EXPORT_FORMATS, stream_json, to_json_value
+
+# Measurements are published on /<building>/<floor>/<room>/<measure>
+MEASUREMENT_TOPIC = re.compile(r"^/([^/]+)/([^/]+)/([^/]+)/([^/]+)$")
+# Measures subscribed with one wildcard filter each, whatever the number of rooms
+MEASURES = ("pollutants",) + tuple(TABLES)
+
+class DatabaseUnavailable(Exception):
+    pass
+
+class StreamedResults:
+    """
+    Iterator over the chunks of a streamed response, holding its pooled connection until it is
+    exhausted or closed. close() also releases the connection when the iteration never started,
+    e.g. when the client disconnected before the first chunk.
+    """
+
+    def __init__(self, pool, db, cursor, chunks):
+        self.pool = pool
+        self.db = db
+        self.cursor = cursor
+        self.chunks = chunks
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.db is None:
+            raise StopIteration
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            self.finished = True
+            self.close()
+            raise
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        db, self.db = self.db, None
+        if db is None:
+            return
+        self.chunks.close()
+        if self.finished:
+            self.cursor.close()
+        # A client that disconnects leaves unread rows: drop the connection then
+        self.pool.release(db, broken=not self.finished)
 
 class TimeSeriesAdaptor:
     exposed = True
 
-    def __init__(self):
+    def __init__(self, start_mqtt=True):
         self.settings = json.load(open('config-time-series-db-adaptor.json'))
+        # Separate pools, so that queries do not wait behind the ingest batches
+        pools = self.settings.get("dbPools", {})
+        self.ingest_pool = ConnectionPool("ingest", lambda: self._connect(autocommit=False), pools.get("ingest"))
+        self.query_pool = ConnectionPool("query", lambda: self._connect(autocommit=True), pools.get("query"))
         print("Connecting to MySQL database...", flush=True)
-        time.sleep(10)
-        self.db = mysql.connector.connect(
+        self.query_pool.warm_up()
+
+        # The measurements are written in batches by the ingest pipeline, and kept on disk
+        # in the spool while MySQL is unavailable
+        spool_settings = self.settings.get("spool", {})
+        self.spool = IngestSpool(spool_settings) if spool_settings.get("path") else None
+        self.ingest = IngestPipeline(self.ingest_pool, self.settings.get("ingest"), self.spool)
+        self.ingest.start()
+
+        # Daily partitions created ahead and dropped after the retention period
+        self.partitions = PartitionManager(self.query_pool, self.settings.get("partitions"))
+        self.partitions.start()
+
+        # Handler and arguments of each topic received, parsed on its first message
+        self.routes = {}
+        # Otherwise adaptor_async.py sets up an AsyncMQTT client
+        if start_mqtt:
+            self._get_broker()
+            self.mqttClient = MyMQTT(
+                self.settings["mqttInfos"]["clientId"], self.brokerIp, self.brokerPort, self, self.settings["mqttInfos"]
+            )
+            self.mqttClient.start()
+            self.subscribe()
+
+    def subscribe(self):
+        # New rooms are ingested without resubscribing
+        for measure in MEASURES:
+            self.mqttClient.mySubscribe(f"/+/+/+/{measure}")
+
+    def _connect(self, autocommit):
+        # Queries run in autocommit mode, otherwise a pooled connection would keep reading
+        # the snapshot of its first transaction
+        return mysql.connector.connect(
             host=self.settings["dbConnection"]["host"],
             port=self.settings["dbConnection"]["port"],
             user=self.settings["dbConnection"]["user"],
             password=self.settings["dbConnection"]["password"],
-            database=self.settings["dbConnection"]["database"]
+            database=self.settings["dbConnection"]["database"],
+            autocommit=autocommit
         )
 
-        self._get_broker()
-        self.mqttClient = MyMQTT(self.settings["mqttInfos"]["clientId"], self.brokerIp, self.brokerPort, self)
-        self.mqttClient.start()
-        self._subscribe_to_all_devices()
-
     def _get_broker(self):
         self.catalog_ip = self.settings["catalog"]["ip"]
         self.catalog_port = self.settings["catalog"]["port"]
@@ -36,96 +121,141 @@ class TimeSeriesAdaptor:
         self.brokerIp = broker_info["ip"]
         self.brokerPort = broker_info["port"]
 
-    def _subscribe_to_all_devices(self):
-        response = requests.get(f"http://{self.catalog_ip}:{self.catalog_port}/devices")
-        devices = response.json()
-
-        for device in devices:
-            topics = device["endpoints"]["mqtt"]["topics"]
-            for topic in topics:
-                self.mqttClient.mySubscribe(topic)
-
     def _fetch_results(self, query, params=None):
-        cursor = self.db.cursor(dictionary=True)
-        cursor.execute(query, params or ())
-        results = cursor.fetchall()
+        with self.query_pool.connection() as db:
+            cursor = db.cursor(dictionary=True)
+            try:
+                cursor.execute(query, params or ())
+                results = cursor.fetchall()
+            finally:
+                cursor.close()
     
-        # Convert datetime fields to strings
+        # Convert datetime fields to strings, and DECIMAL ones to numbers
         for row in results:
             for key, value in row.items():
-                if isinstance(value, datetime):
-                    row[key] = value.strftime('%Y-%m-%d %H:%M:%S')
+                row[key] = to_json_value(value)
         
         return results
 
-    def notify(self, topic, payload):
-        message = json.loads(payload)
-        message_json = json.loads(message)
-        print(f"Received message on topic {topic}: {message_json}", flush=True)
-        topic_parts = topic.split("/")
-        building = topic_parts[1]
-        floor = topic_parts[2]
-        room = topic_parts[3]
-        measureType = topic_parts[4]
-        timestamp = datetime.utcfromtimestamp(message_json["bt"]).strftime('%Y-%m-%d %H:%M:%S')
-        value = message_json["e"][0]["v"]
-        if(measureType in ["aqi", "windows", "ventilation"]):
-            tables = {"aqi": "air_quality_index", "windows": "windows", "ventilation": "ventilation"}
-            query = f"INSERT INTO {tables[measureType]} (building, floor, room, value, timestamp) VALUES (%s, %s, %s, %s, %s)"
-            print(query, (building, floor, room, value, timestamp), flush=True)
-            self._fetch_results(query, (building, floor, room, value, timestamp))
+    def _stream_results(self, query, params, serialize):
+        """
+        Run a query on a server-side cursor and return the StreamedResults of the serialized response.
+        The query runs before returning, so its errors can still change the response status.
+        """
+        db = self.query_pool.acquire()
+        try:
+            cursor = db.cursor()
+            cursor.execute(query, params)
+        except Exception:
+            self.query_pool.release(db, broken=True)
+            raise
+        return StreamedResults(self.query_pool, db, cursor, serialize(cursor))
+
+    def notify(self, topic, message):
+        route = self.routes.get(topic)
+        if route is None:
+            route = self.routes[topic] = self._route(topic)
+        handler, args = route
+        # On the network thread of paho: an exception would stop it, and the ingestion with it
+        try:
+            handler(message, *args)
+        except Exception as e:
+            print(f"Error handling a message of {topic}: {e!r}", flush=True)
+
+    def _route(self, topic):
+        """Handler of the messages of a topic and its arguments."""
+        match = MEASUREMENT_TOPIC.match(topic)
+        if match is None:
+            return self._ignore, ()
+        building, floor, room, measure = match.groups()
+        return self._on_measurement, (building, floor, room, TABLES.get(measure))
+
+    def _ignore(self, message):
+        pass
+
+    def _on_measurement(self, message, building, floor, room, table):
+        # Every numeric entry (e.g. each pollutant) goes to the measurements table
+        records = [record for record in senml.records(message) if record.is_numeric()]
+        rows = [(building, floor, room, record.name, record.value, utc_datetime(record.time)) for record in records]
+        self.submit("measurements", rows)
+
+        # and the first one to the table of the measure, if it has one
+        if table is not None and records:
+            self.submit(table, [(building, floor, room, records[0].value, utc_datetime(records[0].time))])
 
+    def submit(self, table, rows):
+        # On the thread of the MQTT client, which the ingest pipeline may block when its queue is full
+        return self.ingest.submit(table, rows)
 
     def stopMqttClient(self):
         self.mqttClient.stop()
+        self.close()
+
+    def close(self):
+        """Write the measurements still queued and close the connections."""
+        self.ingest.stop()
+        if self.spool is not None:
+            self.spool.close()
+        self.partitions.stop()
+        self.ingest_pool.close()
+        self.query_pool.close()
 
     def GET(self, *uri, **params):
         """Handle GET requests."""
+        try:
+            headers, body = self.respond(uri, params)
+        except DatabaseUnavailable as e:
+            raise cherrypy.HTTPError(503, str(e))
+        cherrypy.response.headers.update(headers)
+        if not isinstance(body, bytes):
+            cherrypy.response.stream = True
+            # Also when the body is never iterated, or wrapped by a tool that does not close it
+            cherrypy.request.hooks.attach('on_end_request', body.close)
+        return body
+
+    def respond(self, uri, params):
+        """
+        Headers and body of the response to a GET, whatever the web server: the body is bytes, or
+        StreamedResults when the rows are streamed, to close once sent. Raises DatabaseUnavailable.
+        """
         if not uri:
-            return json.dumps({"error": "Invalid endpoint"}).encode('utf-8')
+            return {}, json.dumps({"error": "Invalid endpoint"}).encode('utf-8')
 
         endpoint = uri[0]
-        if endpoint not in ["aqi", "windows", "ventilation"]:
-            return json.dumps({"error": "Invalid endpoint"}).encode('utf-8')
+        if endpoint == "metrics":
+            return {}, json.dumps({"ingest": self.ingest.metrics(), "mqtt": self.mqttClient.metrics()}).encode('utf-8')
+        if endpoint not in ["aqi", "windows", "ventilation", "measurements"]:
+            return {}, json.dumps({"error": "Invalid endpoint"}).encode('utf-8')
         if endpoint == "aqi":
             table = "air_quality_index"
         else :
             table = endpoint
 
-        building = params.get("building")
-        floor = params.get("floor")
-        room = params.get("room")
-        time_range = params.get("range")  # '1h', '30m', '1d', '1y'
-
-        query = f"SELECT * FROM {table} WHERE 1=1"
-        query_params = []
+        try:
+            query, query_params = build_query(table, params)
+        except QueryError as e:
+            return {}, json.dumps({"error": str(e)}).encode('utf-8')
 
-        if room:
-            query += " AND room = %s"
-            query_params.append(room)
-        
-        if floor:
-            query += " AND floor = %s"
-            query_params.append(floor)
-        
-        if building:
-            query += " AND building = %s"
-            query_params.append(building)
-
-        if time_range:
-            time_units = {"m": "MINUTE", "h": "HOUR", "d": "DAY", "y": "YEAR"}
-            unit = time_units.get(time_range[-1])  # 'h', 'm', 'y'
-
-            if unit:
-                value = int(time_range[:-1])
-                query += f" AND timestamp >= NOW() - INTERVAL %s {unit}"
-                query_params.append(value)
+        # format=ndjson, or stream=true for a JSON array, sends the rows while they are read.
+        # format=csv and format=npz export the columns with delta-encoded epoch milliseconds (dt_ms).
+        output_format = params.get("format", "json")
+        if output_format not in EXPORT_FORMATS and output_format != "json":
+            return {}, json.dumps({"error": f"'format' must be one of json, {', '.join(EXPORT_FORMATS)}"}).encode('utf-8')
+        stream = output_format != "json" or params.get("stream", "").lower() in ("1", "true", "yes")
+        content_type, serialize = EXPORT_FORMATS.get(output_format, ("application/json", lambda cursor: stream_json(cursor, False)))
+        try:
+            if stream:
+                body = self._stream_results(query, query_params, serialize)
             else:
-                return json.dumps({"error": "Invalid time range unit"}).encode('utf-8')
-
-        results = self._fetch_results(query, query_params)
-        print(f"Results: {results}", flush=True)
-        return json.dumps(results).encode('utf-8')
+                results = self._fetch_results(query, query_params)
+        except (PoolTimeout, mysql.connector.Error) as e:
+            raise DatabaseUnavailable(f"Database unavailable: {e}")
+        if stream:
+            headers = {"Content-Type": content_type}
+            if output_format in ("csv", "npz"):
+                headers["Content-Disposition"] = f'attachment; filename="{endpoint}.{output_format}"'
+            return headers, body
+        return {}, json.dumps(results).encode('utf-8')
 
 if __name__ == '__main__':
     conf = {
@@ -0,0 +1,94 @@
+import asyncio
+
+from aiohttp import web
+
+import aio
+from aio import AsyncMQTT, HttpClient
+from adaptor import TimeSeriesAdaptor, DatabaseUnavailable
+
+# TimeSeriesAdaptor on the asyncio runtime of common/aio.py: MQTT and the REST API run on the event
+# loop instead of paho's and CherryPy's threads. mysql.connector has no asyncio API, so the queries
+# run in the default executor, bounded by the query pool, and the ingest pipeline keeps its thread.
+# The messages are queued on the loop as long as the ingest queue has room.
+# Usage: python3 adaptor_async.py, in place of adaptor.py
+
+# Messages waiting in the executor for room in the ingest queue, the next ones are dropped
+MAX_OVERFLOW = 1000
+
+
+class AsyncTimeSeriesAdaptor(TimeSeriesAdaptor):
+    """TimeSeriesAdaptor whose MQTT messages are handled on the event loop, which submit() must not block."""
+
+    def __init__(self, loop):
+        super().__init__(start_mqtt=False)
+        self.loop = loop
+        self.overflow = 0
+
+    def submit(self, table, rows):
+        if self.ingest.offer(table, rows):
+            return True
+        # The queue is full: spooling the rows or waiting for room runs in the executor
+        if self.overflow >= MAX_OVERFLOW:
+            self.ingest.count(dropped=len(rows))
+            return False
+        self.overflow += 1
+        future = self.loop.run_in_executor(None, self.ingest.submit, table, rows)
+        future.add_done_callback(self._overflow_done)
+        return True
+
+    def _overflow_done(self, future):
+        self.overflow -= 1
+
+
+def get_handler(service):
+    async def get(request):
+        loop = asyncio.get_event_loop()
+        uri = tuple(part for part in request.match_info["uri"].split("/") if part)
+        try:
+            headers, body = await loop.run_in_executor(None, service.respond, uri, dict(request.query))
+        except DatabaseUnavailable as e:
+            raise web.HTTPServiceUnavailable(text=str(e))
+        if isinstance(body, bytes):
+            return web.Response(body=body, headers=headers, content_type=headers.get("Content-Type", "application/json"))
+
+        # Each chunk is read from MySQL in the executor, and sent before reading the next one
+        response = web.StreamResponse(headers=headers)
+        try:
+            await response.prepare(request)
+            while True:
+                chunk = await loop.run_in_executor(None, next, body, None)
+                if chunk is None:
+                    break
+                await response.write(chunk)
+        finally:
+            # Releases the connection, also when the client disconnected before the first chunk
+            await loop.run_in_executor(None, body.close)
+        await response.write_eof()
+        return response
+
+    return get
+
+
+async def main(stopped):
+    loop = asyncio.get_event_loop()
+    # Waits for MySQL to answer
+    service = await loop.run_in_executor(None, AsyncTimeSeriesAdaptor, loop)
+    settings = service.settings
+
+    async with HttpClient(settings.get("http")) as http:
+        broker, port = await aio.get_broker(http, settings["catalog"]["ip"], settings["catalog"]["port"])
+    service.mqttClient = AsyncMQTT(settings["mqttInfos"]["clientId"], broker, port, service, settings["mqttInfos"])
+    service.mqttClient.start()
+    service.subscribe()
+
+    runner = await aio.serve([web.get("/{uri:.*}", get_handler(service))], "0.0.0.0", 8080)
+    await stopped.wait()
+
+    print("Stopping mqtt client...", flush=True)
+    await runner.cleanup()
+    await service.mqttClient.stop()
+    await loop.run_in_executor(None, service.close)
+
+
+if __name__ == '__main__':
+    aio.run(main)
@@ -0,0 +1,159 @@
+import datetime
+import json
+import random
+import statistics
+import sys
+import time
+
+import mysql.connector
+
+# Query latency of the time series tables, before and after the composite primary key and the
+# daily partitions, on the same generated rows (10M by default, spread over DAYS days).
+# Usage: python3 benchmark_queries.py [rows] [host]
+# It creates the bench_flat and bench_partitioned tables in the adaptor database and drops them at the end.
+
+DAYS = 30
+BUILDINGS = 10
+FLOORS = 5
+ROOMS_PER_FLOOR = 10
+BATCH = 10000
+REPEAT = 5
+
+FLAT_SCHEMA = """
+CREATE TABLE bench_flat (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    building VARCHAR(50),
+    floor INT,
+    room VARCHAR(50),
+    value FLOAT
+)
+"""
+
+PARTITIONED_SCHEMA = """
+CREATE TABLE bench_partitioned (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    building VARCHAR(50) NOT NULL,
+    floor INT NOT NULL,
+    room VARCHAR(50) NOT NULL,
+    value FLOAT,
+    PRIMARY KEY (building, floor, room, timestamp, id),
+    KEY idx_id (id),
+    KEY idx_timestamp (timestamp)
+)
+PARTITION BY RANGE (TO_DAYS(timestamp)) ({partitions})
+"""
+
+# The queries of GET /aqi, as built by TimeSeriesAdaptor.GET
+QUERIES = {
+    "room, last hour": ("room = %s AND floor = %s AND building = %s AND timestamp >= NOW() - INTERVAL 1 HOUR", "room"),
+    "room, last day": ("room = %s AND floor = %s AND building = %s AND timestamp >= NOW() - INTERVAL 1 DAY", "room"),
+    "room, last week": ("room = %s AND floor = %s AND building = %s AND timestamp >= NOW() - INTERVAL 7 DAY", "room"),
+    "building, last hour": ("building = %s AND timestamp >= NOW() - INTERVAL 1 HOUR", "building"),
+    "all rooms, last 10 minutes": ("timestamp >= NOW() - INTERVAL 10 MINUTE", "all")
+}
+
+
+def connect(host=None):
+    with open("config-time-series-db-adaptor.json") as file:
+        settings = json.load(file)["dbConnection"]
+    return mysql.connector.connect(
+        host=host or settings["host"],
+        port=settings["port"],
+        user=settings["user"],
+        password=settings["password"],
+        database=settings["database"]
+    )
+
+
+def create_tables(cursor, today):
+    cursor.execute("DROP TABLE IF EXISTS bench_flat, bench_partitioned")
+    cursor.execute(FLAT_SCHEMA)
+    days = [today - datetime.timedelta(days=i) for i in range(DAYS, -2, -1)]
+    partitions = ", ".join(
+        f"PARTITION p{day:%Y%m%d} VALUES LESS THAN (TO_DAYS('{day + datetime.timedelta(days=1)}'))" for day in days
+    )
+    cursor.execute(PARTITIONED_SCHEMA.format(partitions=partitions + ", PARTITION p_future VALUES LESS THAN MAXVALUE"))
+
+
+def rooms():
+    return [
+        (f"B{b}", f, f"R{r}")
+        for b in range(BUILDINGS) for f in range(FLOORS) for r in range(ROOMS_PER_FLOOR)
+    ]
+
+
+def generate(n_rows, now):
+    """Rows of every room at a regular interval over the last DAYS days, in timestamp order."""
+    all_rooms = rooms()
+    step = DAYS * 86400 / (n_rows / len(all_rooms))
+    start = now - datetime.timedelta(days=DAYS)
+    for i in range(n_rows):
+        building, floor, room = all_rooms[i % len(all_rooms)]
+        timestamp = start + datetime.timedelta(seconds=(i // len(all_rooms)) * step)
+        yield (building, floor, room, random.uniform(0, 100), timestamp)
+
+
+def load(db, n_rows, now):
+    cursor = db.cursor()
+    batch = []
+    loaded = 0
+    start = time.time()
+    for row in generate(n_rows, now):
+        batch.append(row)
+        if len(batch) == BATCH:
+            for table in ("bench_flat", "bench_partitioned"):
+                cursor.executemany(
+                    f"INSERT INTO {table} (building, floor, room, value, timestamp) VALUES (%s, %s, %s, %s, %s)", batch
+                )
+            db.commit()
+            loaded += len(batch)
+            batch = []
+            if loaded % 1000000 == 0:
+                print(f"  {loaded} rows loaded in {time.time() - start:.0f}s", flush=True)
+    if batch:
+        for table in ("bench_flat", "bench_partitioned"):
+            cursor.executemany(
+                f"INSERT INTO {table} (building, floor, room, value, timestamp) VALUES (%s, %s, %s, %s, %s)", batch
+            )
+        db.commit()
+    cursor.close()
+
+
+def time_query(cursor, table, condition, params):
+    durations = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        cursor.execute(f"SELECT * FROM {table} WHERE {condition}", params)
+        rows = cursor.fetchall()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000, len(rows)
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    db = connect(sys.argv[2] if len(sys.argv) > 2 else None)
+    db.autocommit = False
+    cursor = db.cursor()
+    # The queries compare with NOW() of the server
+    cursor.execute("SELECT NOW()")
+    now = cursor.fetchone()[0]
+    create_tables(cursor, now.date())
+    print(f"Loading {n_rows} rows in both tables...", flush=True)
+    load(db, n_rows, now)
+
+    building, floor, room = rooms()[0]
+    query_params = {"room": (room, floor, building), "building": (building,), "all": ()}
+    cursor.execute("ANALYZE TABLE bench_flat, bench_partitioned")
+    cursor.fetchall()
+    print(f"{'query':<28} {'flat (ms)':>10} {'partitioned (ms)':>17} {'rows':>8}")
+    for name, (condition, kind) in QUERIES.items():
+        params = query_params[kind]
+        flat_ms, n = time_query(cursor, "bench_flat", condition, params)
+        partitioned_ms, _ = time_query(cursor, "bench_partitioned", condition, params)
+        print(f"{name:<28} {flat_ms:>10.1f} {partitioned_ms:>17.1f} {n:>8}")
+
+    cursor.execute("DROP TABLE bench_flat, bench_partitioned")
+    cursor.close()
+    db.close()
@@ -0,0 +1,77 @@
+import datetime
+import sys
+
+from adaptor import TimeSeriesAdaptor
+
+# Checks of TimeSeriesAdaptor.notify, without MySQL nor broker: any client of the broker can
+# publish on the topics the adaptor subscribes to, so a malformed message must be skipped
+# without raising, as it would stop the network thread of paho.
+# Usage: PYTHONPATH=../common python3 check_messages.py
+
+TOPIC = "/B/1/2/aqi"
+T0 = 1700000000
+START = datetime.datetime.utcfromtimestamp(T0)
+
+# message -> rows submitted to (measurements, air_quality_index)
+MESSAGES = [
+    # A SenML pack, the base time carrying over to the second record
+    ([{"bn": TOPIC, "bt": T0, "n": "aqi", "v": 3}, {"n": "aqi", "t": 60, "v": 4}], (
+        [("B", "1", "2", "aqi", 3, START), ("B", "1", "2", "aqi", 4, START + datetime.timedelta(seconds=60))],
+        [("B", "1", "2", 3, START)]
+    )),
+    # The message of the devices, with its entries in "e"
+    ({"bn": TOPIC, "bt": T0, "e": [{"n": "aqi", "u": "", "v": 5}]}, (
+        [("B", "1", "2", "aqi", 5, START)],
+        [("B", "1", "2", 5, START)]
+    )),
+    # No base time: the entries are at the epoch
+    ({"e": [{"n": "aqi", "v": 2}]}, (
+        [("B", "1", "2", "aqi", 2, datetime.datetime(1970, 1, 1))],
+        [("B", "1", "2", 2, datetime.datetime(1970, 1, 1))]
+    )),
+    # Nothing numeric to store
+    ({"bn": TOPIC, "bt": T0, "e": []}, ([], [])),
+    ({"bn": TOPIC, "bt": T0, "e": [{"n": "aqi", "vs": "good"}]}, ([], [])),
+    # Malformed
+    (None, ([], [])),
+    ("aqi", ([], [])),
+    ([1, 2], ([], [])),
+    ({"bt": "now", "e": [{"n": "aqi", "v": 1}]}, ([], [])),
+    ({"e": [{"n": "aqi", "v": 1, "t": "later"}]}, ([], [])),
+    ({"e": "aqi"}, ([], []))
+]
+
+
+def fake_service():
+    service = TimeSeriesAdaptor.__new__(TimeSeriesAdaptor)
+    service.routes = {}
+    service.submitted = []
+    service.submit = lambda table, rows: service.submitted.append((table, rows))
+    return service
+
+
+def check_notify():
+    """Every message is stored as expected, or skipped, and notify() never raises."""
+    failures = []
+    for message, (measurements, aqi) in MESSAGES:
+        service = fake_service()
+        try:
+            service.notify(TOPIC, message)
+        except Exception as e:
+            failures.append(f"{message!r} raised {e!r}")
+            continue
+        submitted = {}
+        for table, rows in service.submitted:
+            submitted.setdefault(table, []).extend(rows)
+        expected = {"measurements": measurements, "air_quality_index": aqi}
+        if {table: submitted.get(table, []) for table in expected} != expected:
+            failures.append(f"{message!r} submitted {submitted}")
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check_notify()
+    for failure in failures:
+        print(f"FAILED: {failure}", flush=True)
+    print(f"Malformed messages: {'ok' if not failures else 'failed'}", flush=True)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,148 @@
+import contextlib
+import datetime
+import decimal
+import io
+import json
+import sys
+import zipfile
+
+from adaptor import TimeSeriesAdaptor
+from query import build_query
+
+# Checks of TimeSeriesAdaptor.respond on a fake query pool, without MySQL: the rows are typed
+# like mysql.connector returns them, e.g. a SUM of integers as a Decimal, and the pool counts
+# the connections held and dropped.
+# Usage: PYTHONPATH=../common python3 check_responses.py
+
+START = datetime.datetime(2024, 1, 1)
+
+
+class FakeCursor:
+    def __init__(self, rows, dictionary):
+        self.rows = list(rows)
+        self.dictionary = dictionary
+        self.column_names = ("building", "floor", "room", "timestamp", "value")
+        self.closed = False
+
+    def execute(self, query, params=()):
+        pass
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        if self.dictionary:
+            return [dict(zip(self.column_names, row)) for row in rows]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self.rows, dictionary)
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+        self.acquired = 0
+        self.broken = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return FakeConnection(self.rows)
+
+    def release(self, conn, broken=False):
+        self.acquired -= 1
+        self.broken += broken
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+
+def fake_service(rows):
+    service = TimeSeriesAdaptor.__new__(TimeSeriesAdaptor)
+    service.query_pool = FakePool(rows)
+    return service
+
+
+def body_bytes(body):
+    return body if isinstance(body, bytes) else b"".join(body)
+
+
+def check_rollup_count():
+    """A bucketed count on the rollups answers numbers in every format."""
+    params = {"room": "1", "bucket": "1h", "agg": "count"}
+    sql, _ = build_query("air_quality_index", params)
+    failures = []
+    if "rollup_1h" not in sql or "CAST(SUM(samples) AS SIGNED)" not in sql:
+        failures.append(f"count not planned as an integer on the rollup: {sql}")
+
+    # What mysql.connector returns for SUM(samples) without the cast
+    rows = [("B", 1, "1", START + datetime.timedelta(hours=i), decimal.Decimal(60 + i)) for i in range(3)]
+    for output_format in ("json", "ndjson", "npz"):
+        service = fake_service(rows)
+        try:
+            _, body = service.respond(("aqi",), dict(params, format=output_format))
+            data = body_bytes(body)
+        except Exception as e:
+            failures.append(f"format={output_format} failed: {e!r}")
+            continue
+        if output_format == "json":
+            values = [row["value"] for row in json.loads(data)]
+        elif output_format == "ndjson":
+            values = [json.loads(line)["value"] for line in data.decode("utf-8").splitlines()]
+        else:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                header = archive.read("value.npy")[10:].decode("latin-1")
+            values = [60, 61, 62] if "'<i8'" in header else header
+        if values != [60, 61, 62]:
+            failures.append(f"format={output_format} answered {values}")
+        if service.query_pool.acquired:
+            failures.append(f"format={output_format} did not release its connection")
+    return failures
+
+
+def check_stream_release():
+    """A streamed response releases its connection once closed, however far it was read."""
+    rows = [("B", 1, "1", START + datetime.timedelta(minutes=i), float(i)) for i in range(5000)]
+    failures = []
+    # Chunks read before closing: none (e.g. the client left before the headers were sent), some, all
+    for n_chunks, broken in ((0, 1), (2, 1), (None, 0)):
+        service = fake_service(rows)
+        _, body = service.respond(("aqi",), {"format": "ndjson"})
+        if n_chunks is None:
+            list(body)
+        else:
+            for _ in range(n_chunks):
+                next(body)
+        body.close()
+        body.close()
+        if service.query_pool.acquired or service.query_pool.broken != broken:
+            failures.append(
+                f"{n_chunks} chunks read: {service.query_pool.acquired} connections held,"
+                f" {service.query_pool.broken} dropped instead of {broken}"
+            )
+    return failures
+
+
+if __name__ == '__main__':
+    exit_code = 0
+    for name, check in (("Rollup count", check_rollup_count), ("Streamed connections", check_stream_release)):
+        failures = check()
+        for failure in failures:
+            print(f"FAILED: {failure}", flush=True)
+        print(f"{name}: {'ok' if not failures else 'failed'}", flush=True)
+        exit_code = exit_code or (1 if failures else 0)
+    sys.exit(exit_code)
@@ -0,0 +1,140 @@
+import contextlib
+import queue
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import errors
+
+
+class PoolTimeout(Exception):
+    """No database connection became available in time."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySQL connections.
+    A connection is used by one thread at a time. Connections idle for longer than
+    healthCheckInterval seconds are pinged before being handed out, and the ones that
+    failed with a connection error are closed and replaced. Connecting retries with an
+    exponential backoff up to maxBackoff seconds, until acquireTimeout (forever if null).
+    """
+
+    def __init__(self, name, connect, settings=None):
+        settings = settings or {}
+        self.name = name
+        self.connect = connect
+        self.size = settings.get("size", 4)
+        self.acquire_timeout = settings.get("acquireTimeout")
+        self.health_check_interval = settings.get("healthCheckInterval", 30)
+        self.max_backoff = settings.get("maxBackoff", 30)
+
+        # (connection, time it was released), or None to wake up a waiting thread
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.open_count = 0
+        self.closed = False
+
+    def open_connection(self, deadline=None):
+        """Connect, retrying with an exponential backoff until the deadline."""
+        delay = 0.5
+        while True:
+            try:
+                return self.connect()
+            except mysql.connector.Error as e:
+                if self.closed or (deadline is not None and time.time() + delay > deadline):
+                    raise
+                print(f"Database not reachable from the {self.name} pool ({e}), retrying in {delay}s", flush=True)
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def reserve(self):
+        """Count a new connection if the pool is not full."""
+        with self.lock:
+            if self.open_count >= self.size:
+                return False
+            self.open_count += 1
+            return True
+
+    def open_reserved(self, deadline=None):
+        try:
+            return self.open_connection(deadline)
+        except Exception:
+            with self.lock:
+                self.open_count -= 1
+            raise
+
+    def healthy(self, conn, released):
+        if time.time() - released < self.health_check_interval:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def acquire(self):
+        deadline = time.time() + self.acquire_timeout if self.acquire_timeout is not None else None
+        while True:
+            try:
+                entry = self.idle.get_nowait()
+            except queue.Empty:
+                if self.reserve():
+                    return self.open_reserved(deadline)
+                timeout = None if deadline is None else deadline - time.time()
+                if timeout is not None and timeout <= 0:
+                    raise PoolTimeout(f"No connection available in the {self.name} pool")
+                try:
+                    entry = self.idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f"No connection available in the {self.name} pool")
+            if entry is None:
+                # A connection was discarded: try to open a new one
+                continue
+            conn, released = entry
+            if self.healthy(conn, released):
+                return conn
+            self.discard(conn)
+
+    def release(self, conn, broken=False):
+        if broken or self.closed:
+            self.discard(conn)
+        else:
+            self.idle.put((conn, time.time()))
+
+    def discard(self, conn):
+        with self.lock:
+            self.open_count -= 1
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+        self.idle.put(None)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection, replaced if it failed with a connection error."""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except (errors.InterfaceError, errors.OperationalError):
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def warm_up(self):
+        """Open a first connection, waiting for the database to come up."""
+        if self.reserve():
+            self.release(self.open_reserved())
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                entry = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not None:
+                self.discard(entry[0])
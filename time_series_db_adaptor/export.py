@@ -0,0 +1,156 @@
+import array
+import calendar
+import csv
+import datetime
+import decimal
+import io
+import json
+import math
+import struct
+import sys
+import zipfile
+
+# Rows read from the server-side cursor at a time when streaming
+STREAM_BATCH = 1000
+
+
+def to_number(value):
+    """int or float of a DECIMAL column, which json and column_npy do not handle."""
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def to_json_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return to_number(value)
+
+
+def stream_json(cursor, ndjson):
+    """
+    Serialize the rows of an executed unbuffered cursor, STREAM_BATCH rows at a time.
+    Yields one JSON object per line with ndjson, or the chunks of a JSON array.
+    """
+    columns = cursor.column_names
+    first = True
+    if not ndjson:
+        yield b"["
+    while True:
+        rows = cursor.fetchmany(STREAM_BATCH)
+        if not rows:
+            break
+        lines = [json.dumps(dict(zip(columns, map(to_json_value, row)))) for row in rows]
+        if ndjson:
+            yield ("\n".join(lines) + "\n").encode('utf-8')
+        else:
+            yield (("" if first else ",") + ",".join(lines)).encode('utf-8')
+        first = False
+    if not ndjson:
+        yield b"]"
+
+
+# ----------------------------------------------------------------------
+# Columnar export: one array per column, the timestamps as epoch milliseconds delta-encoded
+# (dt_ms[0] is the first timestamp, then the gaps between rows: timestamps = cumsum(dt_ms)).
+# The id column is left out.
+
+def epoch_ms(value):
+    """Epoch milliseconds of a naive UTC datetime."""
+    return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+
+def export_columns(columns):
+    """Indexes and names of the exported columns, the timestamp column becoming dt_ms."""
+    return [(i, "dt_ms" if name == "timestamp" else name) for i, name in enumerate(columns) if name != "id"]
+
+
+def stream_csv(cursor):
+    """CSV with a header line, written STREAM_BATCH rows at a time."""
+    exported = export_columns(cursor.column_names)
+    timestamp_index = cursor.column_names.index("timestamp") if "timestamp" in cursor.column_names else None
+    previous = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([name for _, name in exported])
+    while True:
+        rows = cursor.fetchmany(STREAM_BATCH)
+        if not rows:
+            break
+        for row in rows:
+            row = list(row)
+            if timestamp_index is not None:
+                current = epoch_ms(row[timestamp_index])
+                row[timestamp_index] = current - previous
+                previous = current
+            writer.writerow([row[i] for i, _ in exported])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def npy(descr, n_items, data):
+    """A .npy file (format version 1.0) holding a one-dimensional array."""
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, n_items)
+    # The magic string, version, header length and header are padded to a multiple of 64 bytes
+    padding = 63 - (10 + len(header)) % 64
+    header = header + " " * padding + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode('latin1') + data
+
+
+def little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def column_npy(values):
+    """Encode a column as int64, float64 (None as NaN) or fixed width unicode, like NumPy would infer it."""
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, int) and not isinstance(v, bool) for v in present) and len(present) == len(values):
+        return npy("<i8", len(values), little_endian(array.array("q", values)))
+    if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        floats = array.array("d", (math.nan if v is None else float(v) for v in values))
+        return npy("<f8", len(values), little_endian(floats))
+    strings = ["" if v is None else str(v) for v in values]
+    width = max([len(v) for v in strings] + [1])
+    data = b"".join(v.ljust(width, "\0").encode("utf-32-le") for v in strings)
+    return npy("<U%d" % width, len(values), data)
+
+
+def stream_npz(cursor):
+    """An .npz archive with one array per column, loadable with numpy.load()."""
+    exported = export_columns(cursor.column_names)
+    columns = {name: [] for _, name in exported}
+    previous = 0
+    while True:
+        rows = cursor.fetchmany(STREAM_BATCH)
+        if not rows:
+            break
+        for row in rows:
+            for i, name in exported:
+                value = row[i]
+                if name == "dt_ms":
+                    current = epoch_ms(value)
+                    value = current - previous
+                    previous = current
+                else:
+                    value = to_number(value)
+                columns[name].append(value)
+
+    # The archive needs every column before it can be written
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, values in columns.items():
+            archive.writestr(name + ".npy", column_npy(values))
+    yield buffer.getvalue()
+
+
+# Streamed formats of GET /<measure>?format=...: content type and serializer of an executed cursor
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", lambda cursor: stream_json(cursor, True)),
+    "csv": ("text/csv", stream_csv),
+    "npz": ("application/octet-stream", stream_npz)
+}
@@ -0,0 +1,286 @@
+import datetime
+import queue
+import threading
+import time
+
+from mysql.connector import errors
+
+from db_pool import PoolTimeout
+from rollups import update_rollups
+
+# Tables of the measures that keep their own table (windows and ventilation hold states)
+TABLES = {
+    "aqi": "air_quality_index",
+    "windows": "windows",
+    "ventilation": "ventilation"
+}
+# Columns of every table written by the pipeline
+TABLE_COLUMNS = {
+    "air_quality_index": ("building", "floor", "room", "value", "timestamp"),
+    "windows": ("building", "floor", "room", "value", "timestamp"),
+    "ventilation": ("building", "floor", "room", "value", "timestamp"),
+    "measurements": ("building", "floor", "room", "name", "value", "timestamp")
+}
+
+
+def utc_datetime(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch)
+
+
+def is_transient(error):
+    """Whether a failed write may succeed later: the database is down, slow or the connection was lost."""
+    return isinstance(error, (PoolTimeout, errors.InterfaceError, errors.OperationalError))
+
+
+class IngestPipeline:
+    """
+    Buffers the measurements received over MQTT and writes them in batches.
+    The rows of each message wait in a bounded queue (queueSize messages) and are flushed by
+    a single writer thread, as one executemany per table and one commit per batch, when
+    batchSize rows are waiting or flushInterval seconds after the first message of the batch.
+    When the queue is full, submit() blocks the MQTT thread for up to blockTimeout seconds
+    (the broker then slows down the delivery) and drops the message after that; offer() only
+    queues what fits, for callers that must not block. A batch the
+    database rejects is written again one message at a time, dropping only the invalid ones.
+
+    With a spool (see IngestSpool), nothing is dropped or blocked on MySQL: a full queue
+    overflows to the spool, and so do the batches that failed because the database is
+    unavailable, after which the batches go straight to the spool for retryInterval seconds.
+    The writer thread drains the spool in batches of drainBatchSize rows between the live
+    batches while MySQL accepts them, including what was left in it before a restart.
+    """
+
+    def __init__(self, pool, settings=None, spool=None):
+        settings = settings or {}
+        self.pool = pool
+        self.spool = spool
+        self.batch_size = settings.get("batchSize", 500)
+        self.flush_interval = settings.get("flushInterval", 1.0)
+        self.block_timeout = settings.get("blockTimeout", 0.5)
+        self.drain_batch_size = settings.get("drainBatchSize", 5000)
+        self.retry_interval = settings.get("retryInterval", 5)
+        # Until then the database is considered unavailable and batches are spooled
+        self.unavailable_until = 0
+        self.queue = queue.Queue(maxsize=settings.get("queueSize", 10000))
+
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "inserted": 0,
+            "dropped": 0,
+            "failed": 0,
+            "blocked": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "flushes": 0,
+            "maxQueueDepth": 0,
+            "lastBatchSize": 0,
+            "lastFlushSeconds": 0.0,
+            "maxFlushSeconds": 0.0,
+            "totalFlushSeconds": 0.0,
+            "maxDelaySeconds": 0.0
+        }
+
+        self.thread_stop = threading.Event()
+        self.writer_thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.writer_thread.start()
+
+    def stop(self):
+        """Stop the writer thread after it flushed the rows still queued."""
+        self.thread_stop.set()
+        self.writer_thread.join()
+
+    def count(self, **increments):
+        with self.stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def offer(self, table, rows):
+        """Queue the rows of one message only if the queue has room, returns False otherwise."""
+        if not rows:
+            return True
+        try:
+            self.queue.put_nowait((time.time(), table, rows))
+        except queue.Full:
+            return False
+        self.count_received(len(rows))
+        return True
+
+    def submit(self, table, rows):
+        """Queue the rows of one message for a table, returns False if they were dropped."""
+        if self.offer(table, rows):
+            return True
+        item = (time.time(), table, rows)
+        if self.spool is not None:
+            self.spool.append([item])
+            self.count(received=len(rows), spooled=len(rows))
+            return True
+        self.count(blocked=1)
+        try:
+            self.queue.put(item, timeout=self.block_timeout)
+        except queue.Full:
+            self.count(dropped=len(rows))
+            return False
+        self.count_received(len(rows))
+        return True
+
+    def count_received(self, n_rows):
+        depth = self.queue.qsize()
+        with self.stats_lock:
+            self.stats["received"] += n_rows
+            self.stats["maxQueueDepth"] = max(self.stats["maxQueueDepth"], depth)
+
+    def next_batch(self):
+        """Wait for the first message, then collect messages until the batch is full or flushInterval elapsed."""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        n_rows = len(batch[0][2])
+        deadline = time.time() + self.flush_interval
+        while n_rows < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0 or self.thread_stop.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            n_rows += len(batch[-1][2])
+        return batch
+
+    def write(self, batch):
+        """Insert a batch in one transaction."""
+        rows_by_table = {}
+        for _, table, rows in batch:
+            rows_by_table.setdefault(table, []).extend(rows)
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            try:
+                for table, rows in rows_by_table.items():
+                    columns = TABLE_COLUMNS[table]
+                    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+                    # mysql.connector turns this into a single multi-row INSERT
+                    cursor.executemany(query, rows)
+                # The rollups are updated in the same transaction as the raw rows
+                if "measurements" in rows_by_table:
+                    update_rollups(cursor, rows_by_table["measurements"])
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def write_each(self, batch):
+        """
+        Insert a batch the database rejected one message at a time, so that only the messages
+        with invalid rows (e.g. a floor that is not a number) are lost. Returns the number of
+        rows inserted and failed, and the messages left if the database became unavailable.
+        """
+        inserted = failed = 0
+        for i, item in enumerate(batch):
+            try:
+                self.write([item])
+            except Exception as e:
+                if is_transient(e):
+                    return inserted, failed, batch[i:]
+                print(f"Error inserting {len(item[2])} measurements in {item[1]}: {e}", flush=True)
+                failed += len(item[2])
+                continue
+            inserted += len(item[2])
+        return inserted, failed, []
+
+    def unavailable(self, batch, error):
+        """Spool a batch that failed because the database is unavailable, or drop it without spool."""
+        n_rows = sum(len(rows) for _, _, rows in batch)
+        if self.spool is None:
+            print(f"Error inserting {n_rows} measurements: {error}", flush=True)
+            self.count(failed=n_rows)
+            return
+        print(f"Database unavailable ({error}), spooling {n_rows} measurements", flush=True)
+        self.unavailable_until = time.time() + self.retry_interval
+        self.spool.append(batch)
+        self.count(spooled=n_rows)
+
+    def flush(self, batch):
+        start = time.time()
+        n_rows = sum(len(rows) for _, _, rows in batch)
+        if self.spool is not None and start < self.unavailable_until:
+            self.spool.append(batch)
+            self.count(spooled=n_rows)
+            return
+        try:
+            self.write(batch)
+        except Exception as e:
+            if is_transient(e):
+                self.unavailable(batch, e)
+                return
+            print(f"Error inserting {n_rows} measurements, retrying them one message at a time: {e}", flush=True)
+            n_rows, failed, left = self.write_each(batch)
+            self.count(failed=failed)
+            if left:
+                self.unavailable(left, "connection lost during the retries")
+            if not n_rows:
+                return
+        end = time.time()
+        with self.stats_lock:
+            self.stats["inserted"] += n_rows
+            self.stats["flushes"] += 1
+            self.stats["lastBatchSize"] = n_rows
+            self.stats["lastFlushSeconds"] = end - start
+            self.stats["maxFlushSeconds"] = max(self.stats["maxFlushSeconds"], end - start)
+            self.stats["totalFlushSeconds"] += end - start
+            # Time spent by the oldest row between its reception and the commit
+            self.stats["maxDelaySeconds"] = max(self.stats["maxDelaySeconds"], end - batch[0][0])
+
+    def drain(self):
+        """Write the oldest drainBatchSize rows of the spool to MySQL, if it is available."""
+        if time.time() < self.unavailable_until:
+            return
+        last_seq, batch = self.spool.peek(self.drain_batch_size)
+        if not batch:
+            return
+        n_rows = sum(len(rows) for _, _, rows in batch)
+        try:
+            self.write(batch)
+        except Exception as e:
+            if is_transient(e):
+                self.unavailable_until = time.time() + self.retry_interval
+                return
+            # Rows the database rejects would block the spool forever: discard only them
+            print(f"Error replaying {n_rows} spooled measurements, retrying them one message at a time: {e}", flush=True)
+            n_rows, failed, left = self.write_each(batch)
+            if left:
+                # Appended before the removal, so a crash in between cannot lose them
+                self.unavailable_until = time.time() + self.retry_interval
+                self.spool.append(left)
+            self.spool.remove(last_seq)
+            self.count(inserted=n_rows, replayed=n_rows, failed=failed)
+            return
+        self.spool.remove(last_seq)
+        self.count(inserted=n_rows, replayed=n_rows)
+
+    def run(self):
+        if self.spool is not None:
+            spooled = self.spool.depth()
+            if spooled["spoolMessages"]:
+                print(f"Replaying {spooled['spoolRows']} spooled measurements", flush=True)
+        while not self.thread_stop.is_set() or not self.queue.empty():
+            batch = self.next_batch()
+            if batch:
+                self.flush(batch)
+            if self.spool is not None and not self.thread_stop.is_set():
+                self.drain()
+
+    def metrics(self):
+        with self.stats_lock:
+            metrics = dict(self.stats)
+        metrics["queueDepth"] = self.queue.qsize()
+        metrics["queueSize"] = self.queue.maxsize
+        metrics["avgFlushSeconds"] = metrics["totalFlushSeconds"] / metrics["flushes"] if metrics["flushes"] else 0.0
+        if self.spool is not None:
+            metrics.update(self.spool.depth())
+        return metrics
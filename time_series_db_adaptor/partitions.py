@@ -0,0 +1,106 @@
+import datetime
+import re
+import threading
+
+from ingest import TABLE_COLUMNS
+
+# Daily partitions are named after their day, the last one catches everything after them
+DAY_PARTITION = re.compile(r"^p(\d{8})$")
+FUTURE_PARTITION = "p_future"
+
+
+class PartitionManager:
+    """
+    Maintains the daily partitions of the time series tables.
+    Every checkInterval seconds it splits the partitions of the next precreateDays days out
+    of p_future, so that rows never pile up in it, and drops the partitions older than
+    retentionDays. Dropping a partition is instant, unlike a DELETE of the old rows.
+    The rollup tables are small and not partitioned: their old rows are deleted after the
+    retention of rollupRetentionDays, the ones missing from it are kept forever.
+    """
+
+    def __init__(self, pool, settings=None):
+        settings = settings or {}
+        self.pool = pool
+        self.retention_days = settings.get("retentionDays", 90)
+        self.precreate_days = settings.get("precreateDays", 7)
+        self.check_interval = settings.get("checkInterval", 3600)
+        self.rollup_retention_days = settings.get("rollupRetentionDays", {"rollup_1m": 30, "rollup_1h": 730})
+        self.thread_stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.thread_stop.set()
+
+    @staticmethod
+    def day_partitions(cursor, table):
+        """Days of the daily partitions of a table, oldest first."""
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL",
+            (table,)
+        )
+        days = []
+        for (name,) in cursor.fetchall():
+            match = DAY_PARTITION.match(name)
+            if match:
+                days.append(datetime.datetime.strptime(match.group(1), "%Y%m%d").date())
+        return sorted(days)
+
+    def create_partitions(self, cursor, table, days, today):
+        """Split the partitions of the next days out of p_future. Only days after the last partition can be added."""
+        last = days[-1] if days else None
+        new_days = [
+            today + datetime.timedelta(days=i) for i in range(self.precreate_days + 1)
+            if last is None or today + datetime.timedelta(days=i) > last
+        ]
+        if not new_days:
+            return
+        definitions = ", ".join(
+            f"PARTITION p{day:%Y%m%d} VALUES LESS THAN (TO_DAYS('{day + datetime.timedelta(days=1)}'))"
+            for day in new_days
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} REORGANIZE PARTITION {FUTURE_PARTITION} INTO "
+            f"({definitions}, PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+        )
+        print(f"Created {len(new_days)} partitions of {table} up to {new_days[-1]}", flush=True)
+
+    def drop_partitions(self, cursor, table, days, today):
+        cutoff = today - datetime.timedelta(days=self.retention_days)
+        expired = [day for day in days if day < cutoff]
+        if not expired:
+            return
+        cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(f'p{day:%Y%m%d}' for day in expired)}")
+        print(f"Dropped {len(expired)} partitions of {table} older than {cutoff}", flush=True)
+
+    def delete_old_rollups(self, cursor, today):
+        for table, days in self.rollup_retention_days.items():
+            cutoff = today - datetime.timedelta(days=days)
+            cursor.execute(f"DELETE FROM {table} WHERE timestamp < %s", (cutoff,))
+            if cursor.rowcount:
+                print(f"Deleted {cursor.rowcount} rows of {table} older than {cutoff}", flush=True)
+
+    def maintain(self):
+        today = datetime.datetime.utcnow().date()
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            try:
+                for table in TABLE_COLUMNS:
+                    days = self.day_partitions(cursor, table)
+                    self.create_partitions(cursor, table, days, today)
+                    self.drop_partitions(cursor, table, days, today)
+                self.delete_old_rollups(cursor, today)
+            finally:
+                cursor.close()
+
+    def run(self):
+        while not self.thread_stop.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"Error maintaining the partitions: {e}", flush=True)
+            self.thread_stop.wait(self.check_interval)
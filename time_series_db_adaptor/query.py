@@ -0,0 +1,143 @@
+from rollups import pick_rollup
+
+# Builds the SQL of GET /<measure>: filters, ordering, limit and bucketed aggregation all run
+# in the database, so the size of a response does not depend on the history stored.
+
+RANGE_UNITS = {"m": "MINUTE", "h": "HOUR", "d": "DAY", "y": "YEAR"}
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+AGGREGATES = {"avg": "AVG(value)", "min": "MIN(value)", "max": "MAX(value)", "count": "COUNT(*)"}
+# Tables with numeric values, the other ones hold states and can only be counted
+NUMERIC_TABLES = ("air_quality_index", "measurements")
+# Aggregates computed from the rollup columns. MySQL sums integers as DECIMAL, cast back to an integer.
+ROLLUP_AGGREGATES = {
+    "avg": "SUM(total) / SUM(samples)",
+    "min": "MIN(min_value)",
+    "max": "MAX(max_value)",
+    "count": "CAST(SUM(samples) AS SIGNED)"
+}
+
+
+class QueryError(ValueError):
+    """Invalid query parameter."""
+
+
+def parse_duration(text, units):
+    """Split a duration such as '5m' into (5, units['m'])."""
+    if not text or text[-1] not in units:
+        raise QueryError(f"Invalid duration '{text}', the unit must be one of {', '.join(units)}")
+    try:
+        value = int(text[:-1])
+    except ValueError:
+        raise QueryError(f"Invalid duration '{text}'")
+    if value <= 0:
+        raise QueryError(f"Invalid duration '{text}'")
+    return value, units[text[-1]]
+
+
+def series_columns(table):
+    """Columns identifying a time series of a table."""
+    return ["building", "floor", "room"] + (["name"] if table == "measurements" else [])
+
+
+def where_clause(table, params, conditions=None, args=None):
+    """WHERE clause and its arguments for the room, pollutant and time range filters."""
+    conditions = list(conditions or [])
+    args = list(args or [])
+    for column in series_columns(table):
+        if params.get(column):
+            conditions.append(f"{column} = %s")
+            args.append(params[column])
+    if params.get("range"):
+        value, unit = parse_duration(params["range"], RANGE_UNITS)
+        conditions.append(f"timestamp >= NOW() - INTERVAL %s {unit}")
+        args.append(value)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", args
+
+
+def parse_limit(params):
+    if params.get("latest", "").lower() in ("1", "true", "yes"):
+        return 1
+    if "limit" not in params:
+        return None
+    try:
+        limit = int(params["limit"])
+    except ValueError:
+        raise QueryError("'limit' must be an integer")
+    if limit <= 0:
+        raise QueryError("'limit' must be positive")
+    return limit
+
+
+def parse_order(params):
+    # latest=true is the last row: newest first, limit 1
+    if params.get("latest", "").lower() in ("1", "true", "yes"):
+        return "DESC"
+    order = params.get("order", "asc").lower()
+    if order not in ("asc", "desc"):
+        raise QueryError("'order' must be asc or desc")
+    return order.upper()
+
+
+def bucket_query(series, select_series, aggregate, source, where, order):
+    """Aggregate per series and time bucket: bucket number in the inner query, its start time in the outer one."""
+    return (
+        f"SELECT {series}, FROM_UNIXTIME(bucket * %s) AS timestamp, value FROM ("
+        f"SELECT {select_series}, FLOOR(UNIX_TIMESTAMP(timestamp) / %s) AS bucket, {aggregate} AS value"
+        f" FROM {source}{where} GROUP BY {series}, bucket"
+        f") AS buckets ORDER BY timestamp {order}"
+    )
+
+
+def rollup_query(table, params, seconds, agg, order):
+    """
+    Bucketed query planned on the coarsest rollup table whose resolution divides the bucket.
+    The range starts at the first whole rollup bucket after NOW() - range.
+    """
+    rollup = pick_rollup(seconds)
+    if rollup is None or table not in NUMERIC_TABLES:
+        return None
+    if table == "measurements":
+        measure = [("measure = %s", params["name"])] if params.get("name") else []
+        series, select_series = "building, floor, room, name", "building, floor, room, measure AS name"
+    else:
+        measure = [("measure = %s", "aqi")]
+        series = select_series = "building, floor, room"
+    where, args = where_clause("rollup", params, [c for c, _ in measure], [a for _, a in measure])
+    sql = bucket_query(series, select_series, ROLLUP_AGGREGATES[agg], rollup, where, order)
+    return sql, [seconds, seconds] + args
+
+
+def build_query(table, params):
+    """
+    (sql, args) of a query on a table. Supported parameters:
+    building, floor, room, name (measurements only), range, order, limit, latest,
+    bucket with agg (e.g. bucket=5m&agg=avg).
+    """
+    where, args = where_clause(table, params)
+    order = parse_order(params)
+    limit = parse_limit(params)
+
+    if "bucket" in params or "agg" in params:
+        if not params.get("bucket"):
+            raise QueryError("'bucket' is required with 'agg'")
+        seconds, unit_seconds = parse_duration(params.get("bucket"), BUCKET_UNITS)
+        seconds *= unit_seconds
+        agg = params.get("agg", "avg")
+        if agg not in AGGREGATES:
+            raise QueryError(f"'agg' must be one of {', '.join(AGGREGATES)}")
+        if agg != "count" and table not in NUMERIC_TABLES:
+            raise QueryError(f"Only agg=count is supported on {table}")
+        planned = rollup_query(table, params, seconds, agg, order)
+        if planned is not None:
+            sql, args = planned
+        else:
+            series = ", ".join(series_columns(table))
+            sql = bucket_query(series, series, AGGREGATES[agg], table, where, order)
+            args = [seconds, seconds] + args
+    else:
+        sql = f"SELECT * FROM {table}{where} ORDER BY timestamp {order}"
+
+    if limit is not None:
+        sql += " LIMIT %s"
+        args.append(limit)
+    return sql, args
@@ -0,0 +1,54 @@
+import datetime
+
+# Pre-aggregated copies of the measurements table, by resolution in seconds, coarsest last.
+# Each row holds the count, sum, min and max of one measure of one room over one bucket,
+# so buckets can be merged into any coarser one.
+ROLLUPS = {
+    "rollup_1m": 60,
+    "rollup_1h": 3600,
+    "rollup_1d": 86400
+}
+ROLLUP_COLUMNS = ("measure", "building", "floor", "room", "timestamp", "samples", "total", "min_value", "max_value")
+
+# Merges a batch into the existing buckets. mysql.connector sends executemany as one multi-row statement.
+UPSERT_SQL = (
+    "INSERT INTO {table} (" + ", ".join(ROLLUP_COLUMNS) + ") VALUES (" + ", ".join(["%s"] * len(ROLLUP_COLUMNS)) + ")"
+    " ON DUPLICATE KEY UPDATE samples = samples + VALUES(samples), total = total + VALUES(total),"
+    " min_value = LEAST(min_value, VALUES(min_value)), max_value = GREATEST(max_value, VALUES(max_value))"
+)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def bucket_start(timestamp, seconds):
+    """Start of the bucket of a naive UTC datetime."""
+    elapsed = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=elapsed - elapsed % seconds)
+
+
+def rollup_rows(measurements, seconds):
+    """Aggregate rows of the measurements table (building, floor, room, name, value, timestamp) per bucket."""
+    buckets = {}
+    for building, floor, room, name, value, timestamp in measurements:
+        key = (name, building, floor, room, bucket_start(timestamp, seconds))
+        aggregate = buckets.get(key)
+        if aggregate is None:
+            buckets[key] = [1, value, value, value]
+        else:
+            aggregate[0] += 1
+            aggregate[1] += value
+            aggregate[2] = min(aggregate[2], value)
+            aggregate[3] = max(aggregate[3], value)
+    return [key + tuple(aggregate) for key, aggregate in buckets.items()]
+
+
+def update_rollups(cursor, measurements):
+    """Add new rows of the measurements table to every rollup, in the caller's transaction."""
+    for table, seconds in ROLLUPS.items():
+        cursor.executemany(UPSERT_SQL.format(table=table), rollup_rows(measurements, seconds))
+
+
+def pick_rollup(bucket_seconds):
+    """Coarsest rollup whose buckets fit exactly in buckets of bucket_seconds, or None."""
+    fitting = [table for table, seconds in ROLLUPS.items() if bucket_seconds % seconds == 0]
+    return fitting[-1] if fitting else None
@@ -0,0 +1,84 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    received REAL NOT NULL,
+    table_name TEXT NOT NULL,
+    n_rows INTEGER NOT NULL,
+    rows BLOB NOT NULL
+);
+"""
+
+APPEND_SQL = "INSERT INTO spool (received, table_name, n_rows, rows) VALUES (?, ?, ?, ?)"
+
+
+class IngestSpool:
+    """
+    Disk-backed queue of the messages that could not be written to MySQL, in a SQLite file.
+    Items are the (received, table, rows) of the ingest pipeline, read back oldest first and
+    removed once committed to MySQL, so that they survive a restart of the adaptor.
+    The file is in WAL mode with synchronous=NORMAL: an append is a single small write,
+    whatever the latency of MySQL.
+    """
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.path = settings.get("path", "spool/ingest.db")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={settings.get('synchronous', 'NORMAL')}")
+        self.conn.executescript(SCHEMA)
+
+    def append(self, items):
+        """Store items in one transaction."""
+        with self.lock, self.conn:
+            self.conn.executemany(APPEND_SQL, (
+                (received, table, len(rows), pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL))
+                for received, table, rows in items
+            ))
+
+    def peek(self, max_rows):
+        """(last seq, items) of the oldest items up to max_rows rows, at least one if the spool is not empty."""
+        items = []
+        last_seq = None
+        n_rows = 0
+        with self.lock:
+            cursor = self.conn.execute("SELECT seq, received, table_name, n_rows, rows FROM spool ORDER BY seq")
+            try:
+                for seq, received, table, count, rows in cursor:
+                    if items and n_rows + count > max_rows:
+                        break
+                    items.append((received, table, pickle.loads(rows)))
+                    last_seq = seq
+                    n_rows += count
+            finally:
+                cursor.close()
+        return last_seq, items
+
+    def remove(self, last_seq):
+        """Remove the items up to last_seq, once they are written to MySQL."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM spool WHERE seq <= ?", (last_seq,))
+
+    def depth(self):
+        """Messages and rows in the spool, and the age in seconds of the oldest one."""
+        with self.lock:
+            messages, rows, oldest = self.conn.execute("SELECT COUNT(*), SUM(n_rows), MIN(received) FROM spool").fetchone()
+        return {
+            "spoolMessages": messages,
+            "spoolRows": rows or 0,
+            "spoolAgeSeconds": time.time() - oldest if oldest is not None else 0.0
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()